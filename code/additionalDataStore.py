@@ -0,0 +1,170 @@
+import os
+import json
+import pickle
+import shutil
+import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import helpFunctions
+
+#store of the additional data (see createAdditionalDataSets.py) as a folder with one parquet file per table and a
+#manifest.json with the schema, size and checksum of each table and the provenance of the data
+#the tables are only read when they are used, so a build does not load the tables it does not need, and a table can be
+#read partially by its columns, row groups or a filter on its values
+#the legacy pickles (<timestamp>_df.pkl) with a dict of all tables can still be opened and converted with convertPickle
+
+#version of the layout of the store
+additional_data_store_version = 1
+
+manifest_file_name = 'manifest.json'
+
+#number of rows of the row groups of the parquet files
+row_group_size = 10000
+
+def isStore(path):
+    return os.path.isdir(path)
+
+def manifestPath(path):
+    return os.path.join(path, manifest_file_name)
+
+def hashPath(path):
+    #the file whose hash identifies the additional data, the manifest has the checksums of all tables of a store
+    if isStore(path):
+        return manifestPath(path)
+    return path
+
+def selectsNothing(filters):
+    #whether the conjunction filters has a condition ('in', []), which pyarrow cannot bind to the column type
+    return filters is not None and any(op == 'in' and len(values) == 0 for _, op, values in filters)
+
+def tableSchema(df):
+    #the columns of df with their pandas and arrow types
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    return [
+        {'name':str(column), 'dtype':str(df[column].dtype), 'type':str(schema.field(str(column)).type)}
+        for column in df.columns
+    ]
+
+def saveAdditionalData(tables, folder, provenance=None, sources=None):
+    #write the data frames of the dict tables to folder, provenance is stored in the manifest as it is (e.g. the
+    #endpoints and the times of the requests) and sources maps the names of the tables to a description of their source
+    manifest = {
+        'version':additional_data_store_version,
+        'created':datetime.datetime.now().isoformat(),
+        'provenance':provenance or {},
+        'tables':{}
+    }
+
+    if os.path.exists(folder + '.tmp'):
+        shutil.rmtree(folder + '.tmp')
+    os.makedirs(folder + '.tmp')
+    for name, df in tables.items():
+        file_name = name + '.parquet'
+        path = os.path.join(folder + '.tmp', file_name)
+        #the index is kept, the tables are filtered frames whose index is part of the pickled data
+        df.to_parquet(path, engine='pyarrow', index=True, row_group_size=row_group_size)
+        manifest['tables'][name] = {
+            'file':file_name,
+            'rows':len(df),
+            'row_groups':pq.ParquetFile(path).num_row_groups,
+            'columns':tableSchema(df),
+            'sha256':helpFunctions.fileHash(path),
+            'source':(sources or {}).get(name)
+        }
+
+    #the manifest is written last, a folder without manifest is incomplete
+    with open(manifestPath(folder + '.tmp'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, default=str)
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.replace(folder + '.tmp', folder)
+
+class AdditionalDataStore:
+    #read access to the tables of a store, store[name] reads a whole table once and keeps it,
+    #store.read(name, ...) reads the selected part of a table every time it is called
+    def __init__(self, folder):
+        self.folder = folder
+        with open(manifestPath(folder)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest['version'] != additional_data_store_version:
+            raise ValueError(folder + ' has the store version ' + str(self.manifest['version']))
+        self.tables = {}
+
+    def keys(self):
+        return list(self.manifest['tables'])
+
+    def __contains__(self, name):
+        return name in self.manifest['tables']
+
+    def path(self, name):
+        if name not in self:
+            raise KeyError(name + ' is not a table of ' + self.folder)
+        return os.path.join(self.folder, self.manifest['tables'][name]['file'])
+
+    def __getitem__(self, name):
+        if name not in self.tables:
+            self.tables[name] = self.read(name)
+        return self.tables[name]
+
+    def read(self, name, columns=None, row_groups=None, filters=None):
+        #columns is a list of column names, row_groups a list of row group numbers and filters a filter of
+        #pyarrow.parquet.read_table, e.g. [('LEI', 'in', leis)]
+        if selectsNothing(filters):
+            row_groups = []
+            filters = None
+        if row_groups is not None:
+            table = pq.ParquetFile(self.path(name)).read_row_groups(
+                row_groups, columns=columns, use_pandas_metadata=True
+            )
+            if filters is not None:
+                table = table.filter(pq.filters_to_expression(filters))
+        else:
+            table = pq.read_table(self.path(name), columns=columns, filters=filters, use_pandas_metadata=True)
+        return table.to_pandas()
+
+class PickledAdditionalData:
+    #the same interface for a legacy pickle, which can only be read as a whole
+    def __init__(self, path):
+        self.path = path
+        self._tables = None
+
+    @property
+    def tables(self):
+        if self._tables is None:
+            with open(self.path, 'rb') as pickled:
+                self._tables = pickle.load(pickled)
+        return self._tables
+
+    def keys(self):
+        return list(self.tables)
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def read(self, name, columns=None, row_groups=None, filters=None):
+        if row_groups is not None:
+            raise ValueError(self.path + ' is a pickle and has no row groups, convert it with convertPickle')
+        df = self.tables[name]
+        if selectsNothing(filters):
+            df = df.iloc[:0]
+        elif filters is not None:
+            table = pa.Table.from_pandas(df).filter(pq.filters_to_expression(filters))
+            df = table.to_pandas()
+        if columns is not None:
+            df = df[columns]
+        return df
+
+def openAdditionalData(path):
+    #path is the folder of a store or a legacy pickle
+    if isStore(path):
+        return AdditionalDataStore(path)
+    return PickledAdditionalData(path)
+
+def convertPickle(path, folder):
+    #write the tables of the legacy pickle path to the store folder
+    data = PickledAdditionalData(path)
+    saveAdditionalData(data.tables, folder, provenance={'converted_from':os.path.basename(path)})
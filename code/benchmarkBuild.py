@@ -0,0 +1,248 @@
+import os
+import json
+import datetime
+import traceback
+import subprocess
+import multiprocessing
+import pandas as pd
+import rdflib
+
+import helpFunctions
+import graphWriter
+import tripleEmission
+import buildProfiler
+import syntheticData
+
+#benchmarks of the stages of the build on synthetic GLEIF data of different sizes
+#each benchmark runs in its own process, so that the peak memory of one benchmark does not hide the peak
+#memory of the next one, and appends its result together with the current git commit to results_path
+#the memory of a benchmark is the peak during the measured stage above the memory after its setup (e.g. loading the
+#data), a benchmark whose process fails or is killed (e.g. out of memory) is recorded as failed
+
+#specify the folder for the synthetic data, the intermediate files and the results
+benchmark_folder = '../data/benchmark/'
+results_path = benchmark_folder + 'results.jsonl'
+
+#number of entities of the synthetic data sets and the seed of the random generator
+n_entities_list = [10000, 100000, 1000000]
+seed = 0
+
+#names of the benchmarks to run, see the benchmark functions below
+benchmarks = [
+    'loadLEIData', 'createWikidataCityDict', 'createMatchingCityID', 'createMatchingCityIDParallel',
+    'leiTriples', 'auxiliaryTriples', 'relationshipTriples', 'serializeXML'
+]
+
+#the xml output keeps the whole graph in memory, so it is only benchmarked up to this number of entities
+max_entities_xml = 100000
+
+#number of worker processes of the parallel benchmarks
+n_workers = os.cpu_count()
+
+max_distance = 0.3
+
+def syntheticDataFolder(n_entities):
+    return os.path.join(
+        benchmark_folder, 'synthetic_v%d_%d_%d' % (syntheticData.synthetic_data_version, n_entities, seed)
+    )
+
+def loadMatchedLEIData(paths, folder):
+    #load the LEI data with matched cityIDs and company entities, the matches are cached in folder
+    lei_data = helpFunctions.loadLEIData(paths['lei'])
+    wikidataCityDict = helpFunctions.createWikidataCityDict(paths['wikidata_cities'])
+
+    cache_path = os.path.join(folder, 'cityMatches.pkl')
+    cache = helpFunctions.loadCityMatchCache(cache_path)
+    (lei_data['Entity_LegalAddress_CityID'], lei_data['Entity_LegalAddress_CityID_Label'],
+    lei_data['Entity_HeadquartersAddress_CityID'], lei_data['Entity_HeadquartersAddress_CityID_Label']) = (
+        helpFunctions.createMatchingCityID(lei_data, wikidataCityDict, max_distance, cache=cache))
+    helpFunctions.saveCityMatchCache(cache, cache_path)
+
+    company_entities = pd.read_csv(paths['company_entities'], dtype=str)
+    return lei_data.merge(company_entities, how='left', on='LEI')
+
+def benchmarkLoadLEIData(profiler, paths, folder):
+    profiler.start('loadLEIData')
+    lei_data = helpFunctions.loadLEIData(paths['lei'])
+    return profiler.stop(rows_in=len(lei_data))
+
+def benchmarkCreateWikidataCityDict(profiler, paths, folder):
+    profiler.start('createWikidataCityDict')
+    helpFunctions.createWikidataCityDict(paths['wikidata_cities'])
+    return profiler.stop()
+
+def benchmarkCreateMatchingCityID(profiler, paths, folder, workers=1):
+    lei_data = helpFunctions.loadLEIData(paths['lei'])
+    wikidataCityDict = helpFunctions.createWikidataCityDict(paths['wikidata_cities'])
+
+    #the matching starts without cache
+    profiler.start('createMatchingCityID' if workers == 1 else 'createMatchingCityIDParallel')
+    helpFunctions.createMatchingCityID(lei_data, wikidataCityDict, max_distance, n_workers=workers)
+    return profiler.stop(rows_in=len(lei_data))
+
+def benchmarkCreateMatchingCityIDParallel(profiler, paths, folder):
+    return benchmarkCreateMatchingCityID(profiler, paths, folder, workers=n_workers)
+
+def benchmarkTriples(profiler, paths, folder, name, emit, rows):
+    #emit the triples as N-Triples and remove the file afterwards
+    graph_path = os.path.join(folder, name + '.nt')
+    g = graphWriter.NTriplesWriter(graph_path)
+
+    profiler.start(name)
+    emit(g)
+    g.close()
+    stage = profiler.stop(rows_in=rows, triples_out=len(g))
+
+    stage['output_bytes'] = os.path.getsize(graph_path)
+    os.remove(graph_path)
+    return stage
+
+def benchmarkLeiTriples(profiler, paths, folder):
+    lei_data = loadMatchedLEIData(paths, folder)
+    return benchmarkTriples(
+        profiler, paths, folder, 'leiTriples', lambda g: tripleEmission.addLEITriples(g, lei_data), len(lei_data)
+    )
+
+def benchmarkAuxiliaryTriples(profiler, paths, folder):
+    lei_data = loadMatchedLEIData(paths, folder)
+    return benchmarkTriples(
+        profiler, paths, folder, 'auxiliaryTriples',
+        lambda g: tripleEmission.addAuxiliaryTriples(
+            g, tripleEmission.collectAuxiliaryEntities(lei_data, tripleEmission.AuxiliaryEntities())
+        ), len(lei_data)
+    )
+
+def benchmarkRelationshipTriples(profiler, paths, folder):
+    relationship_data = helpFunctions.loadRelationshipData(paths['relationship'])
+    return benchmarkTriples(
+        profiler, paths, folder, 'relationshipTriples',
+        lambda g: tripleEmission.addRelationshipTriples(g, relationship_data), len(relationship_data)
+    )
+
+def benchmarkSerializeXML(profiler, paths, folder):
+    #building the rdflib graph and serializing it as RDF/XML, as in the original build
+    lei_data = loadMatchedLEIData(paths, folder)
+    graph_path = os.path.join(folder, 'serializeXML.xml')
+
+    profiler.start('serializeXML')
+    g = rdflib.Graph(identifier='taxGraph')
+    tripleEmission.addLEITriples(g, lei_data)
+    with open(graph_path, 'wb') as output:
+        g.serialize(destination=output, format='xml')
+    stage = profiler.stop(rows_in=len(lei_data), triples_out=len(g))
+
+    stage['output_bytes'] = os.path.getsize(graph_path)
+    os.remove(graph_path)
+    return stage
+
+benchmark_functions = {
+    'loadLEIData':benchmarkLoadLEIData,
+    'createWikidataCityDict':benchmarkCreateWikidataCityDict,
+    'createMatchingCityID':benchmarkCreateMatchingCityID,
+    'createMatchingCityIDParallel':benchmarkCreateMatchingCityIDParallel,
+    'leiTriples':benchmarkLeiTriples,
+    'auxiliaryTriples':benchmarkAuxiliaryTriples,
+    'relationshipTriples':benchmarkRelationshipTriples,
+    'serializeXML':benchmarkSerializeXML
+}
+
+def runBenchmark(name, paths, folder, connection):
+    #runs in a child process and sends the measured stage or the error to the parent
+    profiler = buildProfiler.BuildProfiler()
+    try:
+        stage = benchmark_functions[name](profiler, paths, folder)
+    except Exception:
+        stage = {'failed':True, 'error':traceback.format_exc()}
+    connection.send(stage)
+    connection.close()
+
+def runInProcess(name, paths, folder):
+    context = multiprocessing.get_context('spawn')
+    parent_connection, child_connection = context.Pipe(duplex=False)
+    process = context.Process(target=runBenchmark, args=(name, paths, folder, child_connection))
+    process.start()
+    child_connection.close()
+    try:
+        stage = parent_connection.recv()
+    except EOFError:
+        #the process has ended without sending its stage, e.g. it crashed or was killed by the out-of-memory killer
+        stage = None
+    process.join()
+
+    if stage is None:
+        #a negative exit code is the number of the signal that killed the process, e.g. -9 for SIGKILL
+        stage = {'failed':True, 'error':'the process exited with code ' + str(process.exitcode)}
+    stage['exitcode'] = process.exitcode
+    return stage
+
+def gitCommit():
+    #the commit of the benchmarked code, marked as dirty if there are uncommitted changes
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+def loadResults(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as results_file:
+        return [json.loads(line) for line in results_file if line.strip()]
+
+def previousResult(results, result):
+    #the latest result of the same benchmark on the same data by another commit
+    for previous in reversed(results):
+        if (previous['benchmark'] == result['benchmark'] and previous['n_entities'] == result['n_entities']
+            and previous['seed'] == result['seed'] and previous['data_version'] == result['data_version']
+            and previous['commit'] != result['commit'] and not previous.get('failed')):
+            return previous
+    return None
+
+if __name__ == '__main__':
+    os.makedirs(benchmark_folder, exist_ok=True)
+    commit = gitCommit()
+    date_and_time = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
+    results = loadResults(results_path)
+
+    for n_entities in n_entities_list:
+        folder = syntheticDataFolder(n_entities)
+        paths = syntheticData.createSyntheticData(folder, n_entities, seed)
+
+        for name in benchmarks:
+            if name == 'serializeXML' and n_entities > max_entities_xml:
+                continue
+
+            stage = runInProcess(name, paths, folder)
+            result = {
+                'benchmark':name,
+                'n_entities':n_entities,
+                'seed':seed,
+                'data_version':syntheticData.synthetic_data_version,
+                'n_workers':n_workers if name == 'createMatchingCityIDParallel' else 1,
+                'commit':commit,
+                'date':date_and_time
+            }
+            result.update(stage)
+
+            if result.get('failed'):
+                print('%s %d entities: failed, %s' % (name, n_entities, result['error'].strip().splitlines()[-1]))
+            else:
+                line = '%s %d entities: %.2fs, memory %+.0f MB (peak %.0f MB)' % (
+                    name, n_entities, result['wall_time_s'], result['stage_peak_rss_delta_mb'],
+                    result['stage_peak_rss_mb']
+                )
+                previous = previousResult(results, result)
+                if previous is not None:
+                    #results of earlier versions have no memory of the stage
+                    line += ' (%+.0f%% time, %s memory compared to %s)' % (
+                        100 * (result['wall_time_s'] / previous['wall_time_s'] - 1),
+                        '%+.0f MB' % (result['stage_peak_rss_delta_mb'] - previous['stage_peak_rss_delta_mb'])
+                        if previous.get('stage_peak_rss_delta_mb') is not None else 'unknown',
+                        previous['commit'][:10] if previous['commit'] is not None else 'unknown commit'
+                    )
+                print(line)
+
+            results.append(result)
+            with open(results_path, 'a') as results_file:
+                results_file.write(json.dumps(result, default=str) + '\n')
@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import io
+import datetime
+import shutil
+import pandas as pd
+
+import helpFunctions
+import compressedSink
+import outOfCore
+
+#increase the version whenever the output of a checkpointed stage changes for the same inputs,
+#so that the checkpoints of older builds are not reused
+checkpoint_version = 2
+
+class CheckpointStore:
+    #stores the outputs of the stages of the build in folder, keyed by the hashes of their inputs and parameters
+    #data frames are stored as parquet files, other outputs (e.g. parts of the graph) as files of the stage
+    #a checkpoint is only valid once its json metadata file has been written, which happens after its output
+    #has been moved into place, so that an interrupted stage never leaves a checkpoint that looks valid
+    #with folder None nothing is stored and every stage is run
+    def __init__(self, folder):
+        self.folder = folder
+        self._file_hashes = None
+        #the sinks of the compressed parts that are being written, by their paths
+        self._part_sinks = {}
+
+    @property
+    def enabled(self):
+        return self.folder is not None
+
+    def fileHash(self, path):
+        #hashing the GLEIF files takes a while, so the hashes are remembered by path, size and modification time
+        if not self.enabled:
+            return helpFunctions.fileHash(path)
+
+        hashes_path = os.path.join(self.folder, 'fileHashes.json')
+        if self._file_hashes is None:
+            if os.path.exists(hashes_path):
+                with open(hashes_path) as f:
+                    self._file_hashes = json.load(f)
+            else:
+                self._file_hashes = {}
+
+        stat = os.stat(path)
+        file_id = '%s:%d:%d' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if file_id not in self._file_hashes:
+            self._file_hashes[file_id] = helpFunctions.fileHash(path)
+
+            os.makedirs(self.folder, exist_ok=True)
+            with open(hashes_path + '.tmp', 'w') as f:
+                json.dump(self._file_hashes, f, indent=2)
+            os.replace(hashes_path + '.tmp', hashes_path)
+
+        return self._file_hashes[file_id]
+
+    def key(self, name, *inputs, **parameters):
+        #inputs are the keys of the checkpoints or the hashes of the files the stage reads
+        #parameters are the settings that change the output of the stage, e.g. max_distance
+        description = json.dumps(
+            [name, checkpoint_version, list(inputs), sorted(parameters.items())], default=str
+        )
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def path(self, name, key, extension):
+        return os.path.join(self.folder, name + '_' + key[:16] + extension)
+
+    def has(self, name, key):
+        return self.enabled and os.path.exists(self.path(name, key, '.json'))
+
+    def metadata(self, name, key):
+        with open(self.path(name, key, '.json')) as f:
+            return json.load(f)
+
+    def _commit(self, name, key, metadata):
+        metadata = dict(metadata, stage=name, key=key, created=datetime.datetime.now().isoformat())
+        meta_path = self.path(name, key, '.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=2, default=str)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def loadFrame(self, name, key, columns=None):
+        return pd.read_parquet(self.path(name, key, '.parquet'), columns=columns)
+
+    def saveFrame(self, df, name, key, **metadata):
+        if not self.enabled:
+            return
+
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(name, key, '.parquet')
+        df.to_parquet(path + '.tmp', engine='pyarrow', index=True)
+        os.replace(path + '.tmp', path)
+        self._commit(name, key, dict(metadata, rows=len(df)))
+
+    def loadChunks(self, name, key, columns=None):
+        #yield the row groups of a stored data frame as data frames, e.g. of a data frame stored with saveChunks
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(self.path(name, key, '.parquet'))
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i, columns=columns).to_pandas()
+
+    def saveChunks(self, chunks, name, key, **metadata):
+        #store the data frames of chunks with the same columns as row groups of one data frame without holding them
+        #in memory at once, returns the number of rows
+        if not self.enabled:
+            return sum(len(chunk) for chunk in chunks)
+
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(name, key, '.parquet')
+        rows = outOfCore.writeParquetChunks(chunks, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self._commit(name, key, dict(metadata, rows=rows))
+        return rows
+
+    def frameColumns(self, name, key):
+        import pyarrow.parquet as pq
+        return pq.read_schema(self.path(name, key, '.parquet')).names
+
+    def partPath(self, name, key, extension):
+        #the path to write a file output of a stage to, the file is committed with commitPart
+        os.makedirs(self.folder, exist_ok=True)
+        return self.path(name, key, extension) + '.tmp'
+
+    def openPart(self, name, key, extension, compression=None, n_threads=None):
+        #a binary file to write a file output of a stage to, which is compressed while it is written if compression
+        #is given, the file is committed with commitPart after it has been closed
+        path = self.partPath(name, key, extension)
+        if compression is None:
+            return open(path, 'wb', buffering=2**20)
+        sink = compressedSink.CompressedSink(path, compression, n_threads=n_threads, manifest=False)
+        self._part_sinks[path] = sink
+        return io.BufferedWriter(sink, 2**20)
+
+    def commitPart(self, name, key, extension, **metadata):
+        path = self.path(name, key, extension)
+        #the compressed blocks of the part are listed in its metadata, so that copyParts can append them
+        sink = self._part_sinks.pop(path + '.tmp', None)
+        if sink is not None:
+            metadata['blocks'] = sink.blocks
+        os.replace(path + '.tmp', path)
+        self._commit(name, key, metadata)
+
+    def copyParts(self, parts, destination, buffer_size=2**24):
+        #concatenate the committed file outputs parts, a list of (name, key, extension), into destination,
+        #which is a path or a binary file
+        #compressed parts are appended block by block to destination, which is a file of compressedSink.openSink
+        #with the same compression, without decompressing them
+        if isinstance(destination, str):
+            with open(destination, 'wb') as output:
+                self.copyParts(parts, output, buffer_size)
+            return
+
+        for name, key, extension in parts:
+            blocks = self.metadata(name, key).get('blocks')
+            with open(self.path(name, key, extension), 'rb') as part:
+                if blocks is None:
+                    shutil.copyfileobj(part, destination, buffer_size)
+                else:
+                    compressedSink.copyBlocks(part, blocks, destination)
+
+def saveBuildState(path, state):
+    #the state of a build lists the checkpoints of its lei data, relationship data and graph parts,
+    #from which later builds can be updated incrementally (see updateRDF.py)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(path + '.tmp', path)
+
+def loadBuildState(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,149 @@
+import time
+import json
+import os
+import sys
+import resource
+import threading
+import cProfile
+import datetime
+
+def peakRSS(who=resource.RUSAGE_SELF):
+    #peak resident set size in MB, ru_maxrss is given in KB on linux and in bytes on macOS
+    max_rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss / 2**20
+    return max_rss / 2**10
+
+def currentRSS():
+    #current resident set size in MB read from /proc, None on systems without /proc (e.g. macOS)
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+class RSSSampler:
+    #samples the current resident set size every interval seconds in a thread and keeps the maximum,
+    #ru_maxrss only has the peak of the whole process, which hides the peak of a stage below the peak of an earlier one
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.max_rss = currentRSS()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.max_rss is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.max_rss = max(self.max_rss, currentRSS())
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.max_rss = max(self.max_rss, currentRSS())
+        return self.max_rss
+
+def cpuTime():
+    #user and system time of this process and of all finished child processes (e.g. pool workers)
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+class BuildProfiler:
+    #records the wall time, cpu time, peak memory, rows in and triples out of the named stages of a build
+    #the peak memory of a stage is the maximum of the sampled resident set size of the build process during the stage,
+    #the cumulative peaks are the peaks of the process and of its finished child processes up to the end of the stage
+    #stages are measured between start(name) and stop(), so that the sections of a script need no reindenting
+    #the stages in profile_stages are additionally profiled with cProfile and dumped to profile_folder
+    #stage_hook can be a function that takes the stage name and returns a context manager,
+    #which is entered for the duration of the stage, e.g. to attach a sampling profiler
+    def __init__(self, profile_folder=None, profile_stages=(), stage_hook=None):
+        self.profile_folder = profile_folder
+        self.profile_stages = profile_stages
+        self.stage_hook = stage_hook
+
+        self.stages = []
+        self._current = None
+        self._start_time = datetime.datetime.now()
+
+    def start(self, name):
+        if self._current is not None:
+            self.stop()
+
+        current = {
+            'name':name,
+            'wall_start':time.perf_counter(),
+            'cpu_start':cpuTime(),
+            'rss_start':currentRSS(),
+            'peak_rss_start':peakRSS(),
+            'sampler':RSSSampler()
+        }
+
+        if self.stage_hook is not None:
+            current['hook'] = self.stage_hook(name)
+            current['hook'].__enter__()
+
+        if name in self.profile_stages:
+            current['profile'] = cProfile.Profile()
+            current['profile'].enable()
+
+        self._current = current
+
+    def stop(self, rows_in=None, triples_out=None):
+        current = self._current
+        self._current = None
+
+        if 'profile' in current:
+            current['profile'].disable()
+            os.makedirs(self.profile_folder, exist_ok=True)
+            current['profile'].dump_stats(os.path.join(self.profile_folder, current['name'] + '.prof'))
+
+        if 'hook' in current:
+            current['hook'].__exit__(None, None, None)
+
+        wall_time = time.perf_counter() - current['wall_start']
+        stage_peak_rss = current['sampler'].stop()
+        peak_rss = peakRSS()
+        if peak_rss > current['peak_rss_start']:
+            #the stage has raised the peak of the process, so ru_maxrss is its exact peak, also between the samples
+            stage_peak_rss = peak_rss if stage_peak_rss is None else max(stage_peak_rss, peak_rss)
+
+        stage = {
+            'name':current['name'],
+            'wall_time_s':wall_time,
+            'cpu_time_s':cpuTime() - current['cpu_start'],
+            'rss_start_mb':current['rss_start'],
+            'stage_peak_rss_mb':stage_peak_rss,
+            'stage_peak_rss_delta_mb':(
+                stage_peak_rss - current['rss_start']
+                if stage_peak_rss is not None and current['rss_start'] is not None else None
+            ),
+            'cumulative_peak_rss_mb':peak_rss,
+            'cumulative_children_peak_rss_mb':peakRSS(resource.RUSAGE_CHILDREN),
+            'rows_in':rows_in,
+            'triples_out':triples_out,
+            'triples_per_s':triples_out / wall_time if triples_out is not None and wall_time > 0 else None
+        }
+        self.stages.append(stage)
+
+        print(stage['name'] + ' finished in ' + '%.1f' % wall_time + 's')
+        return stage
+
+    def report(self):
+        return {
+            'start':self._start_time.isoformat(),
+            'wall_time_s':sum(stage['wall_time_s'] for stage in self.stages),
+            'cpu_time_s':sum(stage['cpu_time_s'] for stage in self.stages),
+            'peak_rss_mb':peakRSS(),
+            'triples_out':sum(stage['triples_out'] or 0 for stage in self.stages),
+            'stages':self.stages
+        }
+
+    def saveReport(self, path, **extra):
+        #extra entries (e.g. cache statistics) are added to the top level of the report
+        report = self.report()
+        report.update(extra)
+
+        with open(path, 'w') as output:
+            json.dump(report, output, indent=2, default=str)
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import hashlib
+import concurrent.futures
+import requests
+
+#requests of remote data with timeouts, bounded retries and an on-disk cache of the raw responses
+#a response is cached under a hash of its url, query parameters and requested format (the Accept header) and is
+#reused until it is older than the ttl
+#in offline mode the cached responses are replayed regardless of their age and no request is sent
+
+#http status codes of failed requests that are worth retrying
+retry_status_codes = [429, 500, 502, 503, 504]
+
+class ResponseCache:
+    def __init__(self, folder, ttl=7*24*3600, offline=False):
+        self.folder = folder
+        self.ttl = ttl
+        self.offline = offline
+        #the metadata of the responses that were fetched or read from the cache, as provenance of the data
+        self.responses = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, url, params, accept=None):
+        return hashlib.sha256(
+            json.dumps([url, [list(param) for param in params], accept]).encode('utf-8')
+        ).hexdigest()
+
+    def bodyPath(self, key):
+        return os.path.join(self.folder, key + '.body')
+
+    def metadataPath(self, key):
+        return os.path.join(self.folder, key + '.json')
+
+    def get(self, url, params, accept=None):
+        #the path of the cached response body or None if there is no valid response
+        key = self.key(url, params, accept)
+        if not os.path.exists(self.metadataPath(key)):
+            if self.offline:
+                raise ValueError(url + ' with the parameters ' + str(params) + ' is not cached')
+            return None
+
+        with open(self.metadataPath(key)) as metadata_file:
+            metadata = json.load(metadata_file)
+        if self.offline or time.time() - metadata['fetched_at'] <= self.ttl:
+            self.responses[key] = metadata
+            return self.bodyPath(key)
+        return None
+
+    def put(self, url, params, accept, response):
+        #stream the body of response to the cache, the metadata is written last and marks the response as valid
+        key = self.key(url, params, accept)
+        with open(self.bodyPath(key) + '.tmp', 'wb') as body:
+            for block in response.iter_content(2**20):
+                body.write(block)
+        os.replace(self.bodyPath(key) + '.tmp', self.bodyPath(key))
+
+        metadata = {
+            'url':url,
+            'params':params,
+            'accept':accept,
+            'status':response.status_code,
+            'fetched_at':time.time()
+        }
+        with open(self.metadataPath(key) + '.tmp', 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(self.metadataPath(key) + '.tmp', self.metadataPath(key))
+        self.responses[key] = metadata
+        return self.bodyPath(key)
+
+def fetch(url, params, cache, headers=None, timeout=60, retries=3, backoff=2.0):
+    #return the path of the cached body of the response to a GET request of url with the query parameters params
+    #failed requests are retried up to retries times, waiting backoff * 2**attempt seconds before each retry
+    params = [tuple(param) for param in params]
+    accept = headers.get('Accept') if headers is not None else None
+    path = cache.get(url, params, accept)
+    if path is not None:
+        return path
+
+    for attempt in range(retries + 1):
+        try:
+            with requests.get(url, params=params, headers=headers, timeout=timeout, stream=True) as response:
+                if response.status_code not in retry_status_codes:
+                    response.raise_for_status()
+                    return cache.put(url, params, accept, response)
+                error = requests.HTTPError(str(response.status_code) + ' for ' + response.url, response=response)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            error = e
+
+        if attempt < retries:
+            print(url + ' failed (' + str(error) + '), retrying')
+            time.sleep(backoff * 2**attempt)
+    raise error
+
+def fetchJSON(url, params, cache, **kwargs):
+    with open(fetch(url, params, cache, **kwargs), 'rb') as body:
+        return json.load(body)
+
+def runConcurrently(functions, n_workers):
+    #call the functions of the dict functions in a thread pool and return a dict of their results
+    #the requests are waiting for the network most of the time, so threads are enough
+    with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+        futures = {name:executor.submit(function) for name, function in functions.items()}
+    return {name:future.result() for name, future in futures.items()}
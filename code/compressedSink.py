@@ -0,0 +1,208 @@
+import io
+import os
+import json
+import gzip
+import zlib
+import hashlib
+import threading
+import collections
+import concurrent.futures
+
+#binary output files that compress the written data in blocks in a thread pool, while the data of the next blocks is
+#still being written, and optionally rotate into parts of a fixed size
+#each block is compressed on its own into a gzip member (like bgzf) or a zstd frame, the concatenated blocks are a
+#valid gzip or zstd file that can be decompressed by gzip -d or zstd -d
+#the blocks end at the end of a line, so each part of a rotated N-Triples or N-Quads file is a valid file on its own
+#the parts are listed with their sizes and sha256 checksums in a json manifest next to them
+#compressed blocks of one sink can be appended to another sink with the same compression without compressing them
+#again, e.g. the compressed parts of the checkpoints of a build are appended to the graph file
+
+#file extensions of the compressions
+extensions = {None:'', 'gzip':'.gz', 'zstd':'.zst'}
+
+#default compression levels
+levels = {None:None, 'gzip':6, 'zstd':3}
+
+def gzipCompressor(level):
+    def compress(data):
+        #wbits 31 writes a gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    return compress
+
+def zstdCompressor(level):
+    #zstandard is only needed for this compression
+    import zstandard
+
+    #a compressor must not be used by several threads at once, so each thread has its own
+    local = threading.local()
+    def compress(data):
+        if not hasattr(local, 'compressor'):
+            local.compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+        return local.compressor.compress(data)
+    return compress
+
+def createCompressor(compression, level):
+    if compression is None:
+        return bytes
+    if compression == 'gzip':
+        return gzipCompressor(level)
+    if compression == 'zstd':
+        return zstdCompressor(level)
+    raise ValueError(str(compression) + ' is not a valid compression')
+
+def partPath(path, i):
+    #the path of the i-th part of path, e.g. graph.part0003.nt.gz for graph.nt.gz
+    folder, file_name = os.path.split(path)
+    stem, _, extension = file_name.partition('.')
+    return os.path.join(folder, stem + '.part%04d' % i + ('.' + extension if extension else ''))
+
+def manifestPath(path):
+    #the path of the manifest of path, e.g. graph_manifest.json for graph.nt.gz
+    folder, file_name = os.path.split(path)
+    return os.path.join(folder, file_name.partition('.')[0] + '_manifest.json')
+
+class CompressedSink(io.RawIOBase):
+    #path is the path of the output file, which is split into parts of about part_size compressed bytes if part_size
+    #is given, the data is compressed in blocks of block_size bytes by n_threads threads
+    #blocks lists the compressed and uncompressed size of each written block, with manifest = False no manifest is saved
+    def __init__(self, path, compression='gzip', level=None, part_size=None, block_size=2**20, n_threads=None,
+        split_lines=True, manifest=True):
+        super().__init__()
+        self.path = path
+        self.compression = compression
+        self.level = level if level is not None else levels[compression]
+        self.part_size = part_size
+        self.block_size = block_size
+        self.split_lines = split_lines
+        self.manifest = manifest
+        self.parts = []
+        self.blocks = []
+
+        self._compress = createCompressor(compression, self.level)
+        self._n_threads = n_threads or os.cpu_count()
+        self._executor = concurrent.futures.ThreadPoolExecutor(self._n_threads)
+        #the compressed blocks are written in their order, at most two blocks per thread are waiting
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._file = None
+        self._hash = None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            end = self.block_size
+            if self.split_lines:
+                #the block ends after the last line end, or after the block if a line is longer than the block
+                end = self._buffer.rfind(b'\n', 0, self.block_size) + 1 or self.block_size
+            self._submit(bytes(self._buffer[:end]))
+            del self._buffer[:end]
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append((len(block), self._executor.submit(self._compress, block)))
+        while len(self._pending) > 2 * self._n_threads:
+            self._writeBlock(*self._popBlock())
+
+    def _popBlock(self):
+        size, future = self._pending.popleft()
+        return size, future.result()
+
+    def _openPart(self):
+        self._closePart()
+        path = self.path if self.part_size is None else partPath(self.path, len(self.parts))
+        self._file = open(path, 'wb')
+        self._hash = hashlib.sha256()
+        self.parts.append({'file':os.path.basename(path), 'bytes':0, 'uncompressed_bytes':0})
+
+    def _closePart(self):
+        if self._file is not None:
+            self._file.close()
+            self.parts[-1]['sha256'] = self._hash.hexdigest()
+            self._file = None
+
+    def _writeBlock(self, size, block):
+        #a new part is started once the current part has reached part_size
+        if self._file is None or (self.part_size is not None and self.parts[-1]['bytes'] >= self.part_size):
+            self._openPart()
+        self._file.write(block)
+        self._hash.update(block)
+        self.parts[-1]['bytes'] += len(block)
+        self.parts[-1]['uncompressed_bytes'] += size
+        self.blocks.append([len(block), size])
+
+    def writeCompressed(self, block, size):
+        #append a block of size uncompressed bytes that has already been compressed with the same compression
+        #the data written before is compressed into blocks of its own first
+        if len(self._buffer) > 0:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while len(self._pending) > 0:
+            self._writeBlock(*self._popBlock())
+        self._writeBlock(size, block)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if len(self._buffer) > 0 or self._file is None and len(self._pending) == 0:
+                #an empty output still gets one (empty) block, so that it is a valid compressed file
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while len(self._pending) > 0:
+                self._writeBlock(*self._popBlock())
+            self._closePart()
+            if self.manifest:
+                self.saveManifest()
+        finally:
+            self._executor.shutdown()
+            super().close()
+
+    def saveManifest(self):
+        manifest = {
+            'compression':self.compression,
+            'level':self.level,
+            'block_size':self.block_size,
+            'part_size':self.part_size,
+            'bytes':sum(part['bytes'] for part in self.parts),
+            'uncompressed_bytes':sum(part['uncompressed_bytes'] for part in self.parts),
+            'parts':self.parts
+        }
+        with open(manifestPath(self.path) + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(manifestPath(self.path) + '.tmp', manifestPath(self.path))
+
+def openSink(path, compression=None, part_size=None, buffer_size=2**20, **kwargs):
+    #a buffered binary file for writing path, which is a plain file if it is neither compressed nor rotated
+    if compression is None and part_size is None:
+        return open(path, 'wb', buffering=buffer_size)
+    return io.BufferedWriter(CompressedSink(path, compression, part_size=part_size, **kwargs), buffer_size)
+
+def copyBlocks(source, blocks, destination):
+    #append the compressed blocks of the binary file source, a list of their compressed and uncompressed sizes as in
+    #CompressedSink.blocks, to destination, a file of openSink with the same compression
+    destination.flush()
+    for size, uncompressed_size in blocks:
+        destination.raw.writeCompressed(source.read(size), uncompressed_size)
+
+def compressionOf(path):
+    #the compression of a file by its extension
+    for compression, extension in extensions.items():
+        if compression is not None and path.endswith(extension):
+            return compression
+    return None
+
+def openReader(path):
+    #a binary file for reading the decompressed data of path, which may consist of several gzip members or zstd frames
+    compression = compressionOf(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        import zstandard
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True), 2**20
+        )
+    return open(path, 'rb')
@@ -1,11 +1,33 @@
-import requests
 import pandas as pd
 import pycountry
-from SPARQLWrapper import SPARQLWrapper, JSON
-import pickle
 import datetime
 import os
 
+import cachedRequests
+import additionalDataStore
+
+#endpoints of the remote data, which can be replaced by a local server, e.g. for testing
+oecd_url = 'https://stats.oecd.org/SDMX-JSON/data/CTS_CIT/.COMB_CIT_RATE/all'
+world_bank_url = 'http://api.worldbank.org/v2/country/all/indicator/'
+wikidata_endpoint = 'https://query.wikidata.org/sparql'
+
+#the raw responses are cached in cache_folder and reused for cache_ttl seconds,
+#offline = True rebuilds the additional data from the cached responses without sending any request
+cache_folder = '../data/cache/additionalData/'
+cache_ttl = 7*24*3600
+offline = False
+
+#the requests are sent concurrently by n_workers threads and retried up to retries times
+n_workers = 7
+timeout = 300
+retries = 3
+
+#number of entities of each page of the paginated wikidata queries
+company_page_size = 20000
+
+cache = cachedRequests.ResponseCache(cache_folder, ttl=cache_ttl, offline=offline)
+request_options = {'timeout':timeout, 'retries':retries}
+
 def iso3ToIso2(row):
     country = pycountry.countries.get(alpha_3=row['iso3'])
     if country:
@@ -14,23 +36,17 @@ def iso3ToIso2(row):
         return None
 
 def getOECDCorporateTaxRate():
-    url = 'https://stats.oecd.org/SDMX-JSON/data/CTS_CIT/.COMB_CIT_RATE/all'
     params = [('startTime','2018'),('endTime','2018')]
-    r = requests.get(url, params=params)
-    content = r.json()
+    content = cachedRequests.fetchJSON(oecd_url, params, cache, **request_options)
     countries = content['structure']['dimensions']['series'][0]['values']
     values = content['dataSets'][0]['series']
 
-    #Create Data Frame
-    df = pd.DataFrame(columns=['name','iso3','corporateTaxRate'])
-    for i in range(0,len(countries)):
-        row = {
-            'name':countries[i]['name'],
-            'iso3':countries[i]['id'],
-            'corporateTaxRate':values[str(i)+':0']['observations']['0'][0]
-        }
-        
-        df = df.append(row, ignore_index=True)
+    #Create Data Frame from the columns at once
+    df = pd.DataFrame({
+        'name':[country['name'] for country in countries],
+        'iso3':[country['id'] for country in countries],
+        'corporateTaxRate':[values[str(i)+':0']['observations']['0'][0] for i in range(0,len(countries))]
+    })
 
     #Add iso2 based on iso3
     df['iso2'] = df.apply(lambda row: iso3ToIso2(row),axis=1)
@@ -45,26 +61,23 @@ def getOECDCorporateTaxRate():
 
 def getWorldBankPopGdp(attribute):
     if attribute == 'pop':
-        url = "http://api.worldbank.org/v2/country/all/indicator/SP.POP.TOTL"
+        url = world_bank_url + 'SP.POP.TOTL'
     elif attribute == 'gdp':
-        url = "http://api.worldbank.org/v2/country/all/indicator/NY.GDP.MKTP.CD"
+        url = world_bank_url + 'NY.GDP.MKTP.CD'
     else:
         return None
     
     params = [('mrnev','1'),('format','json'),('per_page','300')]
-    r = requests.get(url, params=params)
-
-    #Create Data Frame
-    df = pd.DataFrame(columns=['name','iso3','date',attribute])
-    for record in r.json()[1]:
-        row = {
-            'name':record['country']['value'],
-            'iso3':record['countryiso3code'],
-            'date':record['date'],
-            attribute:record['value']
-        }
-        
-        df = df.append(row, ignore_index=True)
+    content = cachedRequests.fetchJSON(url, params, cache, **request_options)
+
+    #Create Data Frame from the columns at once
+    records = content[1]
+    df = pd.DataFrame({
+        'name':[record['country']['value'] for record in records],
+        'iso3':[record['countryiso3code'] for record in records],
+        'date':[record['date'] for record in records],
+        attribute:[record['value'] for record in records]
+    })
 
     #Remove all countries that have no iso3 code
     df = df[df['iso3'] != '']
@@ -87,37 +100,42 @@ def getWorldBankPopGdp(attribute):
     return df
 
 def queryWikidata(query):
-
-    def extractJsonResults(results):
-        cols = results['head']['vars']
-        df = pd.DataFrame(columns=cols)
-        dict_list = []
-        for row in results['results']['bindings']:
-            df_dict = {}
-            for col in cols:
-                try:
-                    value = row[col]['value']
-                except:
-                    value = None
-                
-                df_dict[col] = value
-            
-            dict_list.append(df_dict)
-    
-        df = df.append(dict_list,ignore_index=True)
-        return df
-
-    sparql = SPARQLWrapper('https://query.wikidata.org/sparql')
-    #Set different user aggent to fix 403 errors
-    sparql.addCustomHttpHeader('User-Agent',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36')
-
-    sparql.setReturnFormat(JSON)
-    sparql.setQuery(query)
-    results = sparql.query().convert()
-
-    df = extractJsonResults(results)
-    return df
+    #the results are requested as csv and parsed by read_csv directly into the columns of the data frame,
+    #so that the memory is proportional to the columns and not to a json tree of the results
+    headers = {
+        #Set different user aggent to fix 403 errors
+        'User-Agent':'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36',
+        'Accept':'text/csv'
+    }
+    path = cachedRequests.fetch(wikidata_endpoint, [('query', query)], cache, headers=headers, **request_options)
+
+    #unbound values are empty in the csv results and become None
+    df = pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''])
+    return df.astype(object).where(df.notna(), None)
+
+def sparqlString(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def queryWikidataPages(select, where, key, page_size):
+    #query large results in pages of the rows of page_size entities, which are fetched one after the other, as wikidata
+    #limits the number of concurrent requests
+    #the entities are the unique IRIs of the variable key, a subquery selects the next page_size of them in their order
+    #after the last entity of the previous page, so unlike OFFSET the endpoint does not have to skip the rows of all
+    #previous pages, and all rows of an entity are in the same page
+    pages = []
+    last = None
+    while True:
+        subquery = 'SELECT DISTINCT ?' + key + ' WHERE {' + where
+        if last is not None:
+            subquery += ' FILTER(STR(?' + key + ') > ' + sparqlString(last) + ')'
+        subquery += '} ORDER BY ?' + key + ' LIMIT ' + str(page_size)
+        page = queryWikidata(select + ' WHERE {{' + subquery + '} ' + where + '}')
+        pages.append(page)
+        entities = page[key].dropna()
+        if entities.nunique() < page_size:
+            #a row that the endpoint returns twice is kept once
+            return pd.concat(pages, ignore_index=True).drop_duplicates(ignore_index=True)
+        last = entities.max()
 
 def getWikidataPopGdp(attribute):
     query = """
@@ -171,22 +189,30 @@ def getWikidataCountryEntities():
     return queryWikidata(query)
 
 def getWikidataCompanyEntities():
-    query = """
-    SELECT ?companyEntity ?LEI WHERE {{
-    ?companyEntity wdt:P1278 ?LEI .
-    }}
-    """
-
-    return queryWikidata(query)
+    #every wikidata item with a LEI, which is the largest of the queries and is therefore paginated
+    return queryWikidataPages(
+        'SELECT ?companyEntity ?LEI', '?companyEntity wdt:P1278 ?LEI .', 'companyEntity', company_page_size
+    )
 
 def getPyCountryNames():
     return pd.DataFrame([{'iso2': c.alpha_2, 'name': c.name} for c in list(pycountry.countries)])
 
-df_pop_world_bank = getWorldBankPopGdp('pop')
-df_gdp_world_bank = getWorldBankPopGdp('gdp')
+#the requests are independent of each other, so the refresh takes about as long as the slowest request
+results = cachedRequests.runConcurrently({
+    'df_pop_world_bank':lambda: getWorldBankPopGdp('pop'),
+    'df_gdp_world_bank':lambda: getWorldBankPopGdp('gdp'),
+    'df_pop_wiki':lambda: getWikidataPopGdp('pop'),
+    'df_gdp_wiki':lambda: getWikidataPopGdp('gdp'),
+    'df_corporateTaxRate':getOECDCorporateTaxRate,
+    'df_countryEntities':getWikidataCountryEntities,
+    'df_companyEntities':getWikidataCompanyEntities
+}, n_workers)
 
-df_pop_wiki = getWikidataPopGdp('pop')
-df_gdp_wiki = getWikidataPopGdp('gdp')
+df_pop_world_bank = results['df_pop_world_bank']
+df_gdp_world_bank = results['df_gdp_world_bank']
+
+df_pop_wiki = results['df_pop_wiki']
+df_gdp_wiki = results['df_gdp_wiki']
 
 #Check which countries are in wiki data but not in world bank data
 df_pop_wiki.loc[~df_pop_wiki['iso2'].isin(df_pop_world_bank['iso2']), 'iso2']
@@ -197,20 +223,21 @@ len(df_gdp_wiki.loc[~df_gdp_wiki['iso2'].isin(df_gdp_world_bank['iso2']), 'iso2'
 
 #Add every country that is in wiki data but not in world bank data to world bank data
 df_pop = df_pop_world_bank[['iso2','pop']].copy(deep=True)
-df_pop = df_pop.append(df_pop_wiki.loc[~df_pop_wiki['iso2'].isin(df_pop['iso2']), ['iso2','pop']])
+df_pop = pd.concat([df_pop, df_pop_wiki.loc[~df_pop_wiki['iso2'].isin(df_pop['iso2']), ['iso2','pop']]])
 
 df_gdp = df_gdp_world_bank[['iso2','gdp']].copy(deep=True)
-df_gdp = df_gdp.append(df_gdp_wiki.loc[~df_gdp_wiki['iso2'].isin(df_gdp['iso2']), ['iso2','gdp']])
+df_gdp = pd.concat([df_gdp, df_gdp_wiki.loc[~df_gdp_wiki['iso2'].isin(df_gdp['iso2']), ['iso2','gdp']]])
 
-df_corporateTaxRate = getOECDCorporateTaxRate()
-df_countryEntities = getWikidataCountryEntities()
-df_companyEntities = getWikidataCompanyEntities()
+df_corporateTaxRate = results['df_corporateTaxRate']
+df_countryEntities = results['df_countryEntities']
+df_companyEntities = results['df_companyEntities']
 df_countryNames = getPyCountryNames()
 
 #Save dataframes to process them for the building of the knowledge graph
+#they are stored as one parquet file per table (see additionalDataStore.py), which createRDF.py reads as path_additonal_data
 date_and_time = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
 path_df = os.path.realpath(
-    '../data/additionalData/' + date_and_time + '_df.pkl')
+    '../data/additionalData/' + date_and_time + '_additionalData')
 
 df_dict = {
     'df_pop_world_bank':df_pop_world_bank,
@@ -225,6 +252,24 @@ df_dict = {
     'df_countryNames':df_countryNames
 }
 
-with open(path_df, 'wb') as output:
-    pickle.dump(df_dict, output, pickle.HIGHEST_PROTOCOL)
+sources = {
+    'df_pop_world_bank':'world bank',
+    'df_gdp_world_bank':'world bank',
+    'df_pop_wiki':'wikidata',
+    'df_gdp_wiki':'wikidata',
+    'df_pop':'world bank and wikidata',
+    'df_gdp':'world bank and wikidata',
+    'df_corporateTaxRate':'oecd',
+    'df_countryEntities':'wikidata',
+    'df_companyEntities':'wikidata',
+    'df_countryNames':'pycountry'
+}
+
+#the responses the tables were created from, with the times they were fetched
+provenance = {
+    'offline':offline,
+    'responses':sorted(cache.responses.values(), key=lambda metadata: metadata['fetched_at'])
+}
+
+additionalDataStore.saveAdditionalData(df_dict, path_df, provenance=provenance, sources=sources)
 
@@ -1,275 +1,510 @@
-import pandas as pd
 import rdflib
-import pickle
+import pandas as pd
 import datetime
+import os
+import shutil
+import tempfile
 
 import helpFunctions
+import graphWriter
+import tripleEmission
+import buildProfiler
+import buildCheckpoints
+import shardedEmission
+import outOfCore
+import hierarchyIndex
+import leiDictionary
+import additionalDataStore
+import compressedSink
+import subsetBuild
 
 #specify paths
 path_lei_data = '../data/gleifData/20191009-0800-gleif-goldencopy-lei2-golden-copy.csv'
 path_wikidata_cities = '../data/wikidataCityData/wikidata_cities.csv'
-path_additonal_data = '../data/additionalData/2020-03-17_00:56:06_df.pkl'
+#the additional data is a folder of parquet tables created by createAdditionalDataSets.py (see additionalDataStore.py),
+#legacy pickles (<timestamp>_df.pkl) can be used as well
+path_additonal_data = '../data/additionalData/2020-03-17_00:56:06_additionalData'
 path_relationship_data = '../data/gleifData/20191009-0800-gleif-goldencopy-rr-golden-copy.csv'
 graph_storage_folder = '../data/graphData/'
+#folder for caching the wikidata city index and the matches of city names and postal codes
+#to wikidata cityIDs between builds, set to None to disable the cache
+cache_folder = '../data/cache/'
+#folder for the checkpoints of the build stages, a build that is run again with the same input files and
+#parameters skips all stages whose checkpoints exist and resumes after the last one, set to None to disable
+checkpoint_folder = '../data/checkpoints/'
+
+#specify the output format of the graph
+#'nt' (N-Triples) and 'nq' (N-Quads) write each triple directly to the output file while the graph is built
+#'xml' (RDF/XML) builds the whole graph in memory and serializes it at the end
+output_format = 'nt'
+
+if output_format not in ['nt', 'nq', 'xml']:
+    raise ValueError(output_format + ' is not a valid output format')
+
+#number of worker processes for the parallel stages of the build
+n_workers = os.cpu_count()
+
+#compression of the graph file: None, 'gzip' or 'zstd' (requires zstandard)
+#the file is compressed in blocks by compression_threads threads while the triples are written (see compressedSink.py)
+output_compression = None
+compression_threads = n_workers
+#size in bytes of the parts that the graph file is split into, together with a manifest of their checksums,
+#None writes a single file, the parts of nt and nq are valid files on their own,
+#the parts of xml have to be concatenated
+output_part_size = None
+sink_options = {'compression':output_compression, 'part_size':output_part_size, 'n_threads':compression_threads}
+
+#the LEI and relationship triples of the nt and nq formats are hash-partitioned by LEI into n_shards shards,
+#which are emitted by the n_workers processes and appended to the graph in a fixed order,
+#so that the graph only depends on n_shards and not on n_workers, with 1 shard they are emitted in this process
+#each shard costs its own writer, temporary file and copy into the graph, so more shards than workers only slow the
+#build down (on a single core, 64 shards take about five times as long as 1 shard), the default is one shard per
+#worker, set a fixed number to get the same graph on machines with different numbers of cores
+n_shards = n_workers
+
+#memory budget in bytes of the joins and aggregations that are processed in chunks and spill to disk beyond it
+memory_budget = 2**30
+#number of rows of the chunks of the lei data, which is loaded, matched, merged and emitted one chunk at a time
+lei_data_chunksize = 250000
+
+#specify the parser for the GLEIF csv files: 'c' (pandas) or 'pyarrow' (multithreaded, requires pyarrow)
+csv_engine = 'c'
+
+#the consolidation hierarchy of the relationship data is stored as memory-mappable index next to the graph,
+#which answers queries for parents, subsidiaries and groups of LEIs (see hierarchyIndex.py), set to False to skip it
+create_hierarchy_index = True
+
+#a subset build only builds the graph of the LEIs that pass a filter, which is applied while the GLEIF files are read
+#and before the cities are matched (see subsetBuild.py), the LEIs have to pass all filters that are not None
+#LEIs whose legal or headquarters address is in one of the countries, e.g. ['DE', 'FR']
+subset_countries = None
+#file with one LEI per line
+subset_lei_path = None
+#fraction of the LEIs in a deterministic sample by the hash of the LEIs, e.g. 0.01
+subset_sample_rate = None
+#relationships are kept if both of their LEIs are kept, with subset_neighbors = True all relationships of the kept LEIs
+#are kept and the LEIs at their other end are added to the graph
+subset_neighbors = False
+
+if subset_countries is None and subset_lei_path is None and subset_sample_rate is None:
+    subset = None
+else:
+    subset = subsetBuild.SubsetFilter(
+        countries=subset_countries,
+        leis=None if subset_lei_path is None else subsetBuild.readLEIList(subset_lei_path),
+        sample_rate=subset_sample_rate,
+        neighbors=subset_neighbors
+    )
 
-#load lei data
-lei_data = helpFunctions.loadLEIData(path_lei_data)
-print('lei data loaded')
-
-#load wikidata city entities
-wikidataCityDict = helpFunctions.createWikidataCityDict(path_wikidata_cities)
-print('wikidataCityDict created')
-
-#add wikidata cityID and wikidata cityID_label to lei_data
-(legal_cityID_list, legal_cityID_label_list, 
-headquarters_cityID_list, headquarters_cityID_label_list) = helpFunctions.createMatchingCityID(lei_data, wikidataCityDict, 0.3)
-lei_data['Entity_LegalAddress_CityID'] = legal_cityID_list
-lei_data['Entity_LegalAddress_CityID_Label'] = legal_cityID_label_list
-lei_data['Entity_HeadquartersAddress_CityID'] = headquarters_cityID_list
-lei_data['Entity_HeadquartersAddress_CityID_Label'] = headquarters_cityID_label_list
-print('cityID and cityID_label added to lei data')
-
-#load additonal data
-with open(path_additonal_data, 'rb') as output:
-    additional_data = pickle.load(output)
+#the LEI and relationship triples are emitted in shards by a pool of worker processes, which is started before the
+#build starts any threads (e.g. of the compressed sinks or of the memory sampler of the profiler), since forking a
+#process with threads is unsafe
+sharded = n_shards > 1 and output_format != 'xml'
+if sharded and n_workers > 1:
+    shard_pool = shardedEmission.createPool(min(n_workers, n_shards))
+else:
+    shard_pool = None
 
-#add wikidata company entity to lei_data
-df_company_entities = additional_data['df_companyEntities']
-lei_data = lei_data.merge(df_company_entities, how='left', on='LEI')
+#names of the build stages that are profiled with cProfile, e.g. ['createMatchingCityID']
+#the profiles are stored next to the graph and can be inspected with pstats or snakeviz
+profile_stages = []
 
-#create graph g
-g = rdflib.Graph(identifier='taxGraph')
-ns = 'http://taxgraph.informatik.uni-mannheim.de/resource/'
-ns_predicate = ns + 'predicate/'
-
-#define predicates for lei_data
-predicatesLEI = dict({
-    'legalName':{'colName':'Entity_LegalName', 'asLiteral': True},
-    'legalAddressMailRouting':{'colName':'Entity_LegalAddress_MailRouting', 'asLiteral': True},
-    'legalAddressAddressLine0':{'colName':'Entity_LegalAddress_FirstAddressLine', 'asLiteral': True},
-    'legalAddressAddressLine1':{'colName':'Entity_LegalAddress_AdditionalAddressLine_1', 'asLiteral': True},
-    'legalAddressAddressLine2':{'colName':'Entity_LegalAddress_AdditionalAddressLine_2', 'asLiteral': True},
-    'legalAddressAddressLine3':{'colName':'Entity_LegalAddress_AdditionalAddressLine_3', 'asLiteral': True},
-    'legalAddressCity':{'colName':'Entity_LegalAddress_City', 'asLiteral': True},
-    'legalAddressRegion':{'colName':'Entity_LegalAddress_Region', 'asLiteral': False, 'prefix':'region/'},
-    'legalAddressCountry':{'colName':'Entity_LegalAddress_Country', 'asLiteral': False, 'prefix':'country/'},
-    'legalAddressPostalCode':{'colName':'Entity_LegalAddress_PostalCode', 'asLiteral': True},
-    'headquartersAddressMailRouting':{'colName':'Entity_HeadquartersAddress_MailRouting', 'asLiteral': True},
-    'headquartersAddressAddressLine0':{'colName':'Entity_HeadquartersAddress_FirstAddressLine', 'asLiteral': True},
-    'headquartersAddressAddressLine1':{'colName':'Entity_HeadquartersAddress_AdditionalAddressLine_1', 'asLiteral': True},
-    'headquartersAddressAddressLine2':{'colName':'Entity_HeadquartersAddress_AdditionalAddressLine_2', 'asLiteral': True},
-    'headquartersAddressAddressLine3':{'colName':'Entity_HeadquartersAddress_AdditionalAddressLine_3', 'asLiteral': True},
-    'headquartersAddressCity':{'colName':'Entity_HeadquartersAddress_City', 'asLiteral': True},
-    'headquartersAddressRegion':{'colName':'Entity_HeadquartersAddress_Region', 'asLiteral': False, 'prefix':'region/'},
-    'headquartersAddressCountry':{'colName':'Entity_HeadquartersAddress_Country', 'asLiteral': False, 'prefix':'country/'},
-    'headquartersAddressPostalCode':{'colName':'Entity_HeadquartersAddress_PostalCode', 'asLiteral': True},
-    'registrationAuthorityID':{'colName':'Entity_RegistrationAuthority_RegistrationAuthorityID', 'asLiteral': False, 'prefix':'registrationAuthorityID/'},
-    'legalForm':{'colName':'Entity_LegalForm_EntityLegalFormCode', 'asLiteral': False, 'prefix':'legalForm/'},
-    'managingLOU':{'colName':'Registration_ManagingLOU', 'asLiteral': False, 'prefix':'LEI/'}, #Notice that the managing LOU is identified by its LEI
-    'legalAddressCityID':{'colName':'Entity_LegalAddress_CityID', 'asLiteral': False, 'prefix':'cityID/'},
-    'headquartersAddressCityID':{'colName':'Entity_HeadquartersAddress_CityID', 'asLiteral': False, 'prefix':'cityID/'}
-})
-
-#check if all colNames of the predicates can be found in lei_data
-for key in predicatesLEI.keys():
-    if(not predicatesLEI[key]['colName'] in lei_data.columns):
-        raise ValueError(predicatesLEI[key]['colName'] + ' is not a valid column name')
-
-#check if all predicates that do not link to a literal have a prefix defined
-for key in predicatesLEI.keys():
-    if(not predicatesLEI[key]['asLiteral'] and not ('prefix' in predicatesLEI[key].keys())):
-        raise ValueError(key + ' is missing a prefix key')
-
-#create the URIRef for each predicate
-for key in predicatesLEI.keys():
-    predicate_dict = predicatesLEI[key]
-    predicate_dict['URIRef'] = rdflib.URIRef(ns_predicate + key)
-
-##### add lei_data triples ##### 
-i = 0
-for t in lei_data.itertuples():
-    #if LEI is nan we cant add any information
-    if pd.isnull(t.LEI):
-        continue
-    #create a node for this LEI
-    LEI = rdflib.URIRef(ns + 'LEI/' + getattr(t, 'LEI'))
-
-    #add for each predicate a triple, if it exists
-    for key in predicatesLEI.keys():
-        value = getattr(t, predicatesLEI[key]['colName'])
-        if not pd.isnull(value):
-            if(predicatesLEI[key]['asLiteral']):
-                o = rdflib.Literal(value)
-            else:
-                prefix = predicatesLEI[key]['prefix']
-                o = rdflib.URIRef(ns + prefix + value )
-
-            g.add( (LEI,predicatesLEI[key]['URIRef'],o) )
-    
-    #add sameAs predicate for LEI node
-    value = getattr(t, 'companyEntity')
-    if not pd.isnull(value):
-        p = rdflib.URIRef('http://www.w3.org/2002/07/owl#sameAs')
-        o = rdflib.URIRef(value)
-        g.add( (LEI, p, o) )
-    
-    i+=1
-    if(i%250000 == 0):
-        print(i)
-
-##### add locatedIn to region #####
-#find all unique regions
-all_regions = lei_data['Entity_LegalAddress_Region'].append(
-    lei_data['Entity_HeadquartersAddress_Region'])
-unique_regions = all_regions[~all_regions.duplicated()]
-
-for region in unique_regions:
-    if not pd.isnull(region):
-        s = rdflib.URIRef(ns + 'region/' + region)
-        p = rdflib.URIRef(ns_predicate + 'locatedIn')
-        #the first two letters of the region correspond to the country of the region
-        o = rdflib.URIRef(ns + 'country/' + region[0:2])
-
-        g.add( (s, p, o) )
-
-##### add sameAs to cityID #####
-#find all unique cityIDs
-all_cityID = lei_data['Entity_LegalAddress_CityID'].append(
-    lei_data['Entity_HeadquartersAddress_CityID'])
-unique_cityID = all_cityID[~all_cityID.duplicated()]
-
-for cityID in unique_cityID:
-    if not pd.isnull(cityID):
-        s = rdflib.URIRef(ns + 'cityID/' + cityID)
-        p = rdflib.URIRef('http://www.w3.org/2002/07/owl#sameAs')
-        o = rdflib.URIRef('http://www.wikidata.org/wiki/Q' + cityID)
-
-        g.add( (s, p, o) )
-
-##### add label to cityID #####
-#find all unique combinations of cityID and cityID label
-legal_cityIDANDlabel = lei_data[['Entity_LegalAddress_CityID', 'Entity_LegalAddress_CityID_Label']]
-legal_cityIDANDlabel.columns = ['cityID','label'] 
-
-headquarters_cityIDANDlabel = lei_data[['Entity_HeadquartersAddress_CityID', 'Entity_HeadquartersAddress_CityID_Label']]
-headquarters_cityIDANDlabel.columns = ['cityID','label'] 
-
-all_cityIDANDlabel = legal_cityIDANDlabel.append(headquarters_cityIDANDlabel)
-unique_cityIDANDlabel = all_cityIDANDlabel[~all_cityIDANDlabel.duplicated()]
-
-for row in unique_cityIDANDlabel.itertuples():
-    cityID = getattr(row, 'cityID')
-    label = getattr(row, 'label')
-
-    if ((not pd.isnull(cityID)) and (not pd.isnull(label))):
-        s = rdflib.URIRef(ns + 'cityID/' + cityID)
-        p = rdflib.URIRef('http://www.w3.org/2000/01/rdf-schema#label')
-        o = rdflib.Literal(label)
-        
-        g.add( (s, p, o) )
-
-##### add locatedIn to cityID #####
-legal_cityIDANDregion = lei_data[['Entity_LegalAddress_CityID', 'Entity_LegalAddress_Region']]
-legal_cityIDANDregion.columns = ['cityID','region'] 
-
-headquarters_cityIDANDregion = lei_data[['Entity_HeadquartersAddress_CityID', 'Entity_HeadquartersAddress_Region']]
-headquarters_cityIDANDregion.columns = ['cityID','region'] 
-
-all_cityIDANDregion = legal_cityIDANDregion.append(headquarters_cityIDANDregion)
-
-#group by cityID and region
-#and get for each combination the number of LEI entries with that combination
-all_cityIDANDregion_grp = all_cityIDANDregion.groupby(['cityID','region']).size()
-
-#group by cityID and find the region that has the most LEI entries for that cityID
-#this makes sure that each city is only located in a single region
-#this results in a Series where each entry is a tuple of the from (cityID, region)
-all_cityIDANDregion_max = all_cityIDANDregion_grp.groupby(level='cityID').idxmax()
-
-for row in all_cityIDANDregion_max:
-    cityID = row[0]
-    region = row[1]
-
-    if ((not pd.isnull(cityID)) and (not pd.isnull(region))):
-        s = rdflib.URIRef(ns + 'cityID/' + cityID)
-        p = rdflib.URIRef(ns_predicate + 'locatedIn')
-        o = rdflib.URIRef(ns + 'region/' + region)
-        
-        g.add( (s, p, o) )
-
-##### add country specific data #####
-add_country_data_dict = {
-    'df_pop':{'value_name':'pop', 'predicate_URI':ns_predicate + 'population'},
-    'df_gdp':{'value_name':'gdp', 'predicate_URI':ns_predicate + 'GDP'},
-    'df_corporateTaxRate':{'value_name':'corporateTaxRate', 'predicate_URI':ns_predicate + 'corporateTaxRate'},
-    'df_countryNames':{'value_name':'name', 'predicate_URI':'http://www.w3.org/2000/01/rdf-schema#label'},
-    'df_countryEntities':{'value_name':'countryEntity', 'predicate_URI':'http://www.w3.org/2002/07/owl#sameAs'}
-}
+#time, memory and size of each stage of the build are recorded and stored as json report next to the graph
+date_and_time = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
+profiler = buildProfiler.BuildProfiler(
+    profile_folder=graph_storage_folder + date_and_time + '_profiles/', profile_stages=profile_stages
+)
 
-for key, value_dict in add_country_data_dict.items():
-    data = additional_data[key]
-    value_name = value_dict['value_name']
-    predicate_URI = value_dict['predicate_URI']
+checkpoints = buildCheckpoints.CheckpointStore(checkpoint_folder)
+max_distance = 0.3
+
+#the key of each stage is derived from the hashes of its input files, the keys of the stages it depends on
+#and its parameters
+#the input files are only hashed for the checkpoints, whose store remembers the hashes by the size and modification
+#time of the files, so a file is only hashed again after it has changed
+if checkpoints.enabled:
+    wikidata_cities_hash = checkpoints.fileHash(path_wikidata_cities)
+    additional_data_hash = checkpoints.fileHash(additionalDataStore.hashPath(path_additonal_data))
+    relationship_data_hash = checkpoints.fileHash(path_relationship_data)
+    lei_data_hash = checkpoints.fileHash(path_lei_data)
+else:
+    #without checkpoints the keys are never looked up, only the caches of the wikidata city file need its hash
+    wikidata_cities_hash = checkpoints.fileHash(path_wikidata_cities) if cache_folder is not None else None
+    additional_data_hash = relationship_data_hash = lei_data_hash = None
+if subset is None:
+    lei_data_key = checkpoints.key('loadLEIData', lei_data_hash)
+else:
+    #the neighbors of a subset are found in the relationship data
+    lei_data_key = checkpoints.key(
+        'loadLEIData', lei_data_hash, relationship_data_hash, subset=subset.description()
+    )
+matched_lei_data_key = checkpoints.key(
+    'createMatchingCityID', lei_data_key, wikidata_cities_hash, max_distance=max_distance
+)
+merged_lei_data_key = checkpoints.key('mergeCompanyEntities', matched_lei_data_key, additional_data_hash)
+if subset is None:
+    relationship_data_key = checkpoints.key(
+        'loadRelationshipData', relationship_data_hash, columns=helpFunctions.relationship_data_columns
+    )
+else:
+    #the relationships of a subset are filtered by the LEIs of the lei data
+    relationship_data_key = checkpoints.key(
+        'loadRelationshipData', relationship_data_hash, lei_data_key,
+        columns=helpFunctions.relationship_data_columns, subset=subset.description()
+    )
 
-    p = rdflib.URIRef(predicate_URI)
+#the triples of the streaming formats are written to one part file per emission stage, which are kept as
+#checkpoints and concatenated to the graph at the end, the xml graph is held in memory and has no parts
+#the parts are compressed like the graph while they are written, and their compressed blocks are appended to the graph
+part_extension = '.' + output_format + compressedSink.extensions[output_compression]
+emission_keys = {
+    'leiTriples':checkpoints.key(
+        'leiTriples', merged_lei_data_key, output_format=output_format, shards=n_shards,
+        compression=output_compression
+    ),
+    'auxiliaryTriples':checkpoints.key(
+        'auxiliaryTriples', merged_lei_data_key, output_format=output_format, shards=n_shards,
+        compression=output_compression
+    ),
+    'countryTriples':checkpoints.key(
+        'countryTriples', additional_data_hash, output_format=output_format, compression=output_compression
+    ),
+    'relationshipTriples':checkpoints.key(
+        'relationshipTriples', relationship_data_key, output_format=output_format, shards=n_shards,
+        compression=output_compression
+    )
+}
+use_parts = checkpoints.enabled and output_format != 'xml'
+
+def needsEmission(name):
+    return not (use_parts and checkpoints.has(name, emission_keys[name]))
+
+#find the stages that have to run, starting from the emission stages
+need_merged_lei_data = (needsEmission('leiTriples') or needsEmission('auxiliaryTriples')
+    or (create_hierarchy_index and not checkpoints.has('mergeCompanyEntities', merged_lei_data_key)))
+need_matched_lei_data = need_merged_lei_data and not checkpoints.has('mergeCompanyEntities', merged_lei_data_key)
+need_additional_data = need_matched_lei_data or needsEmission('countryTriples')
+need_lei_data = need_matched_lei_data and not checkpoints.has('createMatchingCityID', matched_lei_data_key)
+need_relationship_data = needsEmission('relationshipTriples') or create_hierarchy_index
+
+#the lei data is passed between the stages as row groups of parquet files, which are read one chunk at a time,
+#the files are stored as checkpoints or, without checkpoints, in a temporary folder next to the graph
+if checkpoints.enabled:
+    frames = checkpoints
+else:
+    frames = buildCheckpoints.CheckpointStore(graph_storage_folder + date_and_time + '_frames/')
 
-    for row in data.itertuples():
-        country = getattr(row, 'iso2')
-        value = getattr(row, value_name)
+#load lei data
+if need_lei_data:
+    profiler.start('loadLEIData')
+    if not checkpoints.has('loadLEIData', lei_data_key):
+        if subset is None:
+            lei_chunks = helpFunctions.loadLEIDataChunks(path_lei_data, lei_data_chunksize, engine=csv_engine)
+        else:
+            lei_chunks = subset.loadLEIDataChunks(
+                path_lei_data, path_relationship_data, lei_data_chunksize, engine=csv_engine
+            )
+        frames.saveChunks(lei_chunks, 'loadLEIData', lei_data_key, path=path_lei_data)
+    profiler.stop(rows_in=frames.metadata('loadLEIData', lei_data_key)['rows'])
+    print('lei data loaded')
+
+if need_matched_lei_data and not checkpoints.has('createMatchingCityID', matched_lei_data_key):
+    #load wikidata city entities
+    profiler.start('createWikidataCityDict')
+    #a previously created index of the same wikidata city file is memory-mapped instead of being recreated
+    if cache_folder is not None:
+        wikidata_city_index_path = helpFunctions.wikidataCityIndexPath(cache_folder, wikidata_cities_hash)
+    else:
+        wikidata_city_index_path = None
+
+    if wikidata_city_index_path is not None and os.path.exists(wikidata_city_index_path):
+        wikidataCityDict = helpFunctions.loadWikidataCityIndex(wikidata_city_index_path)
+    else:
+        wikidataCityDict = helpFunctions.createWikidataCityDict(path_wikidata_cities)
+        if wikidata_city_index_path is not None:
+            helpFunctions.saveWikidataCityIndex(wikidataCityDict, wikidata_city_index_path)
+    profiler.stop()
+    print('wikidataCityDict created')
+
+    #load the city matches of previous builds
+    profiler.start('createMatchingCityID')
+    if cache_folder is not None:
+        city_match_cache_path = helpFunctions.cityMatchCachePath(cache_folder, wikidata_cities_hash, max_distance)
+        city_match_cache = helpFunctions.loadCityMatchCache(city_match_cache_path)
+    else:
+        city_match_cache = {}
+
+    #the matching workers memory-map the index, which is stored once for all chunks if it is not cached
+    temp_index_folder = None
+    if wikidata_city_index_path is None and n_workers > 1:
+        temp_index_folder = tempfile.TemporaryDirectory()
+        wikidata_city_index_path = os.path.join(temp_index_folder.name, 'wikidataCityIndex')
+        helpFunctions.saveWikidataCityIndex(wikidataCityDict, wikidata_city_index_path)
+
+    #add wikidata cityID and wikidata cityID_label to each chunk of lei_data, the keys of the chunks that are
+    #already in the cache are not matched again
+    def matchedChunks():
+        for lei_data in frames.loadChunks('loadLEIData', lei_data_key):
+            (legal_cityID_list, legal_cityID_label_list,
+            headquarters_cityID_list, headquarters_cityID_label_list) = helpFunctions.createMatchingCityID(
+                lei_data, wikidataCityDict, max_distance, cache=city_match_cache,
+                n_workers=n_workers, index_path=wikidata_city_index_path)
+
+            lei_data['Entity_LegalAddress_CityID'] = legal_cityID_list
+            lei_data['Entity_LegalAddress_CityID_Label'] = legal_cityID_label_list
+            lei_data['Entity_HeadquartersAddress_CityID'] = headquarters_cityID_list
+            lei_data['Entity_HeadquartersAddress_CityID_Label'] = headquarters_cityID_label_list
+            yield lei_data
+
+    rows = frames.saveChunks(matchedChunks(), 'createMatchingCityID', matched_lei_data_key, max_distance=max_distance)
+    if temp_index_folder is not None:
+        temp_index_folder.cleanup()
+    if cache_folder is not None:
+        helpFunctions.saveCityMatchCache(city_match_cache, city_match_cache_path)
+    profiler.stop(rows_in=rows)
+    print('cityID and cityID_label added to lei data')
+
+#open additonal data, its tables are only read when they are used
+if need_additional_data:
+    additional_data = additionalDataStore.openAdditionalData(path_additonal_data)
+
+#the latest stage of the lei data that exists before the company entities are merged
+if need_matched_lei_data:
+    lei_data_stage = ('createMatchingCityID', matched_lei_data_key)
+else:
+    lei_data_stage = ('mergeCompanyEntities', merged_lei_data_key)
 
-        s = rdflib.URIRef(ns + 'country/' + country)
-        
-        if key == 'df_countryEntities':
-            o = rdflib.URIRef(value)
+#load relationship_data
+if need_relationship_data:
+    profiler.start('loadRelationshipData')
+    if checkpoints.has('loadRelationshipData', relationship_data_key):
+        relationship_data = checkpoints.loadFrame('loadRelationshipData', relationship_data_key)
+    else:
+        if subset is None:
+            relationship_filter = None
         else:
-            o = rdflib.Literal(value)
+            relationship_filter = subset.relationshipFilter(
+                frames.loadFrame(*lei_data_stage, columns=['LEI'] + subsetBuild.country_columns)
+            )
+        relationship_data = helpFunctions.loadRelationshipData(
+            path_relationship_data, engine=csv_engine, row_filter=relationship_filter
+        )
+        checkpoints.saveFrame(
+            relationship_data, 'loadRelationshipData', relationship_data_key, path=path_relationship_data
+        )
+    profiler.stop(rows_in=len(relationship_data))
+
+    #relationships of types without a predicate are not part of the graph
+    for relationship_type, count in tripleEmission.unknownRelationshipTypes(relationship_data).items():
+        print(str(count) + ' relationships of the unknown type ' + relationship_type + ' are skipped')
+
+#encode the LEIs of the lei data and the relationship data as int32 IDs of one dictionary of all LEIs, which is stored
+#as memory-mappable array next to the graph, the merge, deduplications and the hierarchy index work on the IDs and
+#the LEIs are only decoded for the rows of each chunk that is written to the graph
+#the checkpoints keep the LEIs as strings, so that they do not depend on the dictionary of a build
+relationship_lei_columns = ['Relationship_StartNode_NodeID', 'Relationship_EndNode_NodeID']
+if need_merged_lei_data or need_relationship_data:
+    profiler.start('leiDictionary')
+    def leiColumns():
+        if need_merged_lei_data or create_hierarchy_index:
+            for chunk in frames.loadChunks(*lei_data_stage, columns=['LEI']):
+                yield chunk['LEI']
+        if need_relationship_data:
+            for col in relationship_lei_columns:
+                yield relationship_data[col]
+
+    lei_dictionary_path = graph_storage_folder + date_and_time + '_leiDictionary.npy'
+    leiDictionary.saveLEIDictionary(leiDictionary.createLEIDictionary(leiColumns()), lei_dictionary_path)
+    leis = leiDictionary.loadLEIDictionary(lei_dictionary_path)
+
+    if need_relationship_data:
+        relationship_data = leiDictionary.encodeColumns(relationship_data, leis, relationship_lei_columns)
+    profiler.stop(rows_in=len(leis))
+    print('lei dictionary created')
+
+def leiDataChunks(name, key, columns=None):
+    #the chunks of the lei data of a stage with the LEIs encoded as IDs of the dictionary
+    for chunk in frames.loadChunks(name, key, columns=columns):
+        yield leiDictionary.encodeColumns(chunk, leis, ['LEI'])
 
-        g.add( (s, p, o) )
+#add wikidata company entity to lei_data
+if need_matched_lei_data:
+    profiler.start('mergeCompanyEntities')
+    #the chunks of the lei data are joined on the IDs of the LEIs and stored as row groups, the company entities of
+    #LEIs that are not in the dictionary have no match
+    df_company_entities = additional_data.read('df_companyEntities', columns=['companyEntity', 'LEI'])
+    df_company_entities = leiDictionary.encodeColumns(df_company_entities, leis, ['LEI'])
+    df_company_entities = df_company_entities[df_company_entities['LEI'].values >= 0]
+    merged_chunks = outOfCore.hashJoinLeft(
+        leiDataChunks('createMatchingCityID', matched_lei_data_key), df_company_entities, 'LEI', memory_budget
+    )
+    rows = frames.saveChunks(
+        (leiDictionary.decodeColumns(chunk, leis, ['LEI']) for chunk in merged_chunks),
+        'mergeCompanyEntities', merged_lei_data_key
+    )
+    del df_company_entities, merged_chunks
+    profiler.stop(rows_in=rows)
 
-#load relationship_data
-relationship_data = pd.read_csv(
-    path_relationship_data, sep=',', header=0, index_col=False, dtype=str
+if need_merged_lei_data:
+    #the predicates for lei_data are defined in tripleEmission.predicatesLEI
+    tripleEmission.checkLEIColumns(
+        pd.DataFrame(columns=frames.frameColumns('mergeCompanyEntities', merged_lei_data_key))
+    )
+    lei_data_rows = frames.metadata('mergeCompanyEntities', merged_lei_data_key)['rows']
+
+#create the index of the consolidation hierarchy
+if create_hierarchy_index:
+    profiler.start('hierarchyIndex')
+    jurisdictions = helpFunctions.concatChunks(list(leiDataChunks(
+        'mergeCompanyEntities', merged_lei_data_key, columns=['LEI', 'Entity_LegalAddress_Country']
+    )))
+    hierarchy_index = hierarchyIndex.createHierarchyIndex(jurisdictions, relationship_data, leis)
+    hierarchyIndex.saveHierarchyIndex(
+        hierarchy_index, graph_storage_folder + date_and_time + '_hierarchyIndex', lei_dictionary_path
+    )
+    del jurisdictions, hierarchy_index
+    profiler.stop(rows_in=len(relationship_data))
+    print('hierarchy index created')
+
+#create graph g
+graph_storage_path = (
+    graph_storage_folder + date_and_time + '_taxGraph.' + output_format + compressedSink.extensions[output_compression]
 )
+graph_name = tripleEmission.ns + 'taxGraph' if output_format == 'nq' else None
 
-#replace dots with underscores in the column names
-relationship_data_column_names = [s.replace('.', '_') for s in relationship_data.columns]
-#rename data frame columns
-relationship_data.columns = relationship_data_column_names
-
-##### add relationship_data triples #####
-for t in relationship_data.itertuples():
-    #if startLEI, endLEI, or type is nan we cant add any information
-    if (pd.isnull(t.Relationship_StartNode_NodeID)
-    or pd.isnull(t.Relationship_EndNode_NodeID)
-    or pd.isnull(t.Relationship_RelationshipType)):
+if output_format == 'xml':
+    g = rdflib.Graph(identifier='taxGraph')
+elif not use_parts:
+    g = graphWriter.NTriplesWriter(
+        graph_storage_path, graph_name=graph_name, output=compressedSink.openSink(graph_storage_path, **sink_options)
+    )
+
+#the regions and cityIDs of the lei data are collected while the LEI triples are added,
+#so that the auxiliary triples do not need another pass over the lei data
+auxiliary = tripleEmission.AuxiliaryEntities(memory_budget)
+
+#each emission stage adds its triples to g and returns the number of its input rows
+def emitLEITriples(g):
+    lei_chunks = leiDataChunks('mergeCompanyEntities', merged_lei_data_key)
+    if sharded:
+        shardedEmission.addTriplesSharded(
+            g, tripleEmission.addLEITriples, lei_chunks, 'LEI', n_shards, shard_pool, auxiliary=auxiliary,
+            lei_dictionary_path=lei_dictionary_path
+        )
+    else:
+        for lei_data in lei_chunks:
+            tripleEmission.addLEITriples(g, lei_data, auxiliary=auxiliary, leis=leis)
+    return lei_data_rows
+
+def emitAuxiliaryTriples(g):
+    #the LEI triples were restored from their checkpoint, the entities are collected in the same order
+    if auxiliary.rows == 0:
+        lei_chunks = frames.loadChunks('mergeCompanyEntities', merged_lei_data_key)
+        if sharded:
+            shardedEmission.collectAuxiliarySharded(
+                (leiDictionary.encodeColumns(chunk, leis, ['LEI']) for chunk in lei_chunks), 'LEI', n_shards,
+                auxiliary, temp_folder=graph_storage_folder
+            )
+        else:
+            for lei_data in lei_chunks:
+                auxiliary.add(lei_data)
+
+    tripleEmission.addAuxiliaryTriples(g, auxiliary)
+    return lei_data_rows
+
+def emitCountryTriples(g):
+    tripleEmission.addCountryTriples(g, additional_data)
+    return None
+
+def emitRelationshipTriples(g):
+    if sharded:
+        shardedEmission.addTriplesSharded(
+            g, tripleEmission.addRelationshipTriples, [relationship_data], 'Relationship_StartNode_NodeID',
+            n_shards, shard_pool, lei_dictionary_path=lei_dictionary_path
+        )
+    else:
+        tripleEmission.addRelationshipTriples(g, relationship_data, leis=leis)
+    return len(relationship_data)
+
+emission_stages = [
+    ##### add lei_data triples #####
+    ('leiTriples', emitLEITriples),
+    ##### add locatedIn, sameAs and label to regions and cityIDs #####
+    ('auxiliaryTriples', emitAuxiliaryTriples),
+    ##### add country specific data #####
+    ('countryTriples', emitCountryTriples),
+    ##### add relationship_data triples #####
+    ('relationshipTriples', emitRelationshipTriples)
+]
+
+for name, emit in emission_stages:
+    key = emission_keys[name]
+    if not needsEmission(name):
+        print(name + ' restored from checkpoint')
         continue
 
-    #create nodes 
-    startLEI = getattr(t, 'Relationship_StartNode_NodeID')
-    endLEI = getattr(t, 'Relationship_EndNode_NodeID')
-    s = rdflib.URIRef(ns + 'LEI/' + startLEI) 
-    o = rdflib.URIRef(ns + 'LEI/' + endLEI) 
+    profiler.start(name)
+    if use_parts:
+        g = graphWriter.NTriplesWriter(
+            checkpoints.partPath(name, key, part_extension), graph_name=graph_name,
+            output=checkpoints.openPart(name, key, part_extension, output_compression, compression_threads)
+        )
+
+    triples_before = len(g)
+    rows_in = emit(g)
+    triples_out = len(g) - triples_before
+
+    if use_parts:
+        g.close()
+        checkpoints.commitPart(name, key, part_extension, triples=triples_out)
+    profiler.stop(rows_in=rows_in, triples_out=triples_out)
+print('graph created')
 
-    #add relationship
-    relationshipType = getattr(t, 'Relationship_RelationshipType')
+if shard_pool is not None:
+    shard_pool.close()
+    shard_pool.join()
 
-    if relationshipType == 'IS_DIRECTLY_CONSOLIDATED_BY':
-        p = rdflib.URIRef(ns_predicate + 'isDirectlyConsolidatedBy')
-    elif relationshipType == 'IS_ULTIMATELY_CONSOLIDATED_BY':
-        p = rdflib.URIRef(ns_predicate + 'isUltimatelyConsolidatedBy')
-    elif relationshipType == 'IS_INTERNATIONAL_BRANCH_OF':
-        p = rdflib.URIRef(ns_predicate + 'isInternationalBranchOf')
-
-    g.add( (s, p, o) )
-print('graph created')
+#the lei data of the stages is only kept as checkpoints
+if not checkpoints.enabled:
+    shutil.rmtree(frames.folder, ignore_errors=True)
 
 #save graph
-date_and_time = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
-graph_storage_path = graph_storage_folder + date_and_time + '_taxGraph.xml' 
-with open(graph_storage_path, 'wb') as output:
-    g.serialize(
-        destination=output,format='xml'
-    )
+#the streaming formats have already been written while the graph was created
+profiler.start('serialize')
+if output_format == 'xml':
+    with compressedSink.openSink(graph_storage_path, **sink_options) as output:
+        g.serialize(
+            destination=output,format='xml'
+        )
+elif use_parts:
+    with compressedSink.openSink(graph_storage_path, **sink_options) as output:
+        checkpoints.copyParts(
+            [(name, emission_keys[name], part_extension) for name, _ in emission_stages], output
+        )
 
 #close graph
-g.close()
+if not use_parts:
+    g.close()
+profiler.stop()
+
+#save the state of the build, from which updateRDF.py can build the next graph incrementally
+if use_parts:
+    buildCheckpoints.saveBuildState(graph_storage_folder + date_and_time + '_buildState.json', {
+        'checkpoint_folder':checkpoint_folder,
+        'output_format':output_format,
+        'output_compression':output_compression,
+        'output_part_size':output_part_size,
+        'graph_path':graph_storage_path,
+        'lei_data':('mergeCompanyEntities', merged_lei_data_key),
+        'relationship_data':('loadRelationshipData', relationship_data_key),
+        'parts':[(name, emission_keys[name], part_extension) for name, _ in emission_stages],
+        'path_wikidata_cities':path_wikidata_cities,
+        'path_additonal_data':path_additonal_data,
+        'max_distance':max_distance,
+        'subset':None if subset is None else subset.description()
+    })
+
+#save the build report
+profiler.saveReport(
+    graph_storage_folder + date_and_time + '_buildReport.json', term_cache=graphWriter.termCacheInfo()
+)
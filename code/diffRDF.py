@@ -0,0 +1,27 @@
+import graphDiff
+
+#compares two builds of the knowledge graph in the N-Triples or N-Quads format (optionally gzip or zstd compressed)
+#and stores the added and removed triples, which can be applied to a triple store instead of reloading the graph
+#a graph that is split into parts is given by its manifest or the path without part number, e.g. _taxGraph.nt.gz
+
+#specify paths
+path_old_graph = '../data/graphData/2020-03-17_00:56:06_taxGraph.nt'
+path_new_graph = '../data/graphData/2020-06-17_00:56:06_taxGraph.nt'
+path_added = '../data/graphData/2020-06-17_00:56:06_added.nt'
+path_removed = '../data/graphData/2020-06-17_00:56:06_removed.nt'
+path_counts = '../data/graphData/2020-06-17_00:56:06_changes.csv'
+#folder for the temporary partition files, which take as much space as both graphs, None uses the system default
+temp_folder = None
+
+#maximum size of a partition that is compared in memory
+max_partition_bytes = 2**28
+
+counts = graphDiff.diffGraphs(
+    path_old_graph, path_new_graph, path_added, path_removed,
+    temp_folder=temp_folder, max_partition_bytes=max_partition_bytes
+)
+graphDiff.saveCounts(counts, path_counts)
+
+for predicate in sorted(counts):
+    added, removed = counts[predicate]
+    print(predicate + ': ' + str(added) + ' added, ' + str(removed) + ' removed')
@@ -0,0 +1,136 @@
+import io
+import os
+import json
+import zlib
+import tempfile
+import collections
+
+import compressedSink
+
+#diff of two N-Triples (or N-Quads) files with bounded memory
+#the lines of both files are distributed over partition files by a hash of the line, so that equal triples of both
+#files end up in partitions with the same number, which are small enough to be compared in memory one at a time
+#the files may be compressed with gzip or zstd and split into parts as written by compressedSink.py
+
+def graphFiles(path):
+    #the files of the graph path in their order, a graph that is split into parts is given by its manifest
+    #(graph_manifest.json) or by the path it was written to (graph.nt.gz for graph.part0000.nt.gz, ...)
+    if path.endswith('_manifest.json'):
+        manifest_path = path
+    elif os.path.exists(path):
+        return [path]
+    else:
+        manifest_path = compressedSink.manifestPath(path)
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            parts = json.load(manifest_file)['parts']
+        return [os.path.join(os.path.dirname(manifest_path), part['file']) for part in parts]
+
+    #without manifest the parts are found by their numbers
+    paths = []
+    while os.path.exists(compressedSink.partPath(path, len(paths))):
+        paths.append(compressedSink.partPath(path, len(paths)))
+    if len(paths) == 0:
+        raise FileNotFoundError(path + ' is neither a graph file nor a graph that is split into parts')
+    return paths
+
+def openGraphFile(path, mode='rb'):
+    #a single file for reading or writing (mode 'wb'), which is compressed according to its extension
+    if mode == 'rb':
+        return compressedSink.openReader(path)
+    compression = compressedSink.compressionOf(path)
+    if compression is None:
+        return open(path, mode)
+    return io.BufferedWriter(compressedSink.CompressedSink(path, compression, manifest=False), 2**20)
+
+def graphLines(path):
+    #the lines of all files of the graph path
+    for file_path in graphFiles(path):
+        with openGraphFile(file_path) as graph_file:
+            for line in graph_file:
+                yield line
+
+def normalizeLine(line):
+    #lines without triples (empty lines and comments) are skipped, line endings are unified
+    line = line.strip()
+    if not line or line.startswith(b'#'):
+        return None
+    return line + b'\n'
+
+def graphSize(path):
+    #the approximate size of the lines of the graph path, compressed N-Triples are about ten times smaller
+    return sum(
+        os.path.getsize(file_path) * (10 if compressedSink.compressionOf(file_path) is not None else 1)
+        for file_path in graphFiles(path)
+    )
+
+def partitionCount(paths, max_partition_bytes):
+    #the number of partitions, so that each partition of the largest graph has about max_partition_bytes
+    size = max(graphSize(path) for path in paths)
+    return max(1, -(-size // max_partition_bytes))
+
+def partitionFile(path, folder, prefix, n_partitions, buffer_size=2**20):
+    #write each line of the graph path to the partition file folder/prefix_<crc32 of line % n_partitions>
+    partition_paths = [os.path.join(folder, prefix + '_%d' % i) for i in range(n_partitions)]
+    partitions = [open(partition_path, 'wb', buffering=buffer_size) for partition_path in partition_paths]
+
+    try:
+        for line in graphLines(path):
+            line = normalizeLine(line)
+            if line is not None:
+                partitions[zlib.crc32(line) % n_partitions].write(line)
+    finally:
+        for partition in partitions:
+            partition.close()
+
+    return partition_paths
+
+def readPartition(path):
+    with open(path, 'rb') as partition:
+        lines = set(partition)
+    os.remove(path)
+    return lines
+
+def predicateOf(line):
+    #IRIs and blank nodes contain no spaces, so the predicate is the second term of the line
+    return line.split(b' ', 2)[1].decode('utf-8')
+
+def diffGraphs(path_old, path_new, path_added, path_removed, temp_folder=None, max_partition_bytes=2**28):
+    #write the triples of path_new that are not in path_old to path_added and the triples of path_old
+    #that are not in path_new to path_removed, both sorted within each partition
+    #returns the number of added and removed triples per predicate
+    #memory is bounded by the set of lines of one partition, which takes about three times max_partition_bytes
+    n_partitions = partitionCount([path_old, path_new], max_partition_bytes)
+    counts = collections.defaultdict(lambda: [0, 0])
+
+    with tempfile.TemporaryDirectory(dir=temp_folder) as folder:
+        old_partitions = partitionFile(path_old, folder, 'old', n_partitions)
+        new_partitions = partitionFile(path_new, folder, 'new', n_partitions)
+
+        with openGraphFile(path_added, 'wb') as added_file, openGraphFile(path_removed, 'wb') as removed_file:
+            for old_partition, new_partition in zip(old_partitions, new_partitions):
+                old_lines = readPartition(old_partition)
+                new_lines = readPartition(new_partition)
+
+                added = sorted(new_lines - old_lines)
+                removed = sorted(old_lines - new_lines)
+                del old_lines, new_lines
+
+                added_file.writelines(added)
+                removed_file.writelines(removed)
+
+                for line in added:
+                    counts[predicateOf(line)][0] += 1
+                for line in removed:
+                    counts[predicateOf(line)][1] += 1
+
+    return dict(counts)
+
+def saveCounts(counts, path):
+    #csv with the number of added and removed triples per predicate
+    with open(path, 'w') as output:
+        output.write('predicate,added,removed\n')
+        for predicate in sorted(counts):
+            added, removed = counts[predicate]
+            output.write('"%s",%d,%d\n' % (predicate.replace('"', '""'), added, removed))
@@ -0,0 +1,159 @@
+import io
+import re
+import shutil
+import functools
+import pandas as pd
+import rdflib
+
+#characters that are not allowed unescaped inside of an N-Triples IRI
+_iri_escape_pattern = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+
+#characters that have to be escaped inside of an N-Triples string literal
+_literal_escape_pattern = re.compile(r'[\\"\n\r]')
+_literal_escape_dict = {'\\':'\\\\', '"':'\\"', '\n':'\\n', '\r':'\\r'}
+
+def escapeIRI(uri):
+    #escape characters that would make the IRI invalid as a unicode escape sequence
+    if _iri_escape_pattern.search(uri):
+        uri = _iri_escape_pattern.sub(lambda m: '\\u%04X' % ord(m.group()), uri)
+    return uri
+
+def escapeLiteral(value):
+    if _literal_escape_pattern.search(value):
+        value = _literal_escape_pattern.sub(lambda m: _literal_escape_dict[m.group()], value)
+    return value
+
+def serializeURI(uri):
+    return '<' + escapeIRI(uri) + '>'
+
+def serializeLiteral(value, datatype=None, language=None):
+    value = escapeLiteral(value)
+
+    if language is not None:
+        return '"' + value + '"@' + language
+    if datatype is not None:
+        #str() since adding strings to a rdflib.URIRef creates new URIRefs
+        return '"' + value + '"^^' + serializeURI(str(datatype))
+    return '"' + value + '"'
+
+def serializeTerm(term):
+    #rdflib.Literal has a language and a datatype, rdflib.URIRef has neither
+    if hasattr(term, 'datatype'):
+        return serializeLiteral(str(term), term.datatype, term.language)
+    return serializeURI(str(term))
+
+def serializeColumn(values, escape, escape_pattern, start, end):
+    #serialize a Series of strings without nulls as start + escaped value + end
+    #categorical columns are serialized once per category instead of once per row
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = serializeColumn(
+            pd.Series(values.cat.categories, dtype=object), escape, escape_pattern, start, end
+        )
+        return pd.Series(categories.values[values.cat.codes.values], index=values.index, dtype=object)
+
+    values = values.astype(object)
+
+    #only the few values that contain special characters are escaped one by one
+    mask = values.str.contains(escape_pattern.pattern).values
+    if mask.any():
+        values = values.copy()
+        values[mask] = values[mask].map(escape)
+
+    return start + values + end
+
+def serializeURIColumn(values, prefix=''):
+    #serialize a Series of strings without nulls as IRIs prefix + value
+    return serializeColumn(values, escapeIRI, _iri_escape_pattern, '<' + escapeIRI(prefix), '>')
+
+def serializeLiteralColumn(values):
+    #serialize a Series of strings without nulls as plain literals
+    return serializeColumn(values, escapeLiteral, _literal_escape_pattern, '"', '"')
+
+#maximum number of terms kept by each of the term interning caches
+term_cache_size = 2**20
+
+@functools.lru_cache(maxsize=term_cache_size)
+def internURI(prefix, value):
+    #return one shared rdflib.URIRef per (prefix, value) instead of a new object for every occurrence
+    #this pays off for terms that repeat millions of times, like countries, regions or legal forms
+    #the hits and misses of the cache are reported by internURI.cache_info()
+    return rdflib.URIRef(prefix + value)
+
+@functools.lru_cache(maxsize=term_cache_size, typed=True)
+def internLiteral(value):
+    #return one shared rdflib.Literal per value, typed=True keeps e.g. 1 and 1.0 apart
+    return rdflib.Literal(value)
+
+def termCacheInfo():
+    return {'URIRef':internURI.cache_info()._asdict(), 'Literal':internLiteral.cache_info()._asdict()}
+
+class NTriplesWriter:
+    #writes every added triple directly to an N-Triples file (or an N-Quads file
+    #if graph_name is given) instead of keeping it in memory like rdflib.Graph
+    #the writer offers the add and close methods of rdflib.Graph, so that the
+    #graph construction code works with both
+    #the lines are written to output instead of path if it is given, a binary file such as the compressed
+    #sinks of compressedSink.py
+    def __init__(self, path, graph_name=None, buffer_size=2**20, output=None):
+        self.path = path
+        self.graph_name = graph_name
+        self.triple_count = 0
+
+        if graph_name is None:
+            self._line_end = ' .\n'
+        else:
+            self._line_end = ' ' + serializeURI(graph_name) + ' .\n'
+
+        if output is None:
+            self._file = open(path, 'w', encoding='utf-8', newline='\n', buffering=buffer_size)
+        else:
+            self._file = io.TextIOWrapper(output, encoding='utf-8', newline='\n')
+
+    def add(self, triple):
+        s, p, o = triple
+        self._file.write(
+            serializeTerm(s) + ' ' + serializeTerm(p) + ' ' + serializeTerm(o) + self._line_end
+        )
+        self.triple_count += 1
+
+    def addColumn(self, subjects, predicate, values, asLiteral, prefix=''):
+        #add the triples (subject, predicate, prefix + value) for all values that are not null
+        #in one vectorized pass, subjects are serialized IRIs with the same index as values
+        notnull = values.notna().values
+        values = values[notnull]
+
+        if asLiteral:
+            objects = serializeLiteralColumn(values)
+        else:
+            objects = serializeURIColumn(values, prefix)
+
+        lines = subjects[notnull] + (' ' + serializeURI(str(predicate)) + ' ') + objects + self._line_end
+        self._file.write(''.join(lines.values))
+        self.triple_count += len(lines)
+
+    def addLines(self, subjects, predicates, objects):
+        #add the triples of serialized subjects, predicates and objects with the same index in one pass
+        lines = subjects + ' ' + predicates + ' ' + objects + self._line_end
+        self._file.write(''.join(lines.values))
+        self.triple_count += len(lines)
+
+    def addFile(self, path, triple_count):
+        #append the lines of an N-Triples file written by another writer with the same graph_name,
+        #e.g. a shard written by a worker process
+        self._file.flush()
+        with open(path, 'rb') as shard:
+            shutil.copyfileobj(shard, self._file.buffer, 2**24)
+        self.triple_count += triple_count
+
+    def __len__(self):
+        return self.triple_count
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,6 +1,18 @@
 import pandas as pd
 import numpy as np
 import Levenshtein
+import hashlib
+import pickle
+import os
+import re
+import shutil
+import multiprocessing
+import tempfile
+
+#version of the layout of the postal code index, which is part of the path of cached indexes
+wikidata_city_index_version = 2
+
+_digits_pattern = re.compile('[0-9]+')
 
 def createWikidataCityDict(path):
     df = pd.read_csv(path,sep=';',dtype='str')
@@ -38,168 +50,576 @@ def createWikidataCityDict(path):
         df = df.loc[~mask,:]
 
         #Add all comma unfolded rows
-        df = df.append(res)
+        df = pd.concat([df, pd.DataFrame(res, columns=df.columns)], ignore_index=True)
 
         return df
 
-    def unfoldRange(df,separator):
-        #this function gets used when the current row will not be unfolded
-        #since all rows of mask will be deleted, the rows that do no get unfolded
-        #would get lost otherwise
-        def addCurrentRow(res,row):
-            res.append({
-                'city':getattr(row,'city'),
-                'postalcode':getattr(row,'postalcode'),
-                'cityLabel':getattr(row,'cityLabel')
-            })
+    def splitRange(df,separator):
+        #rows with a range of postal codes (e.g. 68159–68169) are not unfolded into one row per postal code
+        #instead each range is kept as an interval of integers together with the number of digits,
+        #since unfolding a range would add the postal codes str(i).zfill(digits) for all i in the interval
+        range_columns = ['city', 'cityLabel', 'lower', 'upper', 'digits']
 
         #find all rows that contain ONE separator in postal code
         mask = df['postalcode'].str.count(separator)
         mask = mask == 1
 
+        #rows that cannot be interpreted as a range are kept as they are
         res = []
+        ranges = []
         for row in df.loc[mask,:].itertuples(index=False):
             first, second = getattr(row,'postalcode').split(separator)
 
-            city = getattr(row,'city')
-            cityLabel = getattr(row,'cityLabel')
+            #only process row when first and second have both no - and the same length
+            #ranges with more than 18 digits do not fit into int64 and are kept as they are
+            if first.count('-') != 0 or second.count('-') != 0 or len(first) != len(second) or len(first) > 18:
+                res.append(row)
+                continue
 
-            #only process row when first and second have both no -
-            first_mask = first.count('-')
-            second_mask = second.count('-')
-            if first_mask == 0 and second_mask == 0:
-                first_len = len(first)
-                second_len = len(second)
-
-                if first_len != second_len:
-                    addCurrentRow(res,row)
-                    continue
-                
-                try:
-                    first_int = int(first)
-                except:
-                    addCurrentRow(res,row)
-                    continue
-
-                try:
-                    second_int = int(second)
-                except:
-                    addCurrentRow(res,row)
-                    continue
-
-                assert first_int >= 0 and second_int >= 0
-
-                #do not unfold row when more than 100000 post codes would be added
-                #if (second_int - first_int) > 10000:
-                #    addCurrentRow(res,row)
-                #    continue
-
-                for i in range(first_int,second_int+1):
-                    #use zfill to account for post codes that start with 0
-                    #e.g. int("01184") results in 1184
-                    res.append({
-                        'city':city,
-                        'postalcode':str(i).zfill(first_len),
-                        'cityLabel':cityLabel
-                    })
-            else:
-                addCurrentRow(res,row)
+            try:
+                first_int = int(first)
+                second_int = int(second)
+            except ValueError:
+                res.append(row)
                 continue
-            
+
+            assert first_int >= 0 and second_int >= 0
+
+            ranges.append((getattr(row,'city'), getattr(row,'cityLabel'), first_int, second_int, len(first)))
+
         #remove all rows with separator in postal code
         df = df.loc[~mask,:]
 
-        #Add all range unfolded rows
-        df = df.append(res)
+        #Add all rows that are not a range
+        df = pd.concat([df, pd.DataFrame(res, columns=df.columns)], ignore_index=True)
 
-        return df
+        return df, pd.DataFrame(ranges, columns=range_columns)
 
     df = unfoldComma(df)
-    df = unfoldRange(df, '–')
+    df, df_ranges = splitRange(df, '–')
 
     #drop duplicates again
     df.drop_duplicates(inplace=True)
 
-    #build dictionary from df
-    grouping = df.groupby(by = 'postalcode')
-
-    postalcode_dict = {}
-    for code, data in grouping:
-        postalcode_dict[code] = data
-    
-    return postalcode_dict
+    return createPostalCodeIndex(
+        df['postalcode'].values, df['city'].values, df['cityLabel'].values, df_ranges
+    )
 
-def loadLEIData(path):
-    #specify which columns to load from LEI data
-    cols_lei_data = [
-        0,1,34,37,38,39,40,41,42,43,44,46,49,50,51,52,
-        53,54,55,56,187,192,208
-    ]
+def createStringPool(strings):
+    #store a list of strings as one contiguous utf-8 buffer and the offsets of the strings in it
+    encoded = [x.encode('utf-8') for x in strings]
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    return data, offsets
+
+def getPoolStrings(data, offsets, start, end):
+    #return the strings start to end (exclusive) of a string pool
+    base = offsets[start]
+    buffer = data[base:offsets[end]].tobytes()
+    bounds = offsets[start:end+1] - base
+
+    return [buffer[bounds[i]:bounds[i+1]].decode('utf-8') for i in range(end - start)]
+
+def createPostalCodeIndex(postalcodes, cities, cityLabels, df_ranges):
+    #the index consists of the sorted unique postal codes and for each postal code an offset range
+    #into the city and cityLabel arrays, which contain the wikidata entries sorted by postal code
+    #the stable sort keeps the order of the entries within a postal code, which decides ties in matchCityID
+    postalcodes = np.array([x.encode('utf-8') for x in postalcodes], dtype=bytes)
+    order = np.argsort(postalcodes, kind='stable')
+    postalcodes = postalcodes[order]
+
+    unique_postalcodes, starts = np.unique(postalcodes, return_index=True)
+    offsets = np.append(starts, len(postalcodes)).astype(np.int64)
+
+    city_data, city_offsets = createStringPool(cities[order])
+    cityLabel_data, cityLabel_offsets = createStringPool(cityLabels[order])
+
+    #the postal code ranges are sorted by number of digits and lower bound
+    #range_position keeps the original order of the ranges
+    range_order = np.lexsort((df_ranges['lower'].values, df_ranges['digits'].values))
+    df_ranges = df_ranges.iloc[range_order]
+
+    range_city_data, range_city_offsets = createStringPool(df_ranges['city'].values)
+    range_cityLabel_data, range_cityLabel_offsets = createStringPool(df_ranges['cityLabel'].values)
+
+    return {
+        'postalcodes':unique_postalcodes,
+        'offsets':offsets,
+        'city_data':city_data,
+        'city_offsets':city_offsets,
+        'cityLabel_data':cityLabel_data,
+        'cityLabel_offsets':cityLabel_offsets,
+        'range_digits':df_ranges['digits'].values.astype(np.int64),
+        'range_lower':df_ranges['lower'].values.astype(np.int64),
+        'range_upper':df_ranges['upper'].values.astype(np.int64),
+        'range_position':range_order.astype(np.int64),
+        'range_city_data':range_city_data,
+        'range_city_offsets':range_city_offsets,
+        'range_cityLabel_data':range_cityLabel_data,
+        'range_cityLabel_offsets':range_cityLabel_offsets
+    }
+
+def lookupPostalCodeRanges(index, postal_code):
+    #return the cityIDs and cityLabels of all postal code ranges that contain the postal code
+    #a range only contains postal codes that consist of as many digits as its bounds
+    if _digits_pattern.fullmatch(postal_code) is None or len(postal_code) > 18:
+        return [], []
+
+    #find the ranges with the same number of digits
+    range_digits = index['range_digits']
+    start = np.searchsorted(range_digits, len(postal_code), side='left')
+    end = np.searchsorted(range_digits, len(postal_code), side='right')
+
+    #of these, find the ranges with lower <= value <= upper
+    value = int(postal_code)
+    end = start + np.searchsorted(index['range_lower'][start:end], value, side='right')
+    matches = start + np.flatnonzero(index['range_upper'][start:end] >= value)
+
+    #restore the original order of the ranges
+    matches = matches[np.argsort(index['range_position'][matches])]
+
+    cityIDs = [getPoolStrings(index['range_city_data'], index['range_city_offsets'], i, i+1)[0] for i in matches]
+    cityLabels = [getPoolStrings(index['range_cityLabel_data'], index['range_cityLabel_offsets'], i, i+1)[0] for i in matches]
+
+    return cityIDs, cityLabels
+
+def lookupPostalCode(index, postal_code):
+    #return the cityIDs and cityLabels of all wikidata entries with the postal code
+    #entries with exactly this postal code come first, followed by the ranges that contain the postal code
+    key = postal_code.encode('utf-8')
+    postalcodes = index['postalcodes']
+
+    i = np.searchsorted(postalcodes, key)
+    if i < len(postalcodes) and postalcodes[i] == key:
+        start = index['offsets'][i]
+        end = index['offsets'][i+1]
+
+        cityIDs = getPoolStrings(index['city_data'], index['city_offsets'], start, end)
+        cityLabels = getPoolStrings(index['cityLabel_data'], index['cityLabel_offsets'], start, end)
+    else:
+        cityIDs = []
+        cityLabels = []
+
+    #entries of ranges that equal an entry with the exact postal code or of a previous range are skipped,
+    #like the duplicated rows of unfolded ranges were dropped
+    seen = set(zip(cityIDs, cityLabels))
+    for cityID, cityLabel in zip(*lookupPostalCodeRanges(index, postal_code)):
+        if (cityID, cityLabel) not in seen:
+            seen.add((cityID, cityLabel))
+            cityIDs.append(cityID)
+            cityLabels.append(cityLabel)
+
+    return cityIDs, cityLabels
+
+def wikidataCityIndexPath(cache_folder, wikidata_cities_hash):
+    #the index is only valid for the wikidata city file it was created from
+    #and for the version of the index layout
+    return os.path.join(
+        cache_folder, 'wikidataCityIndex_v' + str(wikidata_city_index_version) + '_' + wikidata_cities_hash
+    )
 
-    #load LEI data
-    lei_data = pd.read_csv(
-        path, sep=',', header=0, index_col=False, usecols=cols_lei_data, dtype=str
+def saveWikidataCityIndex(index, folder):
+    #store each array of the index as .npy file, so that the arrays can be memory-mapped
+    #the arrays are written to a temporary folder of this build, so that builds running at the same time do not
+    #write to the same folder, and the folder is renamed once it is complete
+    parent, name = os.path.split(os.path.abspath(folder))
+    os.makedirs(parent, exist_ok=True)
+    tmp_folder = tempfile.mkdtemp(prefix=name + '.', suffix='.tmp', dir=parent)
+    for array_name, array in index.items():
+        np.save(os.path.join(tmp_folder, array_name + '.npy'), array)
+
+    #an existing index is replaced, os.replace cannot replace a folder that is not empty
+    if os.path.exists(folder):
+        shutil.rmtree(folder, ignore_errors=True)
+    try:
+        os.replace(tmp_folder, folder)
+    except OSError:
+        if not os.path.isdir(folder):
+            raise
+        #another build has stored the index in the meantime, the path has the hash of the wikidata city file,
+        #so its index is the same and is kept
+        shutil.rmtree(tmp_folder)
+
+def loadWikidataCityIndex(folder, mmap=True):
+    index = {}
+    for file_name in os.listdir(folder):
+        name = file_name[:-len('.npy')]
+        index[name] = np.load(os.path.join(folder, file_name), mmap_mode='r' if mmap else None)
+    return index
+
+#columns of the LEI data that are used to build the knowledge graph
+lei_data_columns = [
+    'LEI',
+    'Entity.LegalName',
+    'Entity.LegalAddress.FirstAddressLine',
+    'Entity.LegalAddress.MailRouting',
+    'Entity.LegalAddress.AdditionalAddressLine.1',
+    'Entity.LegalAddress.AdditionalAddressLine.2',
+    'Entity.LegalAddress.AdditionalAddressLine.3',
+    'Entity.LegalAddress.City',
+    'Entity.LegalAddress.Region',
+    'Entity.LegalAddress.Country',
+    'Entity.LegalAddress.PostalCode',
+    'Entity.HeadquartersAddress.FirstAddressLine',
+    'Entity.HeadquartersAddress.MailRouting',
+    'Entity.HeadquartersAddress.AdditionalAddressLine.1',
+    'Entity.HeadquartersAddress.AdditionalAddressLine.2',
+    'Entity.HeadquartersAddress.AdditionalAddressLine.3',
+    'Entity.HeadquartersAddress.City',
+    'Entity.HeadquartersAddress.Region',
+    'Entity.HeadquartersAddress.Country',
+    'Entity.HeadquartersAddress.PostalCode',
+    'Entity.RegistrationAuthority.RegistrationAuthorityID',
+    'Entity.LegalForm.EntityLegalFormCode',
+    'Registration.ManagingLOU'
+]
+
+#columns of the LEI data with few distinct values, which are stored as categoricals
+lei_data_categorical_columns = [
+    'Entity.LegalAddress.Region',
+    'Entity.LegalAddress.Country',
+    'Entity.HeadquartersAddress.Region',
+    'Entity.HeadquartersAddress.Country',
+    'Entity.RegistrationAuthority.RegistrationAuthorityID',
+    'Entity.LegalForm.EntityLegalFormCode',
+    'Registration.ManagingLOU'
+]
+
+def readCSVChunksPyArrow(path, columns, chunksize):
+    #pyarrow is only needed for this parser engine
+    import pyarrow as pa
+    import pyarrow.csv
+
+    reader = pyarrow.csv.open_csv(
+        path,
+        convert_options=pyarrow.csv.ConvertOptions(
+            include_columns=columns,
+            column_types={col:pa.string() for col in columns},
+            strings_can_be_null=True
+        )
     )
-    #replace dots with underscores in the column names
-    lei_data_column_names = [s.replace('.', '_') for s in lei_data.columns]
-    #rename data frame columns
-    lei_data.columns = lei_data_column_names
 
-    return lei_data
+    #the record batches of pyarrow have a fixed size in bytes,
+    #therefore they are regrouped into chunks with a fixed number of rows
+    batches = []
+    num_rows = 0
+    num_chunks = 0
+    for batch in reader:
+        batches.append(batch)
+        num_rows += batch.num_rows
+
+        while num_rows >= chunksize:
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+            yield table.slice(0, chunksize).to_pandas()
+            num_chunks += 1
+
+            rest = table.slice(chunksize)
+            batches = rest.to_batches()
+            num_rows = rest.num_rows
+
+    #a file without rows gives one empty chunk, like the pandas parsers
+    if num_rows > 0 or num_chunks == 0:
+        yield pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+def loadLEIDataChunks(path, chunksize=500000, engine='c', row_filter=None):
+    #load LEI data in chunks of chunksize rows
+    #engine can be 'c' or 'python' (pandas parsers) or 'pyarrow' (multithreaded parser of pyarrow)
+    #row_filter is a function that returns a boolean mask of the rows of a chunk to keep (see subsetBuild.py)
+    if engine == 'pyarrow':
+        chunks = readCSVChunksPyArrow(path, lei_data_columns, chunksize)
+    else:
+        dtype = {col:str for col in lei_data_columns}
+        for col in lei_data_categorical_columns:
+            dtype[col] = 'category'
+
+        chunks = pd.read_csv(
+            path, sep=',', header=0, index_col=False, usecols=lei_data_columns, dtype=dtype,
+            chunksize=chunksize, engine=engine
+        )
+
+    start = 0
+    for chunk in chunks:
+        chunk = chunk[lei_data_columns]
+
+        if engine == 'pyarrow':
+            chunk = chunk.astype({col:'category' for col in lei_data_categorical_columns})
+
+        #replace dots with underscores in the column names
+        chunk.columns = [s.replace('.', '_') for s in chunk.columns]
+
+        if row_filter is not None:
+            chunk = chunk[row_filter(chunk)]
+
+        #number the rows of all chunks consecutively
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+
+        yield chunk
+
+def concatChunks(chunks):
+    #pd.concat turns categorical columns into object columns if the categories of the chunks differ
+    #therefore, all chunks get the union of the categories of the chunks first
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([chunk[col] for chunk in chunks]).categories
+            for chunk in chunks:
+                chunk[col] = chunk[col].cat.set_categories(categories)
+
+    return pd.concat(chunks)
+
+def loadLEIData(path, chunksize=500000, engine='c', row_filter=None):
+    #load the complete LEI data as a single data frame
+    return concatChunks(list(loadLEIDataChunks(path, chunksize, engine, row_filter)))
+
+#columns of the relationship data that are used by the graph
+relationship_data_columns = [
+    'Relationship.StartNode.NodeID',
+    'Relationship.EndNode.NodeID',
+    'Relationship.RelationshipType'
+]
+
+#columns of the relationship data with few distinct values, which are stored as categoricals
+relationship_data_categorical_columns = [
+    'Relationship.RelationshipType',
+    'Relationship.RelationshipStatus'
+]
+
+def loadRelationshipDataChunks(path, columns=relationship_data_columns, chunksize=500000, engine='c',
+    row_filter=None):
+    #load the columns of the relationship data in chunks of chunksize rows, the other columns are not parsed
+    #engine can be 'c' or 'python' (pandas parsers) or 'pyarrow' (multithreaded parser of pyarrow)
+    #row_filter is a function that returns a boolean mask of the rows of a chunk to keep (see subsetBuild.py)
+    categorical_columns = [col for col in relationship_data_categorical_columns if col in columns]
+
+    if engine == 'pyarrow':
+        chunks = readCSVChunksPyArrow(path, columns, chunksize)
+    else:
+        dtype = {col:str for col in columns}
+        for col in categorical_columns:
+            dtype[col] = 'category'
+
+        chunks = pd.read_csv(
+            path, sep=',', header=0, index_col=False, usecols=columns, dtype=dtype,
+            chunksize=chunksize, engine=engine
+        )
+
+    start = 0
+    for chunk in chunks:
+        chunk = chunk[columns]
+
+        if engine == 'pyarrow':
+            chunk = chunk.astype({col:'category' for col in categorical_columns})
+
+        #replace dots with underscores in the column names
+        chunk.columns = [s.replace('.', '_') for s in chunk.columns]
+
+        if row_filter is not None:
+            chunk = chunk[row_filter(chunk)]
+
+        #number the rows of all chunks consecutively
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+
+        yield chunk
+
+def loadRelationshipData(path, columns=relationship_data_columns, chunksize=500000, engine='c', row_filter=None):
+    #load the columns of the relationship data as a single data frame
+    return concatChunks(list(loadRelationshipDataChunks(path, columns, chunksize, engine, row_filter)))
+
+def matchCityID(wikidataCityDict, city_name, postal_code, max_distance):
+    if pd.isnull(city_name) or pd.isnull(postal_code):
+        return None, None
+
+    cityIDs, cityLabels = lookupPostalCode(wikidataCityDict, postal_code)
+
+    #for a given city name and postal code from the lei data
+    #find the wikidata label with the same postal code that has the smallest edit distance to city name
+    min_location = findBestMatch(city_name, cityLabels, max_distance)
+
+    if min_location is not None:
+        #return cityID and cityID_label
+        return cityIDs[min_location], cityLabels[min_location]
+    else:
+        return None, None
+
+def levenshteinSupportsCutoff():
+    #the score_cutoff argument was added in Levenshtein 0.18
+    try:
+        Levenshtein.distance('', '', score_cutoff=0)
+        return True
+    except TypeError:
+        return False
+
+_levenshtein_supports_cutoff = levenshteinSupportsCutoff()
+
+def findBestMatch(city_name, cityLabels, max_distance):
+    #return the location of the cityLabel with the smallest normalized edit distance to city_name,
+    #i.e. Levenshtein.distance(city_name.lower(), cityLabel.lower())/max(len(city_name), len(cityLabel)),
+    #or None if the smallest distance is larger than max_distance
+    #like np.argmin over all distances, the first cityLabel wins if several have the smallest distance
+    city_name_len = len(city_name)
+    city_name_lower = city_name.lower()
+    city_name_lower_len = len(city_name_lower)
+
+    min_location = None
+    min_distance = max_distance
+    for location, cityLabel in enumerate(cityLabels):
+        max_len = max(city_name_len, len(cityLabel))
+        cityLabel_lower = cityLabel.lower()
+
+        #the edit distance is at least the difference of the lengths, so labels whose length differs
+        #too much can neither be within max_distance nor better than the best label so far
+        lower_bound = abs(city_name_lower_len - len(cityLabel_lower))/max_len
+        if lower_bound > min_distance or (min_location is not None and lower_bound >= min_distance):
+            continue
+
+        if _levenshtein_supports_cutoff:
+            #stop computing the edit distance as soon as it is too large to be accepted
+            #distances above the cutoff are returned as cutoff + 1, which is always rejected below
+            cutoff = int(min_distance * max_len) + 1
+            distance = Levenshtein.distance(city_name_lower, cityLabel_lower, score_cutoff=cutoff)/max_len
+        else:
+            distance = Levenshtein.distance(city_name_lower, cityLabel_lower)/max_len
+
+        if distance < min_distance or (min_location is None and distance == min_distance):
+            min_location = location
+            min_distance = distance
+
+            #no label can be better than an exact match
+            if distance == 0:
+                break
+
+    return min_location
 
-def createMatchingCityID(lei_data, wikidataCityDict, max_distance):
+#postal code index and max_distance of a matching worker process
+_worker_wikidataCityDict = None
+_worker_max_distance = None
 
-    def matchCityID(city_name, postal_code):
-        if pd.isnull(city_name) or pd.isnull(postal_code):
-            return None, None
+def initMatchingWorker(index_path, max_distance):
+    #each worker memory-maps the postal code index, so that it is shared between
+    #the workers through the page cache instead of being pickled for each task
+    global _worker_wikidataCityDict, _worker_max_distance
+    _worker_wikidataCityDict = loadWikidataCityIndex(index_path)
+    _worker_max_distance = max_distance
 
-        if postal_code in wikidataCityDict:
-            postal_code_data = wikidataCityDict[postal_code] 
+def matchCityIDsWorker(city_names_and_postal_codes):
+    return [
+        matchCityID(_worker_wikidataCityDict, city_name, postal_code, _worker_max_distance)
+        for city_name, postal_code in city_names_and_postal_codes
+    ]
+
+def matchCityIDsParallel(city_names_and_postal_codes, index_path, max_distance, n_workers):
+    #split the list into consecutive parts, which are matched by n_workers processes
+    #pool.map returns the results in the order of the parts, so the result is the same as for the serial matching
+    n_parts = min(len(city_names_and_postal_codes), n_workers * 16)
+    part_bounds = np.linspace(0, len(city_names_and_postal_codes), n_parts + 1).astype(int)
+    parts = [city_names_and_postal_codes[part_bounds[i]:part_bounds[i+1]] for i in range(n_parts)]
+
+    #createRDF.py is a script without main guard, therefore the workers are forked where possible
+    #instead of being spawned, which would rerun the script in every worker
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    with context.Pool(n_workers, initializer=initMatchingWorker, initargs=(index_path, max_distance)) as pool:
+        results = pool.map(matchCityIDsWorker, parts, chunksize=1)
+
+    return [match for part in results for match in part]
+
+def createMatchingCityID(lei_data, wikidataCityDict, max_distance, cache=None, n_workers=1, index_path=None):
+    #cache is a dict of already matched keys (see below), new matches are added to it
+    #with n_workers > 1 the matching is split across n_workers processes, which memory-map the
+    #postal code index stored at index_path (or at a temporary path, if index_path is None)
+
+    n = len(lei_data)
+    city_names = pd.concat([lei_data['Entity_LegalAddress_City'], lei_data['Entity_HeadquartersAddress_City']], ignore_index=True)
+    postal_codes = pd.concat([lei_data['Entity_LegalAddress_PostalCode'], lei_data['Entity_HeadquartersAddress_PostalCode']], ignore_index=True)
+
+    #the result of matchCityID only depends on the lowercased city name, the length of the city name
+    #and the postal code, therefore each such key is only matched once
+    #the length is part of the key, since lowercasing changes the length of a few characters (e.g. İ)
+    valid = (city_names.notna() & postal_codes.notna()).values
+    keys = pd.Series(np.nan, index=city_names.index, dtype=object)
+    valid_city_names = city_names[valid].astype(str)
+    keys[valid] = (valid_city_names.str.lower() + '\x00' + postal_codes[valid].astype(str)
+        + '\x00' + valid_city_names.str.len().astype(str))
+
+    #rows without a key get the code -1
+    codes, unique_keys = pd.factorize(keys)
+
+    #find the first row of each key
+    _, first_index = np.unique(codes[valid], return_index=True)
+    first_rows = np.flatnonzero(valid)[first_index]
+
+    #the last entry stays None and is used for all rows without a key
+    cityID_array = np.full(len(unique_keys) + 1, None, dtype=object)
+    cityID_label_array = np.full(len(unique_keys) + 1, None, dtype=object)
+
+    if cache is None:
+        cache = {}
+
+    #match all keys that are not in the cache yet
+    city_name_values = city_names.values
+    postal_code_values = postal_codes.values
+    new_keys = [i for i, key in enumerate(unique_keys) if key not in cache]
+    city_names_and_postal_codes = [
+        (city_name_values[first_rows[i]], postal_code_values[first_rows[i]]) for i in new_keys
+    ]
+
+    if n_workers > 1 and len(new_keys) > 0:
+        if index_path is None:
+            with tempfile.TemporaryDirectory() as temp_folder:
+                index_path = os.path.join(temp_folder, 'wikidataCityIndex')
+                saveWikidataCityIndex(wikidataCityDict, index_path)
+                matches = matchCityIDsParallel(city_names_and_postal_codes, index_path, max_distance, n_workers)
         else:
-            return None, None
-        
-        city_name_len = len(city_name)
-        #for a given city name and postal code from the lei data
-        #calculate a normalized edit distance between the city name and
-        #all wikidata labels with the same postal code
-        distances = [
-            Levenshtein.distance(city_name.lower(), cityLabel.lower())/max(city_name_len, len(cityLabel))
-            for cityLabel in postal_code_data['cityLabel'].values
+            matches = matchCityIDsParallel(city_names_and_postal_codes, index_path, max_distance, n_workers)
+    else:
+        matches = [
+            matchCityID(wikidataCityDict, city_name, postal_code, max_distance)
+            for city_name, postal_code in city_names_and_postal_codes
         ]
-        #find the wikidata label with the smallest edit distance to city name
-        min_location = np.argmin(distances)
 
-        if distances[min_location] <= max_distance:
-            #return cityID and cityID_label
-            return postal_code_data.iloc[min_location,0], postal_code_data.iloc[min_location,2]
-        else:
-            return None, None
+    for i, match in zip(new_keys, matches):
+        cache[unique_keys[i]] = match
 
-    legal_cityID_list = []
-    legal_cityID_label_list = []
-    headquarters_cityID_list = []
-    headquarters_cityID_label_list = []
+    for i, key in enumerate(unique_keys):
+        cityID_array[i], cityID_label_array[i] = cache[key]
 
-    for row in lei_data.itertuples():
-        legal_city_name = getattr(row, 'Entity_LegalAddress_City')
-        legal_postal_code = getattr(row, 'Entity_LegalAddress_PostalCode')
+    #broadcast the results of the keys back to the rows
+    cityID_list = cityID_array[codes].tolist()
+    cityID_label_list = cityID_label_array[codes].tolist()
 
-        headquarters_city_name = getattr(row, 'Entity_HeadquartersAddress_City')
-        headquarters_postal_code = getattr(row, 'Entity_HeadquartersAddress_PostalCode')
+    return cityID_list[:n], cityID_label_list[:n], cityID_list[n:], cityID_label_list[n:]
 
-        legal_cityID, legal_cityID_label = matchCityID(legal_city_name, legal_postal_code)
+def fileHash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
 
-        #if city name and postal code are the same for legal and headquarters address do not rerun matchCityID
-        if ((legal_city_name == headquarters_city_name) and (legal_postal_code == headquarters_postal_code)):
-            headquarters_cityID = legal_cityID
-            headquarters_cityID_label = legal_cityID_label
-        else:
-            headquarters_cityID, headquarters_cityID_label = matchCityID(headquarters_city_name, headquarters_postal_code)
-        
-        legal_cityID_list.append(legal_cityID)
-        legal_cityID_label_list.append(legal_cityID_label)
-        headquarters_cityID_list.append(headquarters_cityID)
-        headquarters_cityID_label_list.append(headquarters_cityID_label)
+def cityMatchCachePath(cache_folder, wikidata_cities_hash, max_distance):
+    #the matches are only valid for the wikidata city file and max_distance they were created with
+    return os.path.join(
+        cache_folder, 'cityMatches_' + wikidata_cities_hash + '_' + str(max_distance) + '.pkl'
+    )
+
+def loadCityMatchCache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+
+    with open(cache_path, 'rb') as f:
+        return pickle.load(f)
 
-    return legal_cityID_list, legal_cityID_label_list, headquarters_cityID_list, headquarters_cityID_label_list
+def saveCityMatchCache(cache, cache_path):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
 
+    #write to a temporary file first, so that an interrupted run does not leave a broken cache
+    with open(cache_path + '.tmp', 'wb') as f:
+        pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_path + '.tmp', cache_path)
@@ -0,0 +1,246 @@
+import os
+import numpy as np
+
+import leiDictionary
+
+#array-backed index of the consolidation hierarchy of the relationship data, which answers the questions about the
+#parents, subsidiaries and groups of LEIs without recursive SPARQL queries over the graph
+#the LEIs are numbered by their ID in the dictionary of leiDictionary.py, which is not copied into the index, the index
+#refers to the dictionary file of its build and loads it as the array leis,
+#the edges of each relationship type are stored in compressed sparse row (CSR) form, once from child to parent and
+#once from parent to child
+#all arrays have fixed-width types and are stored as .npy files, so that the index can be memory-mapped
+
+#version of the layout of the index
+hierarchy_index_version = 2
+
+#relationship types of the index
+relations = {
+    'direct':'IS_DIRECTLY_CONSOLIDATED_BY',
+    'ultimate':'IS_ULTIMATELY_CONSOLIDATED_BY',
+    'branch':'IS_INTERNATIONAL_BRANCH_OF'
+}
+
+def createCSR(sources, targets, n):
+    #offsets into targets for each of the n sources, the targets of a source keep the order of the edges
+    order = np.argsort(sources, kind='stable')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+    return offsets, targets[order].astype(np.int64)
+
+def firstTargets(offsets, targets):
+    #the first target of each source or -1
+    n = len(offsets) - 1
+    first = np.full(n, -1, dtype=np.int64)
+    has_target = offsets[1:] > offsets[:-1]
+    first[has_target] = targets[offsets[:-1][has_target]]
+    return first
+
+def breakCycles(parent):
+    #remove the parent of one entity of each cycle of parent links, so that every chain of parents ends
+    #the entities that are not on a cycle are removed from the leaves upwards, the remaining ones are on cycles
+    parent = parent.copy()
+    n = len(parent)
+    has_parent = parent >= 0
+    in_degree = np.bincount(parent[has_parent], minlength=n)
+    removed = np.zeros(n, dtype=bool)
+
+    frontier = np.flatnonzero(in_degree == 0)
+    while len(frontier) > 0:
+        removed[frontier] = True
+        parents = parent[frontier]
+        parents = parents[parents >= 0]
+        np.subtract.at(in_degree, parents, 1)
+        parents = np.unique(parents)
+        frontier = parents[(in_degree[parents] == 0) & ~removed[parents]]
+
+    for i in np.flatnonzero(~removed):
+        if removed[i]:
+            continue
+        #walk the cycle of i and cut it at its smallest entity
+        cycle = [i]
+        j = parent[i]
+        while j != i:
+            cycle.append(j)
+            j = parent[j]
+        removed[cycle] = True
+        parent[min(cycle)] = -1
+
+    return parent
+
+def createAncestorChains(parent):
+    #the chain of parents of each entity, from its parent up to the top of the hierarchy, in CSR form
+    levels = []
+    current = parent
+    depth = np.zeros(len(parent), dtype=np.int64)
+    while True:
+        active = current >= 0
+        if not active.any():
+            break
+        levels.append(current)
+        depth += active
+        current = np.where(active, parent[np.maximum(current, 0)], -1)
+
+    offsets = np.zeros(len(parent) + 1, dtype=np.int64)
+    np.cumsum(depth, out=offsets[1:])
+    ancestors = np.empty(offsets[-1], dtype=np.int64)
+    for k, level in enumerate(levels):
+        rows = np.flatnonzero(depth > k)
+        ancestors[offsets[rows] + k] = level[rows]
+
+    return offsets, ancestors
+
+def createHierarchyIndex(lei_data, relationship_data, leis):
+    #lei_data gives the jurisdiction (country of the legal address) of each LEI,
+    #relationship_data the edges of the hierarchy
+    #the LEI columns of both data frames are IDs of the dictionary leis (see leiDictionary.py)
+    lei_columns = ['Relationship_StartNode_NodeID', 'Relationship_EndNode_NodeID']
+    relationship_data = relationship_data[lei_columns + ['Relationship_RelationshipType']]
+    lei_data = lei_data[['LEI', 'Entity_LegalAddress_Country']]
+    n = len(leis)
+
+    index = {'version':np.array(hierarchy_index_version)}
+
+    #jurisdiction of each LEI as position in the sorted array of countries or -1
+    countries = lei_data[(lei_data['LEI'].values >= 0) & lei_data['Entity_LegalAddress_Country'].notna().values]
+    countries = countries.drop_duplicates('LEI', keep='first')
+    country_values = leiDictionary.encodeStrings(countries['Entity_LegalAddress_Country'].values)
+    index['countries'] = np.unique(country_values)
+    index['jurisdiction'] = np.full(n, -1, dtype=np.int64)
+    index['jurisdiction'][countries['LEI'].values] = np.searchsorted(index['countries'], country_values)
+
+    #parents and children of each relationship type, relationships with a LEI that is null are skipped
+    for relation, relationship_type in relations.items():
+        edges = relationship_data[relationship_data['Relationship_RelationshipType'] == relationship_type]
+        edges = edges[(edges[lei_columns[0]].values >= 0) & (edges[lei_columns[1]].values >= 0)]
+        edges = edges.drop_duplicates(lei_columns)
+        children = edges[lei_columns[0]].values.astype(np.int64)
+        parents = edges[lei_columns[1]].values.astype(np.int64)
+
+        index[relation + '_parent_offsets'], index[relation + '_parents'] = createCSR(children, parents, n)
+        index[relation + '_child_offsets'], index[relation + '_children'] = createCSR(parents, children, n)
+
+    #the chains of direct parents, an entity with several direct parents follows the first one
+    direct_parent = breakCycles(firstTargets(index['direct_parent_offsets'], index['direct_parents']))
+    index['ancestor_offsets'], index['ancestors'] = createAncestorChains(direct_parent)
+
+    #the group of an entity is led by the top of its chain of group parents, which is the same for an entity and its
+    #children, the group parent is the direct parent, or else the head office of an international branch, or else the
+    #reported ultimate parent of an entity without direct parent
+    group_parent = direct_parent.copy()
+    for relation in ['branch', 'ultimate']:
+        targets = firstTargets(index[relation + '_parent_offsets'], index[relation + '_parents'])
+        group_parent = np.where(group_parent >= 0, group_parent, targets)
+    offsets, chains = createAncestorChains(breakCycles(group_parent))
+    has_chain = offsets[1:] > offsets[:-1]
+    group = np.arange(n)
+    group[has_chain] = chains[offsets[1:][has_chain] - 1]
+    index['group'] = group
+    del offsets, chains
+
+    #the members of each group, in the order of their IDs
+    index['group_offsets'], index['group_members'] = createCSR(group, np.arange(n), n)
+
+    return index
+
+def saveHierarchyIndex(index, folder, lei_dictionary_path):
+    #store each array of the index as .npy file, so that the arrays can be memory-mapped
+    #the path of the LEI dictionary is stored relative to the folder of the index, which is next to the dictionary
+    os.makedirs(folder + '.tmp', exist_ok=True)
+    for name, array in index.items():
+        np.save(os.path.join(folder + '.tmp', name + '.npy'), array)
+    lei_dictionary_path = os.path.relpath(lei_dictionary_path, os.path.dirname(os.path.abspath(folder)))
+    np.save(os.path.join(folder + '.tmp', 'lei_dictionary.npy'), np.array(lei_dictionary_path))
+    os.replace(folder + '.tmp', folder)
+
+def loadHierarchyIndex(folder, mmap=True):
+    index = {}
+    for file_name in os.listdir(folder):
+        name = file_name[:-len('.npy')]
+        index[name] = np.load(os.path.join(folder, file_name), mmap_mode='r' if mmap else None)
+
+    if int(index['version']) != hierarchy_index_version:
+        raise ValueError(folder + ' has the index version ' + str(int(index['version'])))
+    lei_dictionary_path = os.path.join(os.path.dirname(os.path.abspath(folder)), str(index.pop('lei_dictionary')))
+    index['leis'] = leiDictionary.loadLEIDictionary(lei_dictionary_path, mmap)
+    return index
+
+#queries of the index, LEIs are passed and returned as strings
+
+def leiID(index, lei):
+    #the ID of lei or -1 if it is not in the index
+    key = lei.encode('utf-8')
+    i = int(np.searchsorted(index['leis'], key))
+    if i < len(index['leis']) and index['leis'][i] == key:
+        return i
+    return -1
+
+def leisOf(index, ids):
+    return list(leiDictionary.decodeLEIs(index['leis'], ids))
+
+def rowOf(index, offsets, values, lei):
+    i = leiID(index, lei)
+    if i < 0:
+        return np.zeros(0, dtype=np.int64)
+    return index[values][index[offsets][i]:index[offsets][i+1]]
+
+def parents(index, lei, relation='direct'):
+    #the LEIs that lei has a relationship of the type relation to
+    return leisOf(index, rowOf(index, relation + '_parent_offsets', relation + '_parents', lei))
+
+def children(index, lei, relation='direct'):
+    #the LEIs that have a relationship of the type relation to lei
+    return leisOf(index, rowOf(index, relation + '_child_offsets', relation + '_children', lei))
+
+def ancestors(index, lei):
+    #the chain of direct parents of lei, from its direct parent up to the top of the hierarchy
+    return leisOf(index, rowOf(index, 'ancestor_offsets', 'ancestors', lei))
+
+def topParent(index, lei):
+    #the LEI of the group of lei, which is lei itself if it has no parent, or None if lei is not in the index
+    i = leiID(index, lei)
+    if i < 0:
+        return None
+    return leisOf(index, [index['group'][i]])[0]
+
+def subsidiaries(index, lei, relation='direct'):
+    #all LEIs below lei in the hierarchy of the relationship type relation, in breadth-first order
+    i = leiID(index, lei)
+    if i < 0:
+        return []
+
+    offsets = index[relation + '_child_offsets']
+    child_ids = index[relation + '_children']
+    visited = {i}
+    result = []
+    frontier = [i]
+    while len(frontier) > 0:
+        next_frontier = []
+        for j in frontier:
+            for child in child_ids[offsets[j]:offsets[j+1]]:
+                child = int(child)
+                if child not in visited:
+                    visited.add(child)
+                    next_frontier.append(child)
+        result += next_frontier
+        frontier = next_frontier
+
+    return leisOf(index, result)
+
+def groupMembers(index, lei):
+    #all LEIs of the group of lei, including its top parent and lei itself
+    i = leiID(index, lei)
+    if i < 0:
+        return []
+    group = index['group'][i]
+    return leisOf(index, index['group_members'][index['group_offsets'][group]:index['group_offsets'][group+1]])
+
+def groupJurisdictions(index, lei):
+    #the sorted jurisdictions (countries of the legal addresses) of the members of the group of lei
+    i = leiID(index, lei)
+    if i < 0:
+        return []
+    group = index['group'][i]
+    members = index['group_members'][index['group_offsets'][group]:index['group_offsets'][group+1]]
+    jurisdictions = np.unique(index['jurisdiction'][members])
+    return [index['countries'][j].decode('utf-8') for j in jurisdictions if j >= 0]
@@ -0,0 +1,153 @@
+import io
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+import helpFunctions
+import graphWriter
+import tripleEmission
+import compressedSink
+import graphDiff
+
+#updating the lei data, relationship data and graph parts of a previous build with GLEIF delta files
+#the delta files have the format of the golden copy files and contain the added and changed records
+#the graph parts may be compressed, they are read and written like the graph file (see compressedSink.py)
+
+relationship_key_columns = [
+    'Relationship_StartNode_NodeID', 'Relationship_EndNode_NodeID', 'Relationship_RelationshipType'
+]
+
+def loadRegistrationStatus(path):
+    #the registration status is not part of lei_data, it is only needed to find the retired LEIs of a delta file
+    return pd.read_csv(
+        path, sep=',', header=0, index_col=False, usecols=['LEI', 'Registration.RegistrationStatus'], dtype=str
+    ).set_index('LEI')['Registration.RegistrationStatus']
+
+def changedRows(previous, delta, key_columns, columns):
+    #the rows of delta whose key is new or whose columns differ from the row with the same key in previous
+    #delta files also contain records that only changed in columns that are not part of the graph
+    previous = previous.drop_duplicates(key_columns, keep='last').set_index(key_columns)[columns]
+    current = delta.drop_duplicates(key_columns, keep='last').set_index(key_columns)[columns]
+
+    is_new = ~current.index.isin(previous.index)
+    previous = previous.reindex(current.index)
+
+    #compare the values as strings, so that categoricals and object columns compare equal
+    previous_values = previous.astype(object).where(previous.notna(), '\x00').astype(str).values
+    current_values = current.astype(object).where(current.notna(), '\x00').astype(str).values
+    is_changed = (previous_values != current_values).any(axis=1)
+
+    return current.index[is_new | is_changed]
+
+def readPart(part_path):
+    return io.TextIOWrapper(compressedSink.openReader(part_path), encoding='utf-8', newline='\n')
+
+def filterPart(part_path, output, removed, subjects):
+    #copy the lines of part_path whose subject is not in subjects to output and the other lines to removed
+    with readPart(part_path) as part:
+        for line in part:
+            if line.split(' ', 1)[0] in subjects:
+                removed.write(line)
+            else:
+                output.write(line)
+
+def emitTriples(path, graph_name, addTriples):
+    #emit triples into the file path and return their number
+    g = graphWriter.NTriplesWriter(path, graph_name=graph_name)
+    addTriples(g)
+    g.close()
+    return len(g)
+
+def updateLEIData(lei_data, delta_lei_data, removed_leis, wikidataCityDict, max_distance, additional_data,
+    city_match_cache=None, n_workers=1, index_path=None):
+    #returns the updated lei_data, the changed rows with matched cities and company entities
+    #and the LEIs whose triples have to be replaced
+    columns = [c for c in delta_lei_data.columns if c != 'LEI']
+    changed_leis = changedRows(lei_data, delta_lei_data, ['LEI'], columns)
+    changed_leis = changed_leis[~changed_leis.isin(removed_leis)]
+
+    changed = delta_lei_data[delta_lei_data['LEI'].isin(changed_leis)].drop_duplicates('LEI', keep='last')
+    changed = changed.reset_index(drop=True)
+
+    #only the changed rows are matched, most of their city names and postal codes are already in the cache
+    (changed['Entity_LegalAddress_CityID'], changed['Entity_LegalAddress_CityID_Label'],
+    changed['Entity_HeadquartersAddress_CityID'], changed['Entity_HeadquartersAddress_CityID_Label']) = (
+        helpFunctions.createMatchingCityID(
+            changed, wikidataCityDict, max_distance, cache=city_match_cache, n_workers=n_workers,
+            index_path=index_path
+        ))
+    #only the company entities of the changed LEIs are read from the additional data
+    company_entities = additional_data.read(
+        'df_companyEntities', columns=['companyEntity', 'LEI'], filters=[('LEI', 'in', list(changed['LEI']))]
+    )
+    changed = changed.merge(company_entities, how='left', on='LEI')
+
+    replaced_leis = changed_leis.append(pd.Index(removed_leis)).unique()
+    lei_data = lei_data.drop(index=lei_data.index[lei_data['LEI'].isin(replaced_leis).values])
+    lei_data = helpFunctions.concatChunks([lei_data, changed.reindex(columns=lei_data.columns)])
+    lei_data.index = pd.RangeIndex(len(lei_data))
+
+    return lei_data, changed, replaced_leis
+
+def updateRelationshipData(relationship_data, delta_relationship_data, retired_statuses=(), removed_leis=()):
+    #returns the updated relationship_data and the start LEIs whose relationship triples have to be replaced
+    #relationships are identified by their start node, end node and type
+    #the relationship data of the build only has the key columns, so a relationship of the delta file has changed
+    #if it is new or retired (or if one of the other columns of relationship_data differs)
+    #the relationships of which the start or end node is one of removed_leis are removed with these LEIs
+    columns = [
+        c for c in relationship_data.columns if c not in relationship_key_columns and c in delta_relationship_data
+    ]
+    changed_keys = changedRows(relationship_data, delta_relationship_data, relationship_key_columns, columns)
+
+    delta = delta_relationship_data.drop_duplicates(relationship_key_columns, keep='last')
+    retired = delta['Relationship_RelationshipStatus'].isin(retired_statuses).values
+    retired_keys = pd.MultiIndex.from_frame(delta.loc[retired, relationship_key_columns])
+    changed_keys = changed_keys.union(retired_keys, sort=False)
+
+    delta = delta.set_index(relationship_key_columns).loc[changed_keys].reset_index()
+
+    keys = pd.MultiIndex.from_frame(relationship_data[relationship_key_columns])
+    relationship_data = relationship_data[~keys.isin(changed_keys)]
+
+    retired = delta['Relationship_RelationshipStatus'].isin(retired_statuses).values
+    delta = delta.reindex(columns=relationship_data.columns)
+    relationship_data = helpFunctions.concatChunks([relationship_data, delta[~retired]]).reset_index(drop=True)
+    replaced_start_leis = delta['Relationship_StartNode_NodeID']
+
+    removed = (relationship_data['Relationship_StartNode_NodeID'].isin(removed_leis).values
+        | relationship_data['Relationship_EndNode_NodeID'].isin(removed_leis).values)
+    if removed.any():
+        replaced_start_leis = pd.concat(
+            [replaced_start_leis, relationship_data.loc[removed, 'Relationship_StartNode_NodeID']], ignore_index=True
+        )
+        relationship_data = relationship_data[~removed].reset_index(drop=True)
+
+    return relationship_data, replaced_start_leis.unique()
+
+def updatePart(part_path, new_part, subjects, emitted_path, removed_path):
+    #replace the triples of subjects in a graph part by the triples of the file emitted_path, the updated part is
+    #written to the binary file new_part and the replaced triples to removed_path
+    with io.TextIOWrapper(new_part, encoding='utf-8', newline='\n') as output:
+        with open(removed_path, 'w', encoding='utf-8', newline='\n') as removed:
+            filterPart(part_path, output, removed, subjects)
+        output.flush()
+        with open(emitted_path, 'rb') as emitted:
+            shutil.copyfileobj(emitted, output.buffer, 2**20)
+
+def diffParts(path_old, path_new, changeset, temp_folder=None):
+    #append the triples of path_new that are not in path_old to the binary file changeset['added'] and the triples
+    #of path_old that are not in path_new to changeset['removed'], returns the numbers of added and removed triples
+    #the triples are compared with graphDiff.diffGraphs, so that memory is bounded for large parts as well
+    with tempfile.TemporaryDirectory(dir=temp_folder) as folder:
+        paths = {name:os.path.join(folder, name + '.nt') for name in ['added', 'removed']}
+        counts = graphDiff.diffGraphs(path_old, path_new, paths['added'], paths['removed'], temp_folder=folder)
+        for name, path in paths.items():
+            with open(path, 'rb') as lines:
+                shutil.copyfileobj(lines, changeset[name], 2**20)
+    return sum(added for added, _ in counts.values()), sum(removed for _, removed in counts.values())
+
+def serializedLEIs(leis):
+    return set(graphWriter.serializeURIColumn(pd.Series(np.asarray(leis), dtype=object), tripleEmission.ns + 'LEI/'))
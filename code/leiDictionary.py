@@ -0,0 +1,58 @@
+import os
+import numpy as np
+
+#dictionary of the LEIs of a build, which numbers each LEI by its position in the sorted array of all LEIs
+#the array has a fixed-width bytes type and is stored as .npy file, so that it can be memory-mapped
+#in the data frames, the LEI columns are int32 IDs of the dictionary, which are found by a binary search in the array,
+#so that the joins and deduplications work on integers and no LEI string is held per row
+#the IDs are decoded back to strings for the rows of each chunk that is written to the graph
+
+def encodeStrings(values):
+    #the strings of the array values as fixed-width utf-8 bytes
+    if len(values) == 0:
+        return np.array([], dtype='S1')
+    return np.char.encode(values.astype(str), 'utf-8')
+
+def createLEIDictionary(columns):
+    #the sorted unique LEIs of the iterable columns of Series of strings, e.g. the LEI column of each chunk of a data
+    #frame, the unique LEIs of each column are collected as bytes
+    leis = [np.unique(encodeStrings(column.dropna().values.astype(object))) for column in columns]
+    return np.unique(np.concatenate(leis + [np.array([], dtype='S1')]))
+
+def saveLEIDictionary(leis, path):
+    with open(path + '.tmp', 'wb') as output:
+        np.save(output, leis)
+    os.replace(path + '.tmp', path)
+
+def loadLEIDictionary(path, mmap=True):
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+def encodeLEIs(leis, values):
+    #the IDs of the LEIs of the Series values, -1 for nulls and LEIs that are not in the dictionary
+    ids = np.full(len(values), -1, dtype=np.int32)
+    notnull = np.flatnonzero(values.notna().values)
+    if len(notnull) == 0 or len(leis) == 0:
+        return ids
+
+    keys = encodeStrings(values.values[notnull])
+    positions = np.minimum(np.searchsorted(leis, keys), len(leis) - 1)
+    found = leis[positions] == keys
+    ids[notnull[found]] = positions[found]
+    return ids
+
+def decodeLEIs(leis, ids):
+    #the LEIs of the IDs as object array, -1 becomes None
+    ids = np.asarray(ids)
+    values = np.full(len(ids), None, dtype=object)
+    known = ids >= 0
+    if known.any():
+        values[known] = np.char.decode(leis[ids[known]], 'utf-8')
+    return values
+
+def encodeColumns(df, leis, columns):
+    #df with the LEIs of columns replaced by their IDs
+    return df.assign(**{col:encodeLEIs(leis, df[col]) for col in columns})
+
+def decodeColumns(df, leis, columns):
+    #df with the IDs of columns replaced by their LEIs
+    return df.assign(**{col:decodeLEIs(leis, df[col].values) for col in columns})
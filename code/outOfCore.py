@@ -0,0 +1,219 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+
+#operations on data frames that are processed in chunks and spill to disk once they exceed a memory budget (in bytes)
+
+def frameBytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+def rowsPerChunk(df, memory_budget, sample_size=10000):
+    #the number of rows of df that take about memory_budget bytes, estimated from a sample of rows
+    if len(df) == 0:
+        return 1
+    sample = df.iloc[:sample_size]
+    bytes_per_row = max(1, frameBytes(sample) // len(sample))
+    return max(1000, memory_budget // bytes_per_row)
+
+def frameChunks(df, chunksize):
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start+chunksize]
+
+def hashPartitions(keys, n_partitions):
+    #hash_pandas_object uses a fixed hash key, so the partition of a key is the same in every run
+    #integer keys, e.g. the IDs of the LEI dictionary (see leiDictionary.py), are hashed as integers
+    if not pd.api.types.is_integer_dtype(keys.dtype):
+        keys = keys.astype(object)
+    return (pd.util.hash_pandas_object(keys, index=False).values % np.uint64(n_partitions)).astype(np.int64)
+
+class DiskPartitions:
+    #appends the rows of data frames to n_partitions files in folder and reads them back one partition at a time
+    def __init__(self, folder, n_partitions, prefix):
+        self.paths = [os.path.join(folder, prefix + '_%d.pkl' % i) for i in range(n_partitions)]
+        self.sizes = np.zeros(n_partitions, dtype=np.int64)
+
+    def append(self, df, codes):
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(self.paths) + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            with open(self.paths[i], 'ab') as partition:
+                pickle.dump(df.iloc[order[bounds[i]:bounds[i+1]]], partition, pickle.HIGHEST_PROTOCOL)
+            self.sizes[i] += bounds[i+1] - bounds[i]
+
+    def chunks(self, i):
+        #yield the data frames that were appended to partition i one at a time, in the order they were appended
+        if self.sizes[i] == 0:
+            return
+        with open(self.paths[i], 'rb') as partition:
+            while True:
+                try:
+                    yield pickle.load(partition)
+                except EOFError:
+                    break
+
+    def read(self, i):
+        #the appended rows of partition i in the order they were appended
+        if self.sizes[i] == 0:
+            return None
+        return pd.concat(list(self.chunks(i)))
+
+def hashJoinLeft(left_chunks, right, on, memory_budget, temp_folder=None):
+    #yield left_chunk.merge(right, how='left', on=on) for each chunk of left_chunks
+    #if right takes more than half of memory_budget, both sides are hash-partitioned to disk by on (a grace hash
+    #join), so that each partition of right is read once and joined with the rows of all chunks in the same partition,
+    #the joined rows are then partitioned by their chunk and sorted back into the order of the chunk
+    n_partitions = -(-frameBytes(right) // max(1, memory_budget // 2))
+    if n_partitions <= 1:
+        for chunk in left_chunks:
+            yield chunk.merge(right, how='left', on=on)
+        return
+
+    with tempfile.TemporaryDirectory(dir=temp_folder) as folder:
+        right_partitions = DiskPartitions(folder, n_partitions, 'right')
+        right_partitions.append(right, hashPartitions(right[on], n_partitions))
+        empty = right.iloc[:0]
+
+        left_partitions = DiskPartitions(folder, n_partitions, 'left')
+        n_chunks = 0
+        template = None
+        for chunk in left_chunks:
+            if template is None:
+                template = chunk.iloc[:0].merge(empty, how='left', on=on)
+            left_partitions.append(
+                chunk.assign(_chunk=n_chunks, _chunk_position=np.arange(len(chunk))),
+                hashPartitions(chunk[on], n_partitions)
+            )
+            n_chunks += 1
+
+        joined_partitions = DiskPartitions(folder, n_chunks, 'joined')
+        for i in range(n_partitions):
+            left_part = left_partitions.read(i)
+            if left_part is None:
+                continue
+            right_part = right_partitions.read(i)
+            joined = left_part.merge(right_part if right_part is not None else empty, how='left', on=on)
+            joined_partitions.append(joined, joined['_chunk'].values)
+
+        for i in range(n_chunks):
+            joined = joined_partitions.read(i)
+            if joined is None:
+                yield template
+                continue
+
+            #the rows of one left row are adjacent and in the order of right, as in the merge of the whole frames
+            joined = joined.sort_values('_chunk_position', kind='stable')
+            joined = joined.drop(columns=['_chunk', '_chunk_position']).reset_index(drop=True)
+            #the categoricals of the chunks become object columns when the rows of chunks with different
+            #categories are concatenated in a partition
+            yield joined.astype({
+                col:'category' for col in template.columns
+                if isinstance(template[col].dtype, pd.CategoricalDtype)
+            })
+
+def writeParquetChunks(chunks, path):
+    #write data frames with the same columns to one parquet file, one row group per chunk
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            if writer is None:
+                #columns without any value in the first chunk are stored as strings instead of nulls and
+                #the codes of categoricals as int32, since the categories of later chunks may need wider codes
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                for i, field in enumerate(schema):
+                    if pa.types.is_null(field.type):
+                        schema = schema.set(i, pa.field(field.name, pa.string()))
+                    elif pa.types.is_dictionary(field.type):
+                        schema = schema.set(i, pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type)))
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+class PairCounter:
+    #counts the (key, value) pairs that are added in chunks, e.g. the regions of the cityIDs of the LEI data
+    #the partial counts are combined in memory and spilled to disk partitions by key once they take more than
+    #memory_budget, the counts of a key are therefore always in one partition
+    def __init__(self, memory_budget=2**30, n_partitions=16, temp_folder=None):
+        self.memory_budget = memory_budget
+        self.n_partitions = n_partitions
+        self.temp_folder = temp_folder
+
+        self._partial = []
+        self._partial_bytes = 0
+        self._folder = None
+        self._partitions = None
+
+    def add(self, keys, values, counts=None):
+        #pairs with a null key or value are not counted, counts are the numbers of already counted pairs
+        pairs = pd.DataFrame({'key':np.asarray(keys, dtype=object), 'value':np.asarray(values, dtype=object)})
+        if counts is None:
+            counts = pairs.dropna().groupby(['key', 'value'], sort=False).size()
+        else:
+            pairs['count'] = np.asarray(counts)
+            counts = pairs.dropna().groupby(['key', 'value'], sort=False)['count'].sum()
+        if len(counts) == 0:
+            return
+
+        self._partial.append(counts)
+        self._partial_bytes += int(counts.memory_usage(index=True, deep=True))
+
+        if self._partial_bytes > self.memory_budget:
+            self._combine()
+            if self._partial_bytes > self.memory_budget // 2:
+                self._spill()
+
+    def _combine(self):
+        counts = pd.concat(self._partial).groupby(level=[0, 1], sort=False).sum()
+        self._partial = [counts]
+        self._partial_bytes = int(counts.memory_usage(index=True, deep=True))
+
+    def _spill(self):
+        if self._partitions is None:
+            self._folder = tempfile.TemporaryDirectory(dir=self.temp_folder)
+            self._partitions = DiskPartitions(self._folder.name, self.n_partitions, 'counts')
+
+        counts = pd.concat(self._partial).rename('count').reset_index()
+        self._partitions.append(counts, hashPartitions(counts['key'], self.n_partitions))
+        self._partial = []
+        self._partial_bytes = 0
+
+    def counts(self):
+        #yield the complete counts as Series with the index (key, value), one Series per partition of the keys
+        if self._partitions is None:
+            if len(self._partial) > 0:
+                self._combine()
+                yield self._partial[0]
+            return
+
+        if len(self._partial) > 0:
+            self._spill()
+        for i in range(self.n_partitions):
+            counts = self._partitions.read(i)
+            if counts is not None:
+                yield counts.groupby(['key', 'value'], sort=False)['count'].sum()
+
+    def majority(self):
+        #the value with the most counts for each key as Series sorted by key,
+        #the smallest value wins if several values have the most counts
+        results = []
+        for counts in self.counts():
+            best = counts.sort_index().groupby(level=0).idxmax()
+            results.append(pd.Series(best.str[1].values, index=best.index, dtype=object))
+
+        if len(results) == 0:
+            return pd.Series(dtype=object)
+        return pd.concat(results).sort_index()
+
+    def close(self):
+        if self._folder is not None:
+            self._folder.cleanup()
+            self._folder = None
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import multiprocessing
+
+import graphWriter
+import tripleEmission
+import leiDictionary
+import outOfCore
+
+#parallel triple emission: the rows are hash-partitioned by LEI into n_shards shards, each shard is written to its own
+#N-Triples file by a worker process and the shards are appended to the graph in the order of their number
+#the shard of a row only depends on its LEI and n_shards (see outOfCore.hashPartitions), so the output is the same
+#for any number of workers
+
+def partitionShards(chunks, key_column, n_shards, folder):
+    #the rows of the data frames of chunks partitioned to disk by shard, the rows of each shard keep their order
+    partitions = outOfCore.DiskPartitions(folder, n_shards, 'shard')
+    for chunk in chunks:
+        partitions.append(chunk, outOfCore.hashPartitions(chunk[key_column], n_shards))
+    return partitions
+
+def emitShard(addTriples, partitions, i, path, graph_name, memory_budget=None, lei_dictionary_path=None):
+    #the rows of shard i are read from partitions and passed to addTriples one appended piece at a time
+    #with a memory_budget, the auxiliary entities of the rows are collected and returned with the triple count
+    #with a lei_dictionary_path, the LEI columns of the rows are IDs of the dictionary, which is memory-mapped
+    g = graphWriter.NTriplesWriter(path, graph_name=graph_name)
+    options = {}
+    if lei_dictionary_path is not None:
+        options['leis'] = leiDictionary.loadLEIDictionary(lei_dictionary_path)
+    if memory_budget is None:
+        auxiliary = None
+    else:
+        auxiliary = tripleEmission.AuxiliaryEntities(memory_budget)
+        options['auxiliary'] = auxiliary
+    for rows in partitions.chunks(i):
+        addTriples(g, rows, **options)
+    g.close()
+    return len(g), auxiliary
+
+def emitShardWorker(args):
+    return emitShard(*args)
+
+def createPool(n_workers):
+    #the pool of the worker processes, which has to be created before the build starts any threads (e.g. of the
+    #compressed sinks or of the memory sampler of buildProfiler), since forking a process with threads is unsafe
+    #createRDF.py is a script without main guard, therefore the workers are forked where possible
+    #instead of being spawned, which would rerun the script in every worker
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    return context.Pool(n_workers)
+
+def addTriplesSharded(g, addTriples, chunks, key_column, n_shards, pool=None, auxiliary=None,
+    lei_dictionary_path=None):
+    #add the triples that addTriples(g, chunk) would add for each data frame of chunks to the graphWriter.NTriplesWriter
+    #g, addTriples has to be a module level function (e.g. tripleEmission.addLEITriples), so that it can be pickled
+    #the rows of chunks are partitioned to disk by shard first, so that neither the coordinator nor the workers hold
+    #more than one chunk of rows at a time, the shards are emitted by the workers of pool (see createPool) or, if pool
+    #is None, in this process
+    #if auxiliary (a tripleEmission.AuxiliaryEntities) is given, the entities of each shard are collected by its
+    #worker and added to auxiliary in the order of the shards
+    #if the LEI columns of chunks are IDs of a LEI dictionary, lei_dictionary_path is the path of the dictionary, which
+    #each worker memory-maps instead of receiving a copy
+    memory_budget = auxiliary.memory_budget if auxiliary is not None else None
+
+    #the shards are written next to the graph, so that appending them does not copy them across file systems
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(g.path))) as folder:
+        partitions = partitionShards(chunks, key_column, n_shards, folder)
+        tasks = [
+            (
+                addTriples, partitions, i, os.path.join(folder, 'shard_%d.nt' % i), g.graph_name, memory_budget,
+                lei_dictionary_path
+            )
+            for i in range(n_shards)
+        ]
+
+        if pool is None:
+            results = [emitShard(*task) for task in tasks]
+        else:
+            results = pool.map(emitShardWorker, tasks, chunksize=1)
+
+        for task, (triple_count, shard_auxiliary) in zip(tasks, results):
+            g.addFile(task[3], triple_count)
+            if auxiliary is not None:
+                auxiliary.update(shard_auxiliary)
+
+def collectAuxiliarySharded(chunks, key_column, n_shards, auxiliary, temp_folder=None):
+    #collect the auxiliary entities of the data frames of chunks in the same order as addTriplesSharded
+    with tempfile.TemporaryDirectory(dir=temp_folder) as folder:
+        partitions = partitionShards(chunks, key_column, n_shards, folder)
+        for i in range(n_shards):
+            for rows in partitions.chunks(i):
+                auxiliary.add(rows)
@@ -0,0 +1,111 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+import helpFunctions
+
+#filters of subset builds, which only build the graph of the LEIs that pass a filter
+#the filters are applied to each chunk of the GLEIF files while they are read, so the rows of the other LEIs are
+#dropped before the cities are matched and never held in memory
+#a LEI passes the filter if its legal or headquarters address is in one of the countries, it is in the list of LEIs
+#and it is in the hash sample, filters that are None are not applied
+#the relationships are kept if both of their LEIs are kept, with neighbors the relationships of the kept LEIs to other
+#LEIs are kept as well and the LEI data of these neighbors is added to the subset
+
+country_columns = ['Entity_LegalAddress_Country', 'Entity_HeadquartersAddress_Country']
+
+def readLEIList(path):
+    #one LEI per line, empty lines and lines starting with # are skipped
+    with open(path, encoding='utf-8') as f:
+        return pd.Index(sorted({line.strip() for line in f if line.strip() and not line.startswith('#')}))
+
+def hashSample(leis, sample_rate):
+    #a deterministic sample of about sample_rate of the LEIs, hash_pandas_object uses a fixed hash key,
+    #so a LEI is in the sample of every build with the same sample_rate
+    hashes = pd.util.hash_pandas_object(pd.Series(leis).astype(object), index=False).values
+    return hashes.astype(np.float64) / 2.0**64 < sample_rate
+
+def isinFilter(column, values):
+    #filter of the chunks of which the value of column is in values
+    def rowFilter(chunk):
+        return chunk[column].isin(values).values
+    return rowFilter
+
+class SubsetFilter:
+    def __init__(self, countries=None, leis=None, sample_rate=None, neighbors=False):
+        self.countries = None if countries is None else sorted(countries)
+        self.leis = leis
+        self.sample_rate = sample_rate
+        self.neighbors = neighbors
+
+    def description(self):
+        #the parameters of the subset as part of the checkpoint keys, the LEI list is described by its hash
+        return {
+            'countries':self.countries,
+            'leis':None if self.leis is None else hashlib.sha256(
+                '\n'.join(sorted(self.leis)).encode('utf-8')).hexdigest(),
+            'sample_rate':self.sample_rate,
+            'neighbors':self.neighbors
+        }
+
+    def leiMask(self, chunk):
+        #whether the rows of a chunk of the lei data pass the filter
+        mask = np.ones(len(chunk), dtype=bool)
+        if self.countries is not None:
+            mask &= (chunk[country_columns[0]].isin(self.countries).values
+                | chunk[country_columns[1]].isin(self.countries).values)
+        if self.leis is not None:
+            mask &= chunk['LEI'].isin(self.leis).values
+        if self.sample_rate is not None:
+            mask &= hashSample(chunk['LEI'].values, self.sample_rate)
+        return mask
+
+    def loadLEIDataChunks(self, path, relationship_path, chunksize=500000, engine='c'):
+        #the chunks of the lei data of the LEIs that pass the filter, followed by the chunks of their neighbors
+        start = 0
+        leis = []
+        for chunk in helpFunctions.loadLEIDataChunks(path, chunksize, engine, row_filter=self.leiMask):
+            start += len(chunk)
+            leis.append(chunk['LEI'].values)
+            yield chunk
+        if not self.neighbors:
+            return
+
+        #the neighbors are read in a second pass over the lei data, which only keeps their rows
+        neighbors = self.neighborLEIs(relationship_path, np.concatenate(leis), chunksize, engine)
+        del leis
+        for chunk in helpFunctions.loadLEIDataChunks(path, chunksize, engine, row_filter=isinFilter('LEI', neighbors)):
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+
+    def relationshipFilter(self, lei_data):
+        #filter of the relationship data by the LEIs of the subset lei_data, which has the LEI column and the
+        #country columns
+        if not self.neighbors:
+            leis = pd.Index(lei_data['LEI'].astype(object).unique())
+            def rowFilter(chunk):
+                return (chunk['Relationship_StartNode_NodeID'].isin(leis).values
+                    & chunk['Relationship_EndNode_NodeID'].isin(leis).values)
+            return rowFilter
+
+        #the relationships of the LEIs that passed the filter, the neighbors are the other LEIs of lei_data
+        leis = pd.Index(lei_data.loc[self.leiMask(lei_data), 'LEI'].astype(object).unique())
+        def rowFilter(chunk):
+            return (chunk['Relationship_StartNode_NodeID'].isin(leis).values
+                | chunk['Relationship_EndNode_NodeID'].isin(leis).values)
+        return rowFilter
+
+    def neighborLEIs(self, relationship_path, leis, chunksize=500000, engine='c'):
+        #the LEIs that are not in leis and have a relationship to one of leis
+        leis = pd.Index(pd.Series(leis).astype(object).unique())
+        neighbors = []
+        for chunk in helpFunctions.loadRelationshipDataChunks(
+            relationship_path, helpFunctions.relationship_data_columns[:2], chunksize, engine):
+            start = chunk['Relationship_StartNode_NodeID']
+            end = chunk['Relationship_EndNode_NodeID']
+            start_kept = start.isin(leis).values
+            end_kept = end.isin(leis).values
+            neighbors.append(end[start_kept & ~end_kept & end.notna().values].values)
+            neighbors.append(start[end_kept & ~start_kept & start.notna().values].values)
+        return pd.Index(pd.unique(np.concatenate(neighbors + [np.array([], dtype=object)])))
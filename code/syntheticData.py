@@ -0,0 +1,247 @@
+import os
+import numpy as np
+import pandas as pd
+
+import helpFunctions
+
+#synthetic GLEIF and wikidata files for benchmarking the build
+#all files are a deterministic function of the number of entities, the seed and the version below
+#increase the version whenever the generated data changes, so that benchmarks of different versions are not compared
+synthetic_data_version = 2
+
+countries = {
+    'DE':['DE-BW', 'DE-BY', 'DE-BE', 'DE-HE', 'DE-NW'],
+    'NL':['NL-NH', 'NL-ZH', 'NL-UT'],
+    'FR':['FR-IDF', 'FR-ARA'],
+    'LU':[],
+    'IE':[],
+    'GB':['GB-ENG', 'GB-SCT'],
+    'US':['US-DE', 'US-NY', 'US-CA', 'US-TX'],
+    'CH':['CH-ZH', 'CH-GE'],
+    'IT':['IT-25', 'IT-62'],
+    'ES':['ES-MD', 'ES-CT']
+}
+
+relationship_data_columns = [
+    'Relationship.StartNode.NodeID',
+    'Relationship.StartNode.NodeIDType',
+    'Relationship.EndNode.NodeID',
+    'Relationship.EndNode.NodeIDType',
+    'Relationship.RelationshipType',
+    'Relationship.RelationshipStatus'
+]
+
+_syllables = np.array(['ber', 'lin', 'ham', 'burg', 'mann', 'heim', 'frank', 'furt', 'am', 'ster',
+    'dam', 'rot', 'ter', 'par', 'is', 'lux', 'em', 'dub', 'zu', 'rich', 'mi', 'lan', 'ma', 'drid'])
+_alphanumeric = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+
+def randomStrings(rng, n, alphabet, length):
+    return pd.Series(alphabet[rng.randint(0, len(alphabet), size=(n, length))].view('U' + str(length)).ravel())
+
+def checkDigits(leis):
+    #the 2 check digits of ISO 17442 (ISO 7064 mod 97-10) of the first 18 characters of the LEIs, the letters count
+    #as two digits A=10 to Z=35 and the number is followed by 00
+    values = np.searchsorted(_alphanumeric, np.array(leis, dtype='U18').view('U1').reshape(-1, 18))
+    remainder = np.zeros(len(values), dtype=np.int64)
+    for i in range(18):
+        remainder = (remainder * np.where(values[:, i] < 10, 10, 100) + values[:, i]) % 97
+    return pd.Series(98 - remainder * 100 % 97).astype(str).str.zfill(2).values
+
+def createLEIs(rng, n):
+    #4 characters of the LOU, 00, 12 characters of the entity and 2 check digits
+    leis = '5299' + '00' + randomStrings(rng, n, _alphanumeric, 12)
+    return (leis + checkDigits(leis.values)).values
+
+def createCities(rng, n_entities):
+    #cities have a name, a country, a region and one to three postal codes
+    n_cities = max(200, n_entities // 20)
+
+    names = pd.Series([''] * n_cities)
+    for i in range(3):
+        names = names + _syllables[rng.randint(0, len(_syllables), size=n_cities)]
+    names = names.str.capitalize() + np.where(rng.rand(n_cities) < 0.2, ' am Main', '')
+    #make the names unique
+    names = names + np.where(names.duplicated(), ' ' + pd.Series(np.arange(n_cities)).astype(str), '')
+
+    country_list = list(countries.keys())
+    country = np.array(country_list)[rng.randint(0, len(country_list), size=n_cities)]
+    region = [countries[c][rng.randint(len(countries[c]))] if len(countries[c]) > 0 else None for c in country]
+
+    #consecutive postal codes of 5 digits, so that ranges of postal codes can be created
+    postalcode = 10000 + 7 * np.arange(n_cities)
+
+    return pd.DataFrame({
+        'cityID':np.arange(1, n_cities + 1).astype(str),
+        'name':names.values,
+        'country':country,
+        'region':region,
+        'postalcode':postalcode
+    })
+
+def createWikidataCities(path, cities, rng):
+    #the wikidata city file contains single postal codes, lists of postal codes, ranges of postal codes,
+    #duplicated rows, label variants of the same postal code and rows without postal code
+    n = len(cities)
+    city = 'http://www.wikidata.org/entity/Q' + cities['cityID']
+    postalcode = cities['postalcode'].astype(str).str.zfill(5)
+
+    kind = rng.rand(n)
+    postalcode = np.where(kind < 0.10, postalcode + ', ' + (cities['postalcode'] + 1).astype(str), postalcode)
+    postalcode = np.where((kind >= 0.10) & (kind < 0.15),
+        postalcode + '–' + (cities['postalcode'] + rng.randint(1, 200, size=n)).astype(str), postalcode)
+    postalcode = np.where((kind >= 0.15) & (kind < 0.16), None, postalcode)
+
+    df = pd.DataFrame({'city':city, 'postalcode':postalcode, 'cityLabel':cities['name']})
+
+    #districts that share the postal code of their city
+    districts = df.sample(frac=0.05, random_state=rng)
+    districts = districts.assign(
+        city=districts['city'] + '0', cityLabel=districts['cityLabel'] + '-Mitte'
+    )
+
+    duplicates = df.sample(frac=0.02, random_state=rng)
+
+    df = pd.concat([df, districts, duplicates]).sample(frac=1, random_state=rng)
+    df.to_csv(path, sep=';', index=False)
+
+def createLEIData(path, cities, n_entities, rng, chunksize=1000000):
+    leis = createLEIs(rng, n_entities)
+
+    #a few big cities have most of the entities
+    weights = 1 / np.arange(1, len(cities) + 1) ** 1.1
+    weights = weights / weights.sum()
+
+    legal_forms = randomStrings(rng, 50, _alphanumeric, 4).values
+    registration_authorities = np.array(['RA%06d' % i for i in range(300)])
+    managing_lous = leis[:30]
+
+    header = True
+    for start in range(0, n_entities, chunksize):
+        n = min(chunksize, n_entities - start)
+        df = pd.DataFrame({'LEI':leis[start:start+n]})
+
+        df['Entity.LegalName'] = 'Company ' + pd.Series(np.arange(start, start + n)).astype(str) + np.where(
+            rng.rand(n) < 0.01, ' "Holding"', np.where(rng.rand(n) < 0.5, ' GmbH', ' B.V.')
+        )
+
+        #the headquarters address equals the legal address for most entities
+        legal_city = rng.choice(len(cities), size=n, p=weights)
+        headquarters_city = np.where(rng.rand(n) < 0.7, legal_city, rng.choice(len(cities), size=n, p=weights))
+
+        for address, city_index in [('Legal', legal_city), ('Headquarters', headquarters_city)]:
+            prefix = 'Entity.' + address + 'Address.'
+            city = cities.iloc[city_index].reset_index(drop=True)
+
+            df[prefix + 'FirstAddressLine'] = 'Street ' + pd.Series(rng.randint(1, 500, size=n)).astype(str)
+            df[prefix + 'MailRouting'] = np.where(rng.rand(n) < 0.05, 'c/o Service GmbH', None)
+            df[prefix + 'AdditionalAddressLine.1'] = np.where(rng.rand(n) < 0.2, 'Floor 2', None)
+            df[prefix + 'AdditionalAddressLine.2'] = np.where(rng.rand(n) < 0.05, 'Room 3', None)
+            df[prefix + 'AdditionalAddressLine.3'] = np.where(rng.rand(n) < 0.01, 'Desk 4', None)
+
+            #city names are mostly spelled like the wikidata label, but also in upper case,
+            #with a typo or not at all like a wikidata label
+            kind = rng.rand(n)
+            name = city['name']
+            name = np.where(kind < 0.10, name.str.upper(), name)
+            name = np.where((kind >= 0.10) & (kind < 0.15), pd.Series(name).str.slice(0, -1) + 'x', name)
+            name = np.where((kind >= 0.15) & (kind < 0.18), 'Unknown City', name)
+            df[prefix + 'City'] = name
+
+            df[prefix + 'Region'] = np.where(rng.rand(n) < 0.6, city['region'], None)
+            df[prefix + 'Country'] = city['country'].values
+
+            #postal codes are mostly the first postal code of the city, some are within a range
+            #of postal codes, some are unknown and some are missing
+            kind = rng.rand(n)
+            postalcode = city['postalcode'] + np.where(kind < 0.05, 1, 0)
+            postalcode = np.where((kind >= 0.05) & (kind < 0.08), rng.randint(90000, 99999, size=n), postalcode)
+            df[prefix + 'PostalCode'] = np.where(
+                (kind >= 0.08) & (kind < 0.12), None, pd.Series(postalcode).astype(str).str.zfill(5)
+            )
+
+        df['Entity.RegistrationAuthority.RegistrationAuthorityID'] = np.where(
+            rng.rand(n) < 0.9, registration_authorities[rng.randint(0, len(registration_authorities), size=n)], None
+        )
+        df['Entity.LegalForm.EntityLegalFormCode'] = np.where(
+            rng.rand(n) < 0.8, legal_forms[rng.randint(0, len(legal_forms), size=n)], None
+        )
+        df['Registration.ManagingLOU'] = managing_lous[rng.randint(0, len(managing_lous), size=n)]
+
+        #columns that are not used by the build
+        df['Entity.EntityStatus'] = 'ACTIVE'
+        df['Registration.RegistrationStatus'] = np.where(rng.rand(n) < 0.9, 'ISSUED', 'LAPSED')
+
+        df = df[helpFunctions.lei_data_columns + ['Entity.EntityStatus', 'Registration.RegistrationStatus']]
+        df.to_csv(path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+    return leis
+
+def createRelationshipData(path, leis, rng):
+    #about a third of the entities are directly consolidated by an entity that was registered shortly before,
+    #which results in consolidation chains of different depths
+    n = len(leis)
+    parent = np.arange(n)
+    has_parent = (rng.rand(n) < 0.35) & (parent > 0)
+    parent[has_parent] = np.maximum(0, parent[has_parent] - rng.randint(1, 1000, size=has_parent.sum()))
+
+    #find the ultimate parent by pointer jumping
+    ultimate_parent = parent.copy()
+    while True:
+        next_parent = ultimate_parent[ultimate_parent]
+        if np.array_equal(next_parent, ultimate_parent):
+            break
+        ultimate_parent = next_parent
+
+    children = np.flatnonzero(has_parent)
+    ultimate_children = children[ultimate_parent[children] != parent[children]]
+    branches = np.flatnonzero(rng.rand(n) < 0.02)
+    branches = branches[branches > 0]
+
+    df = pd.DataFrame({
+        'Relationship.StartNode.NodeID':np.concatenate([leis[children], leis[ultimate_children], leis[branches]]),
+        'Relationship.EndNode.NodeID':np.concatenate([
+            leis[parent[children]], leis[ultimate_parent[ultimate_children]], leis[rng.randint(0, branches, size=len(branches))]
+        ]),
+        'Relationship.RelationshipType':np.repeat(
+            ['IS_DIRECTLY_CONSOLIDATED_BY', 'IS_ULTIMATELY_CONSOLIDATED_BY', 'IS_INTERNATIONAL_BRANCH_OF'],
+            [len(children), len(ultimate_children), len(branches)]
+        )
+    })
+    df['Relationship.StartNode.NodeIDType'] = 'LEI'
+    df['Relationship.EndNode.NodeIDType'] = 'LEI'
+    df['Relationship.RelationshipStatus'] = np.where(rng.rand(len(df)) < 0.95, 'ACTIVE', 'INACTIVE')
+
+    df[relationship_data_columns].to_csv(path, index=False)
+
+def createCompanyEntities(path, leis, rng):
+    #wikidata company entities of about a tenth of the entities, in the form of df_companyEntities of additional_data
+    has_entity = np.flatnonzero(rng.rand(len(leis)) < 0.1)
+    df = pd.DataFrame({
+        'LEI':leis[has_entity],
+        'companyEntity':'http://www.wikidata.org/entity/Q' + pd.Series(1000000 + has_entity).astype(str).values
+    })
+    df.to_csv(path, index=False)
+
+def createSyntheticData(folder, n_entities, seed=0):
+    #create lei.csv, rr.csv, wikidata_cities.csv and company_entities.csv in folder, existing files are kept
+    #returns the paths of the files
+    paths = {
+        'lei':os.path.join(folder, 'lei.csv'),
+        'relationship':os.path.join(folder, 'rr.csv'),
+        'wikidata_cities':os.path.join(folder, 'wikidata_cities.csv'),
+        'company_entities':os.path.join(folder, 'company_entities.csv')
+    }
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.RandomState(seed)
+
+    cities = createCities(rng, n_entities)
+    createWikidataCities(paths['wikidata_cities'], cities, rng)
+    leis = createLEIData(paths['lei'], cities, n_entities, rng)
+    createRelationshipData(paths['relationship'], leis, rng)
+    createCompanyEntities(paths['company_entities'], leis, rng)
+
+    return paths
@@ -0,0 +1,335 @@
+import numpy as np
+import pandas as pd
+import rdflib
+
+import graphWriter
+import outOfCore
+import leiDictionary
+
+#namespaces of the knowledge graph
+ns = 'http://taxgraph.informatik.uni-mannheim.de/resource/'
+ns_predicate = ns + 'predicate/'
+
+sameAs = rdflib.URIRef('http://www.w3.org/2002/07/owl#sameAs')
+label = rdflib.URIRef('http://www.w3.org/2000/01/rdf-schema#label')
+locatedIn = rdflib.URIRef(ns_predicate + 'locatedIn')
+
+#define predicates for lei_data
+predicatesLEI = dict({
+    'legalName':{'colName':'Entity_LegalName', 'asLiteral': True},
+    'legalAddressMailRouting':{'colName':'Entity_LegalAddress_MailRouting', 'asLiteral': True},
+    'legalAddressAddressLine0':{'colName':'Entity_LegalAddress_FirstAddressLine', 'asLiteral': True},
+    'legalAddressAddressLine1':{'colName':'Entity_LegalAddress_AdditionalAddressLine_1', 'asLiteral': True},
+    'legalAddressAddressLine2':{'colName':'Entity_LegalAddress_AdditionalAddressLine_2', 'asLiteral': True},
+    'legalAddressAddressLine3':{'colName':'Entity_LegalAddress_AdditionalAddressLine_3', 'asLiteral': True},
+    'legalAddressCity':{'colName':'Entity_LegalAddress_City', 'asLiteral': True},
+    'legalAddressRegion':{'colName':'Entity_LegalAddress_Region', 'asLiteral': False, 'prefix':'region/'},
+    'legalAddressCountry':{'colName':'Entity_LegalAddress_Country', 'asLiteral': False, 'prefix':'country/'},
+    'legalAddressPostalCode':{'colName':'Entity_LegalAddress_PostalCode', 'asLiteral': True},
+    'headquartersAddressMailRouting':{'colName':'Entity_HeadquartersAddress_MailRouting', 'asLiteral': True},
+    'headquartersAddressAddressLine0':{'colName':'Entity_HeadquartersAddress_FirstAddressLine', 'asLiteral': True},
+    'headquartersAddressAddressLine1':{'colName':'Entity_HeadquartersAddress_AdditionalAddressLine_1', 'asLiteral': True},
+    'headquartersAddressAddressLine2':{'colName':'Entity_HeadquartersAddress_AdditionalAddressLine_2', 'asLiteral': True},
+    'headquartersAddressAddressLine3':{'colName':'Entity_HeadquartersAddress_AdditionalAddressLine_3', 'asLiteral': True},
+    'headquartersAddressCity':{'colName':'Entity_HeadquartersAddress_City', 'asLiteral': True},
+    'headquartersAddressRegion':{'colName':'Entity_HeadquartersAddress_Region', 'asLiteral': False, 'prefix':'region/'},
+    'headquartersAddressCountry':{'colName':'Entity_HeadquartersAddress_Country', 'asLiteral': False, 'prefix':'country/'},
+    'headquartersAddressPostalCode':{'colName':'Entity_HeadquartersAddress_PostalCode', 'asLiteral': True},
+    'registrationAuthorityID':{'colName':'Entity_RegistrationAuthority_RegistrationAuthorityID', 'asLiteral': False, 'prefix':'registrationAuthorityID/'},
+    'legalForm':{'colName':'Entity_LegalForm_EntityLegalFormCode', 'asLiteral': False, 'prefix':'legalForm/'},
+    'managingLOU':{'colName':'Registration_ManagingLOU', 'asLiteral': False, 'prefix':'LEI/'}, #Notice that the managing LOU is identified by its LEI
+    'legalAddressCityID':{'colName':'Entity_LegalAddress_CityID', 'asLiteral': False, 'prefix':'cityID/'},
+    'headquartersAddressCityID':{'colName':'Entity_HeadquartersAddress_CityID', 'asLiteral': False, 'prefix':'cityID/'}
+})
+
+#check if all predicates that do not link to a literal have a prefix defined
+for key in predicatesLEI.keys():
+    if(not predicatesLEI[key]['asLiteral'] and not ('prefix' in predicatesLEI[key].keys())):
+        raise ValueError(key + ' is missing a prefix key')
+
+#create the URIRef for each predicate
+for key in predicatesLEI.keys():
+    predicate_dict = predicatesLEI[key]
+    predicate_dict['URIRef'] = rdflib.URIRef(ns_predicate + key)
+
+#predicates for the relationship types of relationship_data
+isDirectlyConsolidatedBy = rdflib.URIRef(ns_predicate + 'isDirectlyConsolidatedBy')
+isUltimatelyConsolidatedBy = rdflib.URIRef(ns_predicate + 'isUltimatelyConsolidatedBy')
+isInternationalBranchOf = rdflib.URIRef(ns_predicate + 'isInternationalBranchOf')
+
+#relationships of other types have no predicate and are skipped
+relationshipTypePredicates = {
+    'IS_DIRECTLY_CONSOLIDATED_BY':isDirectlyConsolidatedBy,
+    'IS_ULTIMATELY_CONSOLIDATED_BY':isUltimatelyConsolidatedBy,
+    'IS_INTERNATIONAL_BRANCH_OF':isInternationalBranchOf
+}
+serializedRelationshipTypePredicates = {
+    relationshipType:graphWriter.serializeURI(str(p)) for relationshipType, p in relationshipTypePredicates.items()
+}
+
+#define predicates for the country data of additional_data
+add_country_data_dict = {
+    'df_pop':{'value_name':'pop', 'predicate_URI':ns_predicate + 'population'},
+    'df_gdp':{'value_name':'gdp', 'predicate_URI':ns_predicate + 'GDP'},
+    'df_corporateTaxRate':{'value_name':'corporateTaxRate', 'predicate_URI':ns_predicate + 'corporateTaxRate'},
+    'df_countryNames':{'value_name':'name', 'predicate_URI':'http://www.w3.org/2000/01/rdf-schema#label'},
+    'df_countryEntities':{'value_name':'countryEntity', 'predicate_URI':'http://www.w3.org/2002/07/owl#sameAs'}
+}
+
+def checkLEIColumns(lei_data):
+    #check if all colNames of the predicates can be found in lei_data
+    for key in predicatesLEI.keys():
+        if(not predicatesLEI[key]['colName'] in lei_data.columns):
+            raise ValueError(predicatesLEI[key]['colName'] + ' is not a valid column name')
+
+def addLEITriples(g, lei_data, chunksize=250000, auxiliary=None, leis=None):
+    #g is either a rdflib.Graph or a graphWriter.NTriplesWriter
+    #the regions and cityIDs of the rows are collected in auxiliary (an AuxiliaryEntities), if it is given
+    #if leis is given, the LEI column holds the IDs of the dictionary leis (see leiDictionary.py), which are decoded
+    #for each chunk of rows
+    if not isinstance(g, graphWriter.NTriplesWriter):
+        if auxiliary is not None:
+            collectAuxiliaryEntities(lei_data, auxiliary, chunksize)
+        #the rdflib graph holds all triples in memory anyway
+        if leis is not None:
+            lei_data = leiDictionary.decodeColumns(lei_data, leis, ['LEI'])
+
+        i = 0
+        for t in lei_data.itertuples():
+            #if LEI is nan we cant add any information
+            if pd.isnull(t.LEI):
+                continue
+            #create a node for this LEI
+            LEI = rdflib.URIRef(ns + 'LEI/' + getattr(t, 'LEI'))
+
+            #add for each predicate a triple, if it exists
+            for key in predicatesLEI.keys():
+                value = getattr(t, predicatesLEI[key]['colName'])
+                if not pd.isnull(value):
+                    #repeated objects share one interned term
+                    if(predicatesLEI[key]['asLiteral']):
+                        o = graphWriter.internLiteral(value)
+                    else:
+                        prefix = predicatesLEI[key]['prefix']
+                        o = graphWriter.internURI(ns + prefix, value)
+
+                    g.add( (LEI,predicatesLEI[key]['URIRef'],o) )
+        
+            #add sameAs predicate for LEI node
+            value = getattr(t, 'companyEntity')
+            if not pd.isnull(value):
+                o = graphWriter.internURI('', value)
+                g.add( (LEI, sameAs, o) )
+        
+            i+=1
+            if(i%250000 == 0):
+                print(i)
+    else:
+        #serialize the triples of each predicate column in one vectorized pass per chunk of rows
+        for start in range(0, len(lei_data), chunksize):
+            #if LEI is nan we cant add any information
+            chunk = lei_data.iloc[start:start+chunksize]
+            if auxiliary is not None:
+                auxiliary.add(chunk)
+            if leis is not None:
+                chunk = leiDictionary.decodeColumns(chunk, leis, ['LEI'])
+            chunk = chunk[chunk['LEI'].notna()]
+
+            #create a node for each LEI
+            LEIs = graphWriter.serializeURIColumn(chunk['LEI'], ns + 'LEI/')
+
+            #add for each predicate the triples of all rows where it exists
+            for key in predicatesLEI.keys():
+                predicate_dict = predicatesLEI[key]
+                g.addColumn(
+                    LEIs, predicate_dict['URIRef'], chunk[predicate_dict['colName']],
+                    predicate_dict['asLiteral'], ns + predicate_dict.get('prefix', '')
+                )
+
+            #add sameAs predicate for LEI nodes
+            g.addColumn(LEIs, sameAs, chunk['companyEntity'], False)
+
+class AuxiliaryEntities:
+    #collects the regions, cityIDs, combinations of cityID and label and the counts of the regions of each cityID
+    #of lei_data in one pass over its chunks, e.g. while the LEI triples are added
+    #the entities of the legal and the headquarters address are kept apart, so that the auxiliary triples are added
+    #in the same order as if all legal addresses came before all headquarters addresses
+    def __init__(self, memory_budget=2**30):
+        self.memory_budget = memory_budget
+        #dicts with None values are used as sets that keep the order of insertion
+        self.regions = ({}, {})
+        self.cityIDs = ({}, {})
+        self.cityID_labels = ({}, {})
+        self.cityID_region_counts = outOfCore.PairCounter(memory_budget)
+        self.rows = 0
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        for i, address in enumerate(['Entity_LegalAddress_', 'Entity_HeadquartersAddress_']):
+            for entities, col in [(self.regions[i], address + 'Region'), (self.cityIDs[i], address + 'CityID')]:
+                values = pd.unique(np.asarray(chunk[col], dtype=object))
+                entities.update(dict.fromkeys(values[pd.notna(values)]))
+
+            cityID_labels = chunk[[address + 'CityID', address + 'CityID_Label']].dropna().drop_duplicates()
+            self.cityID_labels[i].update(dict.fromkeys(zip(
+                cityID_labels[address + 'CityID'].values, cityID_labels[address + 'CityID_Label'].values
+            )))
+
+            self.cityID_region_counts.add(chunk[address + 'CityID'], chunk[address + 'Region'])
+
+    def update(self, other):
+        #add the entities collected by another AuxiliaryEntities, e.g. of a shard of lei_data
+        self.rows += other.rows
+        for own, others in [(self.regions, other.regions), (self.cityIDs, other.cityIDs),
+            (self.cityID_labels, other.cityID_labels)]:
+            for i in range(2):
+                own[i].update(others[i])
+
+        for counts in other.cityID_region_counts.counts():
+            self.cityID_region_counts.add(
+                counts.index.get_level_values(0), counts.index.get_level_values(1), counts.values
+            )
+
+    def __getstate__(self):
+        #the counts are sent as one Series instead of the spilled partitions, e.g. from a worker process
+        state = self.__dict__.copy()
+        counts = list(self.cityID_region_counts.counts())
+        state['cityID_region_counts'] = pd.concat(counts) if len(counts) > 0 else None
+        return state
+
+    def __setstate__(self, state):
+        counts = state['cityID_region_counts']
+        self.__dict__.update(state)
+        self.cityID_region_counts = outOfCore.PairCounter(self.memory_budget)
+        if counts is not None:
+            self.cityID_region_counts.add(
+                counts.index.get_level_values(0), counts.index.get_level_values(1), counts.values
+            )
+
+    def unique(self, entities):
+        #the entities of the legal addresses followed by the remaining entities of the headquarters addresses
+        return list(entities[0]) + [entity for entity in entities[1] if entity not in entities[0]]
+
+def collectAuxiliaryEntities(lei_data, auxiliary, chunksize=250000):
+    #collect the auxiliary entities of lei_data without adding the LEI triples
+    for start in range(0, len(lei_data), chunksize):
+        auxiliary.add(lei_data.iloc[start:start+chunksize])
+    return auxiliary
+
+def addAuxiliaryTriples(g, auxiliary):
+    #add the triples of the regions and cityIDs that were collected in auxiliary (an AuxiliaryEntities)
+
+    ##### add locatedIn to region #####
+    for region in auxiliary.unique(auxiliary.regions):
+        s = graphWriter.internURI(ns + 'region/', region)
+        #the first two letters of the region correspond to the country of the region
+        o = graphWriter.internURI(ns + 'country/', region[0:2])
+
+        g.add( (s, locatedIn, o) )
+
+    ##### add sameAs to cityID #####
+    for cityID in auxiliary.unique(auxiliary.cityIDs):
+        s = graphWriter.internURI(ns + 'cityID/', cityID)
+        o = rdflib.URIRef('http://www.wikidata.org/wiki/Q' + cityID)
+
+        g.add( (s, sameAs, o) )
+
+    ##### add label to cityID #####
+    for cityID, cityID_label in auxiliary.unique(auxiliary.cityID_labels):
+        s = graphWriter.internURI(ns + 'cityID/', cityID)
+        o = rdflib.Literal(cityID_label)
+
+        g.add( (s, label, o) )
+
+    ##### add locatedIn to cityID #####
+    #find for each cityID the region that has the most LEI entries
+    #this makes sure that each city is only located in a single region
+    cityID_regions = auxiliary.cityID_region_counts.majority()
+    auxiliary.cityID_region_counts.close()
+
+    for cityID, region in cityID_regions.items():
+        s = graphWriter.internURI(ns + 'cityID/', cityID)
+        o = graphWriter.internURI(ns + 'region/', region)
+
+        g.add( (s, locatedIn, o) )
+
+def addCountryTriples(g, additional_data):
+    for key, value_dict in add_country_data_dict.items():
+        data = additional_data[key]
+        value_name = value_dict['value_name']
+        predicate_URI = value_dict['predicate_URI']
+
+        p = rdflib.URIRef(predicate_URI)
+
+        for row in data.itertuples():
+            country = getattr(row, 'iso2')
+            value = getattr(row, value_name)
+
+            s = graphWriter.internURI(ns + 'country/', country)
+        
+            if key == 'df_countryEntities':
+                o = rdflib.URIRef(value)
+            else:
+                o = rdflib.Literal(value)
+
+            g.add( (s, p, o) )
+
+relationship_columns = ['Relationship_StartNode_NodeID', 'Relationship_EndNode_NodeID', 'Relationship_RelationshipType']
+
+def unknownRelationshipTypes(relationship_data):
+    #the number of relationships of each type that is not in relationshipTypePredicates
+    counts = relationship_data['Relationship_RelationshipType'].value_counts(sort=False)
+    counts = counts[(counts > 0).values & ~counts.index.isin(list(relationshipTypePredicates))]
+    return {str(relationshipType):int(count) for relationshipType, count in counts.items()}
+
+def addRelationshipTriples(g, relationship_data, chunksize=250000, leis=None):
+    #g is either a rdflib.Graph or a graphWriter.NTriplesWriter
+    #returns the number of skipped relationships of each unknown type
+    #if leis is given, the LEI columns hold the IDs of the dictionary leis (see leiDictionary.py), which are decoded
+    #for each chunk of rows
+    lei_columns = ['Relationship_StartNode_NodeID', 'Relationship_EndNode_NodeID']
+    if not isinstance(g, graphWriter.NTriplesWriter):
+        if leis is not None:
+            relationship_data = leiDictionary.decodeColumns(relationship_data, leis, lei_columns)
+        for t in relationship_data.itertuples():
+            #if startLEI, endLEI, or type is nan we cant add any information
+            if (pd.isnull(t.Relationship_StartNode_NodeID)
+            or pd.isnull(t.Relationship_EndNode_NodeID)
+            or pd.isnull(t.Relationship_RelationshipType)):
+                continue
+
+            p = relationshipTypePredicates.get(t.Relationship_RelationshipType)
+            if p is None:
+                continue
+
+            #create nodes
+            s = graphWriter.internURI(ns + 'LEI/', t.Relationship_StartNode_NodeID)
+            o = graphWriter.internURI(ns + 'LEI/', t.Relationship_EndNode_NodeID)
+
+            #add relationship
+            g.add( (s, p, o) )
+    else:
+        for start in range(0, len(relationship_data), chunksize):
+            #if startLEI, endLEI, or type is nan we cant add any information
+            chunk = relationship_data.iloc[start:start+chunksize][relationship_columns]
+            if leis is not None:
+                chunk = leiDictionary.decodeColumns(chunk, leis, lei_columns)
+            chunk = chunk.dropna()
+
+            #the serialized predicate of each type is looked up once per type instead of once per row,
+            #the last entry of the table is for the unknown types (code -1 of the categorical)
+            types = chunk['Relationship_RelationshipType'].astype('category')
+            table = np.array([
+                serializedRelationshipTypePredicates.get(relationshipType) for relationshipType in types.cat.categories
+            ] + [None], dtype=object)
+            predicates = table[types.cat.codes.values]
+            known = pd.notna(predicates)
+
+            chunk = chunk[known]
+            g.addLines(
+                graphWriter.serializeURIColumn(chunk['Relationship_StartNode_NodeID'], ns + 'LEI/'),
+                pd.Series(predicates[known], index=chunk.index),
+                graphWriter.serializeURIColumn(chunk['Relationship_EndNode_NodeID'], ns + 'LEI/')
+            )
+
+    return unknownRelationshipTypes(relationship_data)
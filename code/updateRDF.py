@@ -0,0 +1,261 @@
+import datetime
+import os
+
+import helpFunctions
+import graphWriter
+import tripleEmission
+import buildProfiler
+import buildCheckpoints
+import incrementalBuild
+import hierarchyIndex
+import leiDictionary
+import additionalDataStore
+import compressedSink
+
+#updates the graph of a previous build with GLEIF delta files instead of rebuilding it from the full golden copy
+#only the added, changed and retired LEIs and relationships are matched to wikidata cities and emitted as triples
+#the updated graph, an add/remove changeset and the state for the next update are stored in graph_storage_folder
+
+#specify paths
+#the build state is stored next to the graph by createRDF.py and by this script
+path_previous_build_state = '../data/graphData/2020-03-17_00:56:06_buildState.json'
+path_lei_delta = '../data/gleifData/20191009-1600-gleif-goldencopy-lei2-last8hours.csv'
+path_relationship_delta = '../data/gleifData/20191009-1600-gleif-goldencopy-rr-last8hours.csv'
+graph_storage_folder = '../data/graphData/'
+cache_folder = '../data/cache/'
+
+#LEIs with one of these registration statuses in the delta file are removed from the graph with their relationships
+#the full build keeps the LEIs of all statuses, e.g. ['RETIRED', 'ANNULLED', 'DUPLICATE', 'MERGED']
+retired_registration_statuses = []
+#relationships with one of these statuses in the delta file are removed from the graph, e.g. ['INACTIVE']
+retired_relationship_statuses = []
+
+#the index of the consolidation hierarchy is created again for the updated relationship data
+create_hierarchy_index = True
+
+n_workers = os.cpu_count()
+csv_engine = 'c'
+#number of threads that compress the graph file, which is compressed and split into parts like the previous graph
+compression_threads = n_workers
+
+date_and_time = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
+profiler = buildProfiler.BuildProfiler()
+
+state = buildCheckpoints.loadBuildState(path_previous_build_state)
+if state.get('subset') is not None:
+    #the delta files are not filtered, a subset build is built again with createRDF.py instead
+    raise ValueError(path_previous_build_state + ' is the state of a subset build, which cannot be updated')
+checkpoints = buildCheckpoints.CheckpointStore(state['checkpoint_folder'])
+output_format = state['output_format']
+graph_name = tripleEmission.ns + 'taxGraph' if output_format == 'nq' else None
+extension = '.' + output_format
+max_distance = state['max_distance']
+sink_options = {
+    'compression':state.get('output_compression'), 'part_size':state.get('output_part_size'),
+    'n_threads':compression_threads
+}
+parts = {name:(name, key, part_extension) for name, key, part_extension in state['parts']}
+#the updated parts are compressed like the graph, as in createRDF.py
+part_extension = extension + compressedSink.extensions[sink_options['compression']]
+
+#the keys of the updated checkpoints are derived from the keys of the previous build and the delta files
+lei_delta_hash = checkpoints.fileHash(path_lei_delta)
+relationship_delta_hash = checkpoints.fileHash(path_relationship_delta)
+lei_data_key = checkpoints.key(
+    'updateLEIData', state['lei_data'][1], lei_delta_hash, retired=retired_registration_statuses
+)
+relationship_data_key = checkpoints.key(
+    'updateRelationshipData', state['relationship_data'][1], relationship_delta_hash, lei_delta_hash,
+    retired=retired_relationship_statuses, retired_leis=retired_registration_statuses
+)
+
+#load the data of the previous build and the delta files
+profiler.start('loadData')
+lei_data = checkpoints.loadFrame(*state['lei_data'])
+relationship_data = checkpoints.loadFrame(*state['relationship_data'])
+
+delta_lei_data = helpFunctions.loadLEIData(path_lei_delta, engine=csv_engine)
+registration_status = incrementalBuild.loadRegistrationStatus(path_lei_delta)
+removed_leis = registration_status.index[registration_status.isin(retired_registration_statuses).values]
+#the status of the delta relationships is only needed to find the retired relationships
+delta_relationship_data = helpFunctions.loadRelationshipData(
+    path_relationship_delta, helpFunctions.relationship_data_columns + ['Relationship.RelationshipStatus'],
+    engine=csv_engine
+)
+
+additional_data = additionalDataStore.openAdditionalData(state['path_additonal_data'])
+profiler.stop(rows_in=len(delta_lei_data) + len(delta_relationship_data))
+
+#match the cities of the added and changed LEIs
+profiler.start('updateLEIData')
+wikidata_cities_hash = checkpoints.fileHash(state['path_wikidata_cities'])
+if cache_folder is not None:
+    wikidata_city_index_path = helpFunctions.wikidataCityIndexPath(cache_folder, wikidata_cities_hash)
+    city_match_cache_path = helpFunctions.cityMatchCachePath(cache_folder, wikidata_cities_hash, max_distance)
+    city_match_cache = helpFunctions.loadCityMatchCache(city_match_cache_path)
+else:
+    wikidata_city_index_path = None
+    city_match_cache = {}
+
+if wikidata_city_index_path is not None and os.path.exists(wikidata_city_index_path):
+    wikidataCityDict = helpFunctions.loadWikidataCityIndex(wikidata_city_index_path)
+else:
+    wikidataCityDict = helpFunctions.createWikidataCityDict(state['path_wikidata_cities'])
+    if wikidata_city_index_path is not None:
+        helpFunctions.saveWikidataCityIndex(wikidataCityDict, wikidata_city_index_path)
+
+lei_data, changed_lei_data, replaced_leis = incrementalBuild.updateLEIData(
+    lei_data, delta_lei_data, removed_leis, wikidataCityDict, max_distance, additional_data,
+    city_match_cache=city_match_cache, n_workers=n_workers, index_path=wikidata_city_index_path
+)
+if cache_folder is not None:
+    helpFunctions.saveCityMatchCache(city_match_cache, city_match_cache_path)
+checkpoints.saveFrame(lei_data, 'mergeCompanyEntities', lei_data_key, delta=path_lei_delta)
+profiler.stop(rows_in=len(changed_lei_data))
+print(str(len(replaced_leis)) + ' LEIs changed')
+
+profiler.start('updateRelationshipData')
+relationship_data, replaced_start_leis = incrementalBuild.updateRelationshipData(
+    relationship_data, delta_relationship_data, retired_relationship_statuses, removed_leis
+)
+checkpoints.saveFrame(relationship_data, 'loadRelationshipData', relationship_data_key, delta=path_relationship_delta)
+profiler.stop(rows_in=len(replaced_start_leis))
+print(str(len(replaced_start_leis)) + ' start LEIs of relationships changed')
+for relationship_type, count in tripleEmission.unknownRelationshipTypes(delta_relationship_data).items():
+    print(str(count) + ' relationships of the unknown type ' + relationship_type + ' are skipped')
+
+if create_hierarchy_index:
+    profiler.start('hierarchyIndex')
+    #the index refers to a dictionary of the LEIs of the update, which is stored next to it as in createRDF.py
+    relationship_lei_columns = ['Relationship_StartNode_NodeID', 'Relationship_EndNode_NodeID']
+    lei_dictionary_path = graph_storage_folder + date_and_time + '_leiDictionary.npy'
+    leiDictionary.saveLEIDictionary(
+        leiDictionary.createLEIDictionary(
+            [lei_data['LEI']] + [relationship_data[col] for col in relationship_lei_columns]
+        ),
+        lei_dictionary_path
+    )
+    leis = leiDictionary.loadLEIDictionary(lei_dictionary_path)
+    hierarchyIndex.saveHierarchyIndex(
+        hierarchyIndex.createHierarchyIndex(
+            leiDictionary.encodeColumns(lei_data, leis, ['LEI']),
+            leiDictionary.encodeColumns(relationship_data, leis, relationship_lei_columns), leis
+        ),
+        graph_storage_folder + date_and_time + '_hierarchyIndex', lei_dictionary_path
+    )
+    profiler.stop(rows_in=len(relationship_data))
+
+#replace the triples of the changed LEIs and relationships in the graph parts
+#the changeset is the diff between the replaced and the emitted triples of each part, see graphDiff.py
+changeset = {
+    name:open(graph_storage_folder + date_and_time + '_changeset_' + name + extension, 'wb', buffering=2**20)
+    for name in ['added', 'removed']
+}
+n_added = 0
+n_removed = 0
+new_parts = {}
+
+profiler.start('leiTriples')
+key = checkpoints.key(
+    'leiTriples', lei_data_key, output_format=output_format, compression=sink_options['compression']
+)
+emitted_path = checkpoints.partPath('leiTriples', key, '.emit')
+replaced_path = checkpoints.partPath('leiTriples', key, '.replaced')
+triples = incrementalBuild.emitTriples(
+    emitted_path, graph_name, lambda g: tripleEmission.addLEITriples(g, changed_lei_data)
+)
+incrementalBuild.updatePart(
+    checkpoints.path(*parts['leiTriples']),
+    checkpoints.openPart('leiTriples', key, part_extension, sink_options['compression'], compression_threads),
+    incrementalBuild.serializedLEIs(replaced_leis), emitted_path, replaced_path
+)
+added, removed = incrementalBuild.diffParts(replaced_path, emitted_path, changeset, checkpoints.folder)
+os.remove(emitted_path)
+os.remove(replaced_path)
+checkpoints.commitPart('leiTriples', key, part_extension, added=added, removed=removed)
+new_parts['leiTriples'] = ('leiTriples', key, part_extension)
+n_added += added
+n_removed += removed
+profiler.stop(rows_in=len(changed_lei_data), triples_out=triples)
+
+#the regions and cityIDs and the region of each cityID depend on all LEIs and are emitted again
+profiler.start('auxiliaryTriples')
+key = checkpoints.key(
+    'auxiliaryTriples', lei_data_key, output_format=output_format, compression=sink_options['compression']
+)
+g = graphWriter.NTriplesWriter(
+    checkpoints.partPath('auxiliaryTriples', key, part_extension), graph_name=graph_name,
+    output=checkpoints.openPart(
+        'auxiliaryTriples', key, part_extension, sink_options['compression'], compression_threads
+    )
+)
+tripleEmission.addAuxiliaryTriples(
+    g, tripleEmission.collectAuxiliaryEntities(lei_data, tripleEmission.AuxiliaryEntities())
+)
+g.close()
+checkpoints.commitPart('auxiliaryTriples', key, part_extension, triples=len(g))
+new_parts['auxiliaryTriples'] = ('auxiliaryTriples', key, part_extension)
+added, removed = incrementalBuild.diffParts(
+    checkpoints.path(*parts['auxiliaryTriples']), checkpoints.path(*new_parts['auxiliaryTriples']), changeset,
+    checkpoints.folder
+)
+n_added += added
+n_removed += removed
+profiler.stop(rows_in=len(lei_data), triples_out=len(g))
+
+#the country data does not change
+new_parts['countryTriples'] = parts['countryTriples']
+
+profiler.start('relationshipTriples')
+key = checkpoints.key(
+    'relationshipTriples', relationship_data_key, output_format=output_format,
+    compression=sink_options['compression']
+)
+changed_relationship_data = relationship_data[
+    relationship_data['Relationship_StartNode_NodeID'].isin(replaced_start_leis)
+]
+emitted_path = checkpoints.partPath('relationshipTriples', key, '.emit')
+replaced_path = checkpoints.partPath('relationshipTriples', key, '.replaced')
+triples = incrementalBuild.emitTriples(
+    emitted_path, graph_name, lambda g: tripleEmission.addRelationshipTriples(g, changed_relationship_data)
+)
+incrementalBuild.updatePart(
+    checkpoints.path(*parts['relationshipTriples']),
+    checkpoints.openPart(
+        'relationshipTriples', key, part_extension, sink_options['compression'], compression_threads
+    ),
+    incrementalBuild.serializedLEIs(replaced_start_leis), emitted_path, replaced_path
+)
+added, removed = incrementalBuild.diffParts(replaced_path, emitted_path, changeset, checkpoints.folder)
+os.remove(emitted_path)
+os.remove(replaced_path)
+checkpoints.commitPart('relationshipTriples', key, part_extension, added=added, removed=removed)
+new_parts['relationshipTriples'] = ('relationshipTriples', key, part_extension)
+n_added += added
+n_removed += removed
+profiler.stop(rows_in=len(changed_relationship_data), triples_out=triples)
+
+for output in changeset.values():
+    output.close()
+
+#save the updated graph
+profiler.start('serialize')
+graph_storage_path = graph_storage_folder + date_and_time + '_taxGraph' + extension
+graph_storage_path += compressedSink.extensions[sink_options['compression']]
+part_list = [new_parts[name] for name, _, _ in state['parts']]
+with compressedSink.openSink(graph_storage_path, **sink_options) as output:
+    checkpoints.copyParts(part_list, output)
+profiler.stop()
+print(str(n_added) + ' triples added, ' + str(n_removed) + ' triples removed')
+
+#save the state of the update for the next update
+state.update({
+    'graph_path':graph_storage_path,
+    'lei_data':('mergeCompanyEntities', lei_data_key),
+    'relationship_data':('loadRelationshipData', relationship_data_key),
+    'parts':part_list,
+    'previous_build_state':path_previous_build_state
+})
+buildCheckpoints.saveBuildState(graph_storage_folder + date_and_time + '_buildState.json', state)
+
+profiler.saveReport(graph_storage_folder + date_and_time + '_updateReport.json')